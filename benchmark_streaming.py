@@ -0,0 +1,199 @@
+""" This Python module benchmarks how fast jobs can be sent to GRBL. Synthetic
+jobs are sent to the simulated controller (see grbl_simulator.py) with each
+sending mode, and the results are written out as JSON so they can be
+compared between releases """
+
+# imports
+import asyncio
+import contextlib
+import io
+import json
+import platform
+import time
+from collections import deque
+import numpy as np
+import serial
+from grbl_async import AsyncGrbl
+from grbl_simulator import GrblSimulator
+import grbl_controller
+
+# constants
+LINE_COUNTS     = (100, 1000, 10000, 100000) # synthetic job sizes
+MODES           = ("ping-pong", "character-counting", "asyncio")
+PING_PONG_MAX   = 1000 # longest job sent one line at a time (it waits for Idle
+                       # after every line, so bigger jobs take hours)
+SPEED           = 100 # simulated gantry runs this many times faster than real
+                      # time, so the sender is what gets measured
+SEGMENT         = 0.5 # length of every synthetic move (in mm)
+FEEDRATE        = 3000 # feedrate of the synthetic moves (in mm/min)
+RESULTS_FILE    = "benchmark_results.json"
+
+############################## Helper Functions ###############################
+def synthetic_job(lines: int) -> list:
+    """ Short G1 moves zigzagging over a 50 mm wide area, the worst case for a
+    sender as each line is over quickly
+    parameters:
+        lines: number of GCODE lines
+    returns:
+        commands: GCODE commands, lines long
+    """
+    steps = np.arange(1, lines)
+    per_row = int(50 / SEGMENT)
+    row = steps // per_row
+    column = steps % per_row
+    x = np.where(row % 2 == 0, column, per_row - column) * SEGMENT
+    y = row * SEGMENT
+
+    return [grbl_controller.writer.positioning('absolute')] + [
+        f'G1 X{x_k:.3f} Y{y_k:.3f} F{FEEDRATE}' for x_k, y_k in zip(x, y)]
+
+def _summary(values: list) -> dict:
+    """ mean, p50, p95 and max of a list of times, in ms """
+
+    if not values:
+        return {}
+    values = np.array(values) * 1000
+    return {"mean": float(values.mean()),
+            "p50": float(np.percentile(values, 50)),
+            "p95": float(np.percentile(values, 95)),
+            "max": float(values.max())}
+
+class TimedSerial:
+    """ Wraps an open serial port and times every line from when it is
+    written to when GRBL answers it. Answers come back in the order lines
+    were sent, so they are matched first in, first out """
+
+    def __init__(self, ser):
+        self.ser = ser
+        self.sent = deque() # write time of every unanswered line
+        self.latencies = []
+        self.first_write = None
+        self.last_answer = None
+        self.bytes = 0
+
+    def __getattr__(self, name):
+        return getattr(self.ser, name)
+
+    @property
+    def timeout(self):
+        return self.ser.timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self.ser.timeout = value
+
+    def write(self, data: bytes):
+        now = time.perf_counter()
+        lines = data.count(b'\n')
+        if lines:
+            if self.first_write is None:
+                self.first_write = now
+            self.sent.extend([now] * lines)
+            self.bytes += len(data)
+        return self.ser.write(data)
+
+    def readline(self) -> bytes:
+        line = self.ser.readline()
+        if line.startswith((b'ok', b'error')) and self.sent:
+            self.last_answer = time.perf_counter()
+            self.latencies.append(self.last_answer - self.sent.popleft())
+        return line
+
+############################### Sending Modes #################################
+def _send_ping_pong(ser, commands: list) -> int:
+    grbl_controller.send_commands(ser, commands, streaming=False)
+    return 0
+
+def _send_character_counting(ser, commands: list) -> int:
+    grbl_controller.send_commands(ser, commands, streaming=True)
+    return 0
+
+def _send_asyncio(ser, commands: list) -> int:
+    async def send():
+        async with AsyncGrbl(ser) as grbl:
+            await grbl.command("$X")
+            errors = await grbl.stream(commands)
+            await grbl.sync()
+        return len(errors)
+
+    return asyncio.run(send())
+
+SENDERS = {
+    "ping-pong": _send_ping_pong,
+    "character-counting": _send_character_counting,
+    "asyncio": _send_asyncio,
+}
+
+################################# Benchmark ###################################
+def run_once(mode: str, commands: list, speed: float = SPEED) -> dict:
+    """ Sends one job to a fresh simulator
+    parameters:
+        mode: one of MODES
+        commands: GCODE commands to send
+        speed: simulator speed up
+    returns:
+        result: timings and simulator counters for the run
+    """
+    with GrblSimulator(speed=speed) as simulator:
+        ser = TimedSerial(serial.Serial(simulator.port, grbl_controller.BAUDRATE))
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            errors = SENDERS[mode](ser, commands)
+        wall = time.perf_counter() - start
+        ser.close()
+        stats = dict(simulator.stats)
+
+    sending = (ser.last_answer or 0) - (ser.first_write or 0)
+    machine = wall * speed
+    return {
+        "mode": mode,
+        "lines": len(commands),
+        "wall_time": wall,
+        "commands_per_s": len(commands) / sending if sending > 0 else None,
+        "bytes_per_s": ser.bytes / sending if sending > 0 else None,
+        "ack_latency_ms": _summary(ser.latencies),
+        "planner": {
+            "mean_blocks": stats["occupancy"] / machine if machine else 0,
+            "busy_fraction": stats["moving"] / machine if machine else 0,
+            "max_rx_bytes": stats["max_rx"],
+            "rx_overflows": stats["overflows"],
+        },
+        "errors": errors,
+    }
+
+def run_benchmark(line_counts=LINE_COUNTS, modes=MODES,
+                  speed: float = SPEED) -> dict:
+    """ Runs every mode on every job size. Jobs longer than PING_PONG_MAX
+    are not sent with ping-pong
+    returns:
+        report: machine/run details and one result per run
+    """
+    results = []
+    for lines in line_counts:
+        commands = synthetic_job(lines)
+        for mode in modes:
+            if mode == "ping-pong" and lines > PING_PONG_MAX:
+                continue
+            result = run_once(mode, commands, speed)
+            print(f"{mode:>20} {lines:>7} lines: {result['wall_time']:8.2f} s, "
+                  f"{result['commands_per_s'] or 0:9.1f} lines/s")
+            results.append(result)
+
+    return {
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "speed": speed,
+        "segment_mm": SEGMENT,
+        "feedrate": FEEDRATE,
+        "results": results,
+    }
+
+def main():
+    report = run_benchmark()
+    with open(RESULTS_FILE, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {RESULTS_FILE}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+import json
+import os
+import cv2
+import numpy as np
+from old_330_code.config import hole_pitch
+
+SCALE = hole_pitch  # distance between holes (in mm), the same one grbl_controller uses
+CALIBRATION_FILE = "calibration.json"  # calibrations kept per camera and fixture
+RANSAC_TOLERANCE = 0.25  # furthest a hole may sit from the homography (in pitches)
+
+
+class BoardCalibration:
+    """
+    Maps image pixels to protoboard holes and machine coordinates through
+    a full homography, so a skewed or tilted board still lands every joint
+    on the right hole. Holes are counted from 0 at the top-left corner hole;
+    hole numbers (as written to board_data.json) are 1-based, and the
+    machine position of a hole is its number times scale.
+
+    The pixel -> hole homography and the hole -> machine scaling are
+    composed into single 3 x 3 matrices, so any number of points is mapped
+    with one matrix product.
+    """
+
+    def __init__(self, homography, rows, cols, scale=SCALE):
+        """
+        Parameters:
+            homography (array like): 3 x 3 pixel -> hole matrix.
+            rows, cols (int): Holes in the board.
+            scale (float): Distance between holes (in mm).
+        """
+        self.homography = np.asarray(homography, dtype=float)
+        self.rows = int(rows)
+        self.cols = int(cols)
+        self.scale = float(scale)
+
+        # hole -> hole number (1-based) -> mm
+        to_machine = np.array([[scale, 0, scale], [0, scale, scale], [0, 0, 1]])
+        self.machine_matrix = to_machine @ self.homography
+        self.inverse = np.linalg.inv(self.homography)
+
+    @classmethod
+    def from_corners(cls, corners, rows, cols, scale=SCALE):
+        """
+        Calibration from the centres of the four corner holes.
+
+        Parameters:
+            corners (list): (x, y) of the top-left, top-right, bottom-right
+                and bottom-left holes, in pixels.
+            rows, cols (int): Holes in the board.
+        """
+        holes = np.float32([[0, 0], [cols - 1, 0], [cols - 1, rows - 1], [0, rows - 1]])
+        homography = cv2.getPerspectiveTransform(np.float32(corners), holes)
+        return cls(homography, rows, cols, scale)
+
+    @classmethod
+    def from_lattice(cls, lattice, scale=SCALE):
+        """
+        Calibration from a detected hole lattice (see core/hole_lattice.py).
+        The homography is fitted (RANSAC) to every hole the lattice was
+        fitted to, which also captures the perspective the lattice's evenly
+        spaced rows cannot. Without enough holes it falls back to the
+        lattice's corners.
+
+        Parameters:
+            lattice (HoleLattice): Detected grid.
+        """
+        points = lattice.points
+        if len(points) >= 4:
+            holes = _lattice_indices(lattice, points)
+            on_board = ((holes >= 0) & (holes < [lattice.cols, lattice.rows])).all(axis=1)
+            if on_board.sum() >= 4:
+                homography, _ = cv2.findHomography(
+                    np.float32(points[on_board]), np.float32(holes[on_board]),
+                    cv2.RANSAC, RANSAC_TOLERANCE)
+                if homography is not None:
+                    return cls(homography, lattice.rows, lattice.cols, scale)
+
+        return cls.from_corners(lattice.corners(), lattice.rows, lattice.cols, scale)
+
+    def to_holes(self, points):
+        """
+        Hole positions of pixels (fractional, 0-based).
+
+        Parameters:
+            points (array like): N x 2 pixel positions (x, y).
+
+        Returns:
+            holes (numpy array): N x 2 (col, row).
+        """
+        return _transform(self.homography, points)
+
+    def hole_numbers(self, points):
+        """Nearest hole number (1-based col, row) of each pixel, as N x 2 ints."""
+        return np.rint(self.to_holes(points)).astype(int) + 1
+
+    def to_machine(self, points):
+        """Machine position (x, y in mm) of each pixel, as N x 2."""
+        return _transform(self.machine_matrix, points)
+
+    def to_pixels(self, holes):
+        """Pixel positions of holes (0-based col, row), as N x 2."""
+        return _transform(self.inverse, holes)
+
+    def corners(self):
+        """Pixel positions of the top-left, top-right, bottom-right and
+        bottom-left holes."""
+        holes = [[0, 0], [self.cols - 1, 0], [self.cols - 1, self.rows - 1], [0, self.rows - 1]]
+        return self.to_pixels(holes).tolist()
+
+    def to_dict(self):
+        return {"homography": self.homography.tolist(), "rows": self.rows,
+                "cols": self.cols, "scale": self.scale}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["homography"], data["rows"], data["cols"], data["scale"])
+
+
+def _transform(matrix, points):
+    """Applies a 3 x 3 projective matrix to N x 2 points in one pass."""
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    mapped = points @ matrix[:, :2].T + matrix[:, 2]
+    return mapped[:, :2] / mapped[:, 2:]
+
+
+def _lattice_indices(lattice, points):
+    """Integer (col, row) of the lattice point nearest each pixel."""
+    basis = np.array([lattice.col_step, lattice.row_step])
+    return np.rint((np.asarray(points, dtype=float) - lattice.origin) @ np.linalg.inv(basis))
+
+
+class CalibrationCache:
+    """
+    Calibrations kept per camera and fixture. While neither moves, every
+    board placed in the fixture sits in the same place in the image, so
+    the calibration is computed once and reused for every board. Saved to
+    a JSON file so it survives restarts. The camera name should include
+    its resolution, as a calibration only holds for the image size it was
+    made at.
+    """
+
+    def __init__(self, path=CALIBRATION_FILE):
+        self.path = path
+        self._calibrations = None  # loaded on first use
+
+    def get(self, camera, fixture):
+        """
+        Returns:
+            calibration (BoardCalibration): Saved calibration, or None.
+        """
+        data = self._load().get(self._key(camera, fixture))
+        return None if data is None else BoardCalibration.from_dict(data)
+
+    def put(self, camera, fixture, calibration):
+        self._load()[self._key(camera, fixture)] = calibration.to_dict()
+        self._save()
+
+    def remove(self, camera, fixture):
+        """Forgets a calibration, e.g. after the camera was moved."""
+        if self._load().pop(self._key(camera, fixture), None) is not None:
+            self._save()
+
+    def _key(self, camera, fixture):
+        return f"{camera}/{fixture}"
+
+    def _load(self):
+        if self._calibrations is None:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._calibrations = json.load(f)
+            except (OSError, ValueError):
+                self._calibrations = {}
+        return self._calibrations
+
+    def _save(self):
+        # write to a temporary file first so a crash never leaves a partly
+        # written file behind
+        temporary = self.path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(self._calibrations, f, indent=2)
+        os.replace(temporary, self.path)
@@ -0,0 +1,213 @@
+import glob
+import os
+import threading
+import time
+import cv2
+import numpy as np
+
+RING_SIZE = 4  # preallocated frames (the UI holds one, the grabber writes another)
+SOURCE_FPS = 30  # rate a video file or image directory is played back at
+IMAGE_TYPES = ("*.png", "*.jpg", "*.jpeg", "*.bmp")
+
+
+class ImageDirectorySource:
+    """
+    Stand-in camera that plays the images in a directory in name order,
+    looping, so capture can be tested without hardware.
+    """
+
+    def __init__(self, directory):
+        self.paths = sorted(path for pattern in IMAGE_TYPES
+                            for path in glob.glob(os.path.join(directory, pattern)))
+        self.next = 0
+
+    def isOpened(self):
+        return bool(self.paths)
+
+    def read(self):
+        frame = cv2.imread(self.paths[self.next])
+        self.next = (self.next + 1) % len(self.paths)
+        return frame is not None, frame
+
+    def release(self):
+        self.paths = []
+
+
+def open_source(source):
+    """
+    Opens a frame source.
+
+    Parameters:
+        source: Camera index, video file or directory of images.
+
+    Returns:
+        source: Object with cv2.VideoCapture's read/isOpened/release.
+        live (bool): False for files, which are played back at SOURCE_FPS.
+    """
+    if isinstance(source, str) and os.path.isdir(source):
+        return ImageDirectorySource(source), False
+    return cv2.VideoCapture(source), not isinstance(source, str)
+
+
+class CameraCapture:
+    """
+    Grabs frames on a background thread into a ring of preallocated RGB
+    NumPy frames, so capturing never allocates per frame. The UI takes the
+    latest frame as a QImage that wraps the ring slot itself (no copy);
+    that slot is held until the UI asks for the next frame, and the
+    grabber only ever writes into slots that are neither held nor the
+    latest.
+    """
+
+    def __init__(self, source=0, slots=RING_SIZE, fps=SOURCE_FPS):
+        """
+        Parameters:
+            source: Camera index, video file or directory of images.
+            slots (int): Frames in the ring (at least 3).
+            fps (float): Playback rate of file sources.
+        """
+        self.source = source
+        self.slots = max(3, slots)
+        self.fps = fps
+
+        self.ring = None  # slots x height x width x 3, allocated on the first frame
+        self.frame_number = 0  # frames grabbed so far
+        self.timestamps = np.zeros(self.slots)
+        self.dropped = 0  # frames that failed to read
+
+        self._latest = -1  # slot of the newest frame
+        self._held = -1  # slot the UI is looking at
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._capture = None
+        self._scratch = None  # BGR frame as read, converted into a slot
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """
+        Opens the source and starts grabbing.
+
+        Returns:
+            opened (bool): False if the source could not be opened.
+        """
+        if self.running:
+            return True
+
+        self._capture, live = open_source(self.source)
+        if not self._capture.isOpened():
+            self._capture.release()
+            return False
+
+        # forget the frames of the last run, so a restarted capture never
+        # shows a stale frame, and the new source may have another size
+        with self._lock:
+            self.ring = None
+            self._latest = -1
+            self._held = -1
+        self._scratch = None
+        self.frame_number = 0
+        self.timestamps[:] = 0
+        self.dropped = 0
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(live,), daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._capture is not None:
+            self._capture.release()
+            self._capture = None
+
+    def wait_for_frame(self, timeout=2.0):
+        """Waits until at least one frame has been grabbed."""
+        deadline = time.monotonic() + timeout
+        while self._latest < 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return self._latest >= 0
+
+    def latest_frame(self):
+        """
+        Holds the newest frame for the caller until the next call.
+
+        Returns:
+            frame (numpy array): H x W x 3 RGB view of the ring slot (not a
+                copy, so copy it to keep it past the next call), or None.
+        """
+        with self._lock:
+            if self._latest < 0:
+                return None
+            self._held = self._latest
+            return self.ring[self._held]
+
+    def latest_qimage(self):
+        """
+        The newest frame as a QImage sharing the ring slot's memory. Valid
+        until the next call; QPixmap.fromImage or QImage.copy it to keep it.
+        """
+        from PyQt6.QtGui import QImage
+
+        frame = self.latest_frame()
+        if frame is None:
+            return None
+        height, width, _ = frame.shape
+        return QImage(frame.data, width, height, frame.strides[0], QImage.Format.Format_RGB888)
+
+    def snapshot(self):
+        """A copy of the newest frame, e.g. to calibrate a board from."""
+        frame = self.latest_frame()
+        return None if frame is None else frame.copy()
+
+    def _free_slot(self):
+        with self._lock:
+            busy = (self._latest, self._held)
+        return next(slot for slot in range(self.slots) if slot not in busy)
+
+    def _run(self, live):
+        period = 0 if live or not self.fps else 1 / self.fps
+        next_frame = time.monotonic()
+
+        while not self._stop.is_set():
+            ok, frame = self._capture.read(self._scratch) if live else self._capture.read()
+            if not ok and not live and isinstance(self._capture, cv2.VideoCapture):
+                # loop a video file back to its start
+                self._capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                ok, frame = self._capture.read()
+            if not ok:
+                self.dropped += 1
+                self._stop.wait(0.01)
+                continue
+
+            if self.ring is None:
+                self.ring = np.empty((self.slots,) + frame.shape, dtype=np.uint8)
+            if live:
+                self._scratch = frame  # read straight into it next time
+
+            slot = self._free_slot()
+            if frame.shape != self.ring.shape[1:]:
+                frame = cv2.resize(frame, self.ring.shape[2:0:-1])
+            cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=self.ring[slot])
+            self.timestamps[slot] = time.monotonic()
+
+            with self._lock:
+                self._latest = slot
+                self.frame_number += 1
+
+            if period:
+                next_frame += period
+                self._stop.wait(max(0.0, next_frame - time.monotonic()))
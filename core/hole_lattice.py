@@ -0,0 +1,238 @@
+import time
+import cv2
+import numpy as np
+from core.test_opencv import find_white_circle_centroids
+
+DETECT_SIZE = 1024  # longest side the image is shrunk to before detecting (in pixels)
+NEIGHBOURS = 4  # nearest holes looked at around each sampled hole
+SAMPLES = 256  # holes sampled to measure the pitch and rotation
+INLIER_TOLERANCE = 0.3  # furthest a hole may sit from its lattice point (in pitches)
+MIN_HOLES = 12  # fewest holes a lattice is fitted to
+MIN_LINE_FILL = 0.2  # rows/columns with fewer holes than this fraction of the fullest are cut off
+MAX_GAP = 2  # emptier rows/columns bridged inside the board
+GROW_START = 4  # first fit uses the holes this close to the middle (in pitches)
+
+
+class HoleLattice:
+    """
+    Protoboard hole grid in image pixels: hole (col, row) sits at
+    origin + col * col_step + row * row_step, for 0 <= col < cols and
+    0 <= row < rows. The steps are full vectors, so a rotated or slightly
+    skewed board is described exactly.
+    """
+
+    def __init__(self, origin, col_step, row_step, rows, cols, points=None):
+        self.origin = np.asarray(origin, dtype=float)
+        self.col_step = np.asarray(col_step, dtype=float)
+        self.row_step = np.asarray(row_step, dtype=float)
+        self.rows = int(rows)
+        self.cols = int(cols)
+        # detected hole centres the lattice was fitted to
+        self.points = np.empty((0, 2)) if points is None else np.asarray(points, dtype=float)
+
+    @property
+    def holes(self):
+        """Number of detected holes the lattice was fitted to."""
+        return len(self.points)
+
+    @property
+    def pitch(self):
+        """Mean distance between neighbouring holes (in pixels)."""
+        return float((np.linalg.norm(self.col_step) + np.linalg.norm(self.row_step)) / 2)
+
+    @property
+    def rotation(self):
+        """Angle of the rows from the image x axis (in degrees)."""
+        return float(np.degrees(np.arctan2(self.col_step[1], self.col_step[0])))
+
+    def to_pixels(self, cols, rows):
+        """
+        Pixel positions of holes.
+
+        Parameters:
+            cols, rows (array like): Hole indices, any matching shapes.
+
+        Returns:
+            points (numpy array): (..., 2) pixel positions (x, y).
+        """
+        cols = np.asarray(cols, dtype=float)[..., None]
+        rows = np.asarray(rows, dtype=float)[..., None]
+        return self.origin + cols * self.col_step + rows * self.row_step
+
+    def corners(self):
+        """
+        Centres of the corner holes, ordered top-left, top-right,
+        bottom-right, bottom-left (the order corners are clicked in).
+        """
+        cols = [0, self.cols - 1, self.cols - 1, 0]
+        rows = [0, 0, self.rows - 1, self.rows - 1]
+        return self.to_pixels(cols, rows).tolist()
+
+    def scaled(self, factor):
+        """Same lattice for an image resized by factor."""
+        return HoleLattice(self.origin * factor, self.col_step * factor,
+                           self.row_step * factor, self.rows, self.cols,
+                           self.points * factor)
+
+
+def _pitch_and_rotation(points):
+    """
+    Measures hole spacing and grid angle from the vectors between sampled
+    holes and their nearest neighbours. Angles are folded to (-45, 45]
+    degrees by averaging on 4 * angle, as a square grid looks the same
+    every 90 degrees.
+
+    Returns:
+        pitch (float): Median nearest neighbour distance (in pixels).
+        angle (float): Grid rotation (in radians).
+    """
+    rng = np.random.default_rng(0)
+    sample = points[rng.choice(len(points), min(SAMPLES, len(points)), replace=False)]
+
+    # distances from every sampled hole to every hole
+    offsets = points[None, :, :] - sample[:, None, :]
+    distances = np.hypot(offsets[..., 0], offsets[..., 1])
+    k = min(NEIGHBOURS + 1, len(points))
+    nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    vectors = np.take_along_axis(offsets, nearest[..., None], axis=1).reshape(-1, 2)
+    lengths = np.hypot(vectors[:, 0], vectors[:, 1])
+
+    pitch = float(np.median(lengths[lengths > 0].reshape(len(sample), -1).min(axis=1)))
+
+    # only vectors to direct neighbours carry the grid angle
+    direct = np.abs(lengths - pitch) < INLIER_TOLERANCE * pitch
+    angles = np.arctan2(vectors[direct, 1], vectors[direct, 0])
+    angle = float(np.angle(np.exp(4j * angles).mean()) / 4)
+    return pitch, angle
+
+
+def _line_range(indices):
+    """
+    Extent of the board along one grid axis: the run of lines holding at
+    least MIN_LINE_FILL of the fullest line's holes with the most holes in
+    it. Gaps of up to MAX_GAP emptier lines (e.g. under a wire) are bridged,
+    so only stray detections well off the board are cut off.
+
+    Returns:
+        first, last (int): Index of the first line and one past the last.
+    """
+    first = indices.min()
+    counts = np.bincount(indices - first)
+    full = np.flatnonzero(counts >= max(2, MIN_LINE_FILL * counts.max()))
+
+    # split the full lines wherever the gap between them is too wide
+    runs = np.split(full, np.flatnonzero(np.diff(full) > MAX_GAP + 1) + 1)
+    best = max(runs, key=lambda run: counts[run[0]:run[-1] + 1].sum())
+    return first + best[0], first + best[-1] + 1
+
+
+def fit_lattice(points, iterations=2):
+    """
+    Fits a hole grid to detected hole centres. Pitch and rotation come from
+    nearest neighbour vectors. Holes are then given integer grid indices and
+    the grid is refitted by least squares to the holes within
+    INLIER_TOLERANCE of their lattice point, so missing holes, wires and
+    other blobs do not pull it off. The fit starts from the holes near the
+    middle and grows outwards, so a slightly wrong first pitch cannot
+    misnumber holes far from the start.
+
+    Parameters:
+        points (numpy array): N x 2 hole centres (x, y) in pixels.
+        iterations (int): Refits once every hole is in reach.
+
+    Returns:
+        lattice (HoleLattice): Fitted grid, or None if too few holes agree
+            or they do not span at least two rows and two columns.
+    """
+    points = np.asarray(points, dtype=float)
+    if len(points) < MIN_HOLES:
+        return None
+
+    pitch, angle = _pitch_and_rotation(points)
+    col_step = pitch * np.array([np.cos(angle), np.sin(angle)])
+    row_step = pitch * np.array([-np.sin(angle), np.cos(angle)])
+
+    # start at the hole closest to the middle of the detections
+    centre = np.median(points, axis=0)
+    origin = points[np.argmin(np.linalg.norm(points - centre, axis=1))]
+    reach = np.linalg.norm(points - origin, axis=1)
+
+    radius = GROW_START * pitch
+    refits = 0
+    while refits < iterations:
+        basis = np.array([col_step, row_step])
+        uv = (points - origin) @ np.linalg.inv(basis)
+        indices = np.rint(uv)
+        residual = np.linalg.norm((uv - indices) @ basis, axis=1)
+        inliers = (residual < INLIER_TOLERANCE * pitch) & (reach <= radius)
+        if inliers.sum() < 3:
+            return None
+
+        # points = origin + col * col_step + row * row_step
+        design = np.column_stack([np.ones(inliers.sum()), indices[inliers]])
+        # holes on one line (e.g. a single row) cannot fix both steps, the
+        # next pass would have a singular basis
+        if np.linalg.matrix_rank(design) < 3:
+            return None
+        solution, *_ = np.linalg.lstsq(design, points[inliers], rcond=None)
+        origin, col_step, row_step = solution
+
+        if radius >= reach.max():
+            refits += 1
+        radius *= 2
+
+    if inliers.sum() < MIN_HOLES:
+        return None
+
+    points, indices = points[inliers], indices[inliers].astype(int)
+    col_first, col_last = _line_range(indices[:, 0])
+    row_first, row_last = _line_range(indices[:, 1])
+    on_board = ((indices[:, 0] >= col_first) & (indices[:, 0] < col_last)
+                & (indices[:, 1] >= row_first) & (indices[:, 1] < row_last))
+
+    return HoleLattice(origin + col_first * col_step + row_first * row_step,
+                       col_step, row_step, row_last - row_first,
+                       col_last - col_first, points[on_board])
+
+
+def detect_lattice(image, detect_size=DETECT_SIZE):
+    """
+    Finds the protoboard hole grid in a photo. The photo is shrunk by a
+    whole factor to about detect_size first (whole factors take OpenCV's
+    fast area averaging path), so a 12 MP image costs about the same as a
+    small one.
+
+    Parameters:
+        image (numpy array): BGR or RGB image.
+        detect_size (int): Longest side holes are detected at (in pixels).
+
+    Returns:
+        lattice (HoleLattice): Grid in the pixels of image, or None.
+    """
+    factor = max(1, int(np.ceil(max(image.shape[:2]) / detect_size)))
+    small = image if factor == 1 else cv2.resize(
+        image, None, fx=1 / factor, fy=1 / factor, interpolation=cv2.INTER_AREA)
+
+    points, _ = find_white_circle_centroids(small)
+    lattice = fit_lattice(points)
+    return None if lattice is None else lattice.scaled(factor)
+
+
+if __name__ == "__main__":
+    IMAGE_PATH = r"C:\Users\piram\Desktop\solderbot\data\test_images\nov2.jpg"
+    image = cv2.imread(IMAGE_PATH)
+
+    start = time.perf_counter()
+    lattice = detect_lattice(image)
+    print(f"{(time.perf_counter() - start) * 1000:.1f} ms")
+    print(f"{lattice.rows} rows x {lattice.cols} cols, pitch {lattice.pitch:.2f} px, "
+          f"rotation {lattice.rotation:.2f} deg, {lattice.holes} holes")
+
+    output = image.copy()
+    cols, rows = np.meshgrid(np.arange(lattice.cols), np.arange(lattice.rows))
+    for x, y in lattice.to_pixels(cols, rows).reshape(-1, 2):
+        cv2.circle(output, (int(x), int(y)), 3, (0, 0, 255), -1)
+
+    cv2.imshow("Hole Lattice", output)
+    cv2.waitKey(0)      # waits until a key is pressed
+    cv2.destroyAllWindows()
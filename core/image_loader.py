@@ -0,0 +1,156 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+
+CACHE_SIZE = 512 * 1024 * 1024  # most bytes of decoded images kept in memory
+PYRAMID_MIN = 64  # smallest side of the last pyramid level (in pixels)
+
+
+class LoadedImage:
+    """
+    A decoded image: one RGB buffer (shared by OpenCV and, through a
+    QImage wrapping it, by Qt) and its mip pyramid, each level half the
+    size of the one before. Treat the buffers as read only, they are
+    shared through the cache.
+    """
+
+    def __init__(self, rgb, digest=None, path=None):
+        self.rgb = rgb
+        self.pyramid = build_pyramid(rgb)
+        self.digest = digest
+        self.path = path
+
+    @property
+    def nbytes(self):
+        return sum(level.nbytes for level in self.pyramid)
+
+    def level_for(self, width, height):
+        """
+        Smallest pyramid level at least width x height, so it can be scaled
+        down to fit without losing detail.
+        """
+        for level in reversed(self.pyramid):
+            if level.shape[1] >= width and level.shape[0] >= height:
+                return level
+        return self.pyramid[0]
+
+    def fit(self, width, height):
+        """RGB image scaled down to fit in width x height, keeping its aspect ratio."""
+        level = self.level_for(width, height)
+        scale = min(width / level.shape[1], height / level.shape[0], 1.0)
+        if scale == 1.0:
+            return level
+        size = (max(1, round(level.shape[1] * scale)), max(1, round(level.shape[0] * scale)))
+        return cv2.resize(level, size, interpolation=cv2.INTER_AREA)
+
+
+def build_pyramid(image, min_size=PYRAMID_MIN):
+    """Image followed by halved copies (cv2.pyrDown) down to min_size pixels"""
+    pyramid = [image]
+    while min(pyramid[-1].shape[:2]) >= 2 * min_size:
+        pyramid.append(cv2.pyrDown(pyramid[-1]))
+    return pyramid
+
+
+def decode_image(data, digest=None, path=None):
+    """
+    Decodes an encoded image once, straight to RGB.
+
+    Parameters:
+        data (bytes): Contents of an image file.
+
+    Returns:
+        image (LoadedImage): Decoded image, or None if data is not an image.
+    """
+    bgr = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if bgr is None:
+        return None
+    cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB, dst=bgr)  # in place, no second buffer
+    return LoadedImage(bgr, digest, path)
+
+
+class ImageCache:
+    """
+    Decoded images keyed by a hash of the file contents, so opening the same
+    photo again (from any path, or from another widget) skips decoding.
+    Least recently used images are dropped past max_bytes.
+    """
+
+    def __init__(self, max_bytes=CACHE_SIZE):
+        self.max_bytes = max_bytes
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, path):
+        """
+        Reads path once, then returns the cached image for its contents or
+        decodes them.
+
+        Returns:
+            image (LoadedImage): Decoded image, or None if unreadable.
+        """
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+
+        with self._lock:
+            image = self._images.get(digest)
+            if image is not None:
+                self._images.move_to_end(digest)
+                return image
+
+        image = decode_image(data, digest, path)
+        if image is not None:
+            self.put(image)
+        return image
+
+    def put(self, image):
+        with self._lock:
+            self._images[image.digest] = image
+            self._images.move_to_end(image.digest)
+            total = sum(cached.nbytes for cached in self._images.values())
+            while total > self.max_bytes and len(self._images) > 1:
+                _, dropped = self._images.popitem(last=False)
+                total -= dropped.nbytes
+
+
+class ImageLoader:
+    """
+    Decodes images on a worker thread so the UI never blocks on a large
+    photo. Results are handed to a callback on the worker thread; Qt
+    widgets should pass a signal's emit so the image arrives on the UI
+    thread.
+    """
+
+    def __init__(self, cache=None):
+        self.cache = IMAGE_CACHE if cache is None else cache
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="image_loader")
+
+    def load(self, path, callback):
+        """
+        Starts loading path.
+
+        Parameters:
+            path (str): Image file.
+            callback: Called with the LoadedImage (None if unreadable).
+
+        Returns:
+            future (Future): Resolves to the LoadedImage.
+        """
+        def work():
+            image = self.cache.load(path)
+            if image is None:
+                print("Failed to load image:", path)
+            callback(image)
+            return image
+
+        return self._executor.submit(work)
+
+
+IMAGE_CACHE = ImageCache()  # shared by every widget that shows images
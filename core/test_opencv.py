@@ -63,6 +63,47 @@ def find_white_circles_contour(image):
 
     return output
 
+def find_white_circle_centroids(image, kernel=7, min_fill=0.5):
+    """
+    Vectorized version of find_white_circles_contour for whole boards.
+    Pads are silver/white, so they are picked out as the unsaturated pixels
+    (Otsu threshold on saturation, whatever colour the board is), eroded so
+    neighbouring pads come apart, and measured in one
+    connectedComponentsWithStats pass instead of a loop over contours.
+
+    Parameters:
+        image (numpy array): BGR (or RGB, saturation does not depend on
+            the channel order) image.
+        kernel (int): Erosion size separating touching pads (in pixels).
+        min_fill (float): Smallest blob area / bounding box area kept
+            (a disc fills ~0.79 of its box, a wire far less).
+
+    Returns:
+        centroids (numpy array): N x 2 centres (x, y) of the round blobs.
+        area (float): Median blob area (in pixels).
+    """
+    saturation = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)[..., 1]
+    _, thresh = cv2.threshold(saturation, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    thresh = cv2.erode(thresh, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (kernel, kernel)))
+
+    _, _, stats, centroids = cv2.connectedComponentsWithStats(thresh, connectivity=4)
+    stats, centroids = stats[1:], centroids[1:]  # label 0 is the background
+    width = stats[:, cv2.CC_STAT_WIDTH]
+    height = stats[:, cv2.CC_STAT_HEIGHT]
+    area = stats[:, cv2.CC_STAT_AREA]
+
+    # pads are the most common blob, so their size is the median of the
+    # blobs bigger than noise
+    blobs = area[area > kernel * kernel]
+    if blobs.size == 0:
+        return np.empty((0, 2)), 0.0
+    typical = float(np.median(blobs))
+
+    round_blobs = ((area > 0.4 * typical) & (area < 2.5 * typical)
+                   & (width < 1.5 * height) & (height < 1.5 * width)
+                   & (area > min_fill * width * height))
+    return centroids[round_blobs], typical
+
 if __name__ == "__main__":
     IMAGE_PATH = r"C:\Users\piram\Desktop\solderbot\data\test_images\nov2.jpg"
     output = filter_black_to_color(image_path=IMAGE_PATH)
@@ -1,5 +1,95 @@
 """ This Python Class is used to translate user commands into gcode commands """
 
+# imports
+import numpy as np
+
+# op codes used by compiled jobs (see job_compiler.py), one per GCodeWriter
+# command
+OP_POSITIONING      = 0 # G90/G91, value: 0 = absolute, 1 = relative
+OP_HOME             = 1 # G28
+OP_RAPID            = 2 # G0 to x, y (z optional)
+OP_LINEAR           = 3 # G1 to x, y at feedrate value
+OP_PLUNGE           = 4 # G0 to z
+OP_DISPENSE_ON      = 5 # M3 at spool speed value
+OP_DISPENSE_OFF     = 6 # M5
+OP_DWELL            = 7 # G4 for value milliseconds
+OP_ARC_CW           = 8 # G2 to x, y around centre offset i, j at feedrate value
+OP_ARC_CCW          = 9 # G3, same as OP_ARC_CW
+
+FILLET_DECIMALS     = 4 # arcs are rounded to this many decimals so a G2/G3
+                        # line stays under GRBL's 80 character limit
+MAX_FILLET_TURN     = 150 # sharper turns (in degrees) are left as corners
+
+# command letters and the (word, field) pairs written after them by
+# GCodeWriter.serialize ('seconds' is value converted from milliseconds).
+# OP_POSITIONING is handled separately
+BATCH_WORDS = {
+    OP_HOME:            ('G28', ()),
+    OP_RAPID:           ('G0', (('X', 'x'), ('Y', 'y'), ('Z', 'z'))),
+    OP_LINEAR:          ('G1', (('X', 'x'), ('Y', 'y'), ('F', 'value'))),
+    OP_PLUNGE:          ('G0', (('Z', 'z'),)),
+    OP_DISPENSE_ON:     ('M3', (('S', 'value'),)),
+    OP_DISPENSE_OFF:    ('M5', ()),
+    OP_DWELL:           ('G4', (('P', 'seconds'),)),
+    OP_ARC_CW:          ('G2', (('X', 'x'), ('Y', 'y'), ('I', 'i'), ('J', 'j'),
+                                ('F', 'value'))),
+    OP_ARC_CCW:         ('G3', (('X', 'x'), ('Y', 'y'), ('I', 'i'), ('J', 'j'),
+                                ('F', 'value'))),
+}
+
+def fillet_corners(before, corner, after, radius: float):
+    """ Rounds off polyline corners with tangent arcs, so the gantry can take
+    them without stopping. The arc is shrunk on short segments so it never
+    uses more than half of either segment. Works on whole arrays of corners
+    parameters:
+        before, corner, after: (n, 2) arrays of the vertex before each corner,
+                    the corner and the vertex after it
+        radius: fillet radius (in the same units as the vertices)
+    returns:
+        entry: (n, 2) point where each arc leaves the incoming segment
+        exit: (n, 2) point where each arc joins the outgoing segment
+        centre: (n, 2) offset from entry to the arc centre (G2/G3 I and J)
+        clockwise: True for right hand turns (G2), False for left (G3)
+        rounded: False for corners left sharp (straight on, too sharp a turn
+                    or a zero length segment)
+    """
+    before, corner, after = (np.asarray(points, dtype=float).reshape(-1, 2)
+                             for points in (before, corner, after))
+    incoming = corner - before
+    outgoing = after - corner
+    length_in = np.sqrt(np.sum(incoming * incoming, axis=1))
+    length_out = np.sqrt(np.sum(outgoing * outgoing, axis=1))
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        unit_in = incoming / length_in[:, None]
+        unit_out = outgoing / length_out[:, None]
+        cross = unit_in[:, 0] * unit_out[:, 1] - unit_in[:, 1] * unit_out[:, 0]
+        dot = np.sum(unit_in * unit_out, axis=1)
+        turn = np.arctan2(np.abs(cross), dot)
+
+        # distance from the corner to where the arc touches each segment
+        half_tan = np.tan(turn / 2)
+        tangent = np.minimum.reduce((radius * half_tan, length_in / 2,
+                                     length_out / 2))
+        arc_radius = tangent / half_tan
+
+    rounded = ((radius > 0) & (length_in > 0) & (length_out > 0)
+               & (np.abs(cross) > 1e-9)
+               & (turn < np.radians(MAX_FILLET_TURN)))
+    clockwise = cross < 0
+
+    # the centre sits on the inside of the turn, square to the incoming segment
+    side = np.where(clockwise, -1.0, 1.0)
+    normal = np.stack((-unit_in[:, 1], unit_in[:, 0]), axis=1) * side[:, None]
+    exact_entry = corner - unit_in * tangent[:, None]
+    centre = exact_entry + normal * arc_radius[:, None]
+
+    entry = np.round(exact_entry, FILLET_DECIMALS)
+    exit = np.round(corner + unit_out * tangent[:, None], FILLET_DECIMALS)
+    centre = np.round(centre - entry, FILLET_DECIMALS)
+
+    return entry, exit, centre, clockwise & rounded, rounded
+
 class GCodeWriter:
     # +z = up
     # -z = down
@@ -31,7 +121,24 @@ class GCodeWriter:
             command += f' F{f}'
 
         return command
-    
+
+    def circular_interpolation(x: float, y: float, i: float, j: float,
+                               f: float, clockwise: bool):
+        """ Moves the end effector along an arc in the xy-plane, from the
+        current position to x, y around the centre at offset i, j from the
+        current position """
+
+        command = 'G2' if clockwise else 'G3'
+        if x is not None:
+            command += f' X{x}'
+        if y is not None:
+            command += f' Y{y}'
+        command += f' I{i} J{j}'
+        if f is not None:
+            command += f' F{f}'
+
+        return command
+
     def move_up_down(z: float):
         """ Moves end effector up or down using rapid positioning """
 
@@ -42,9 +149,10 @@ class GCodeWriter:
         return command
     
     def wait(mil_sec: int):
-        """" Pauses command queue for x milliseconds soldering to occur """
+        """" Pauses command queue for x milliseconds soldering to occur. GRBL
+        reads the P word of G4 in seconds """
 
-        command = f'G4 P{mil_sec}'
+        command = f'G4 P{mil_sec / 1000:g}'
 
         return command
 
@@ -59,6 +167,14 @@ class GCodeWriter:
 
         command = 'G28'
         return command
+
+    def homing_cycle():
+        """ Runs GRBL's homing cycle against the limit switches, which sets
+        machine zero (needs $22=1). Unlike G28 this finds the real zero
+        after a reset lost it """
+
+        command = '$H'
+        return command
     
     def positioning(reference: str):
         """ Sets whether the coordinates should be interpreted relatively or 
@@ -91,6 +207,24 @@ class GCodeWriter:
         
         command = 'M5'
         return command
+    def set_work_offset(slot: int, x: float, y: float):
+        """ Stores the origin of work coordinate system slot (1 = G54 ...
+        6 = G59) at machine position x, y. GRBL keeps this in EEPROM """
+
+        command = f'G10 L2 P{slot}'
+        if x is not None:
+            command += f' X{x}'
+        if y is not None:
+            command += f' Y{y}'
+
+        return command
+
+    def work_coordinates(slot: int):
+        """ Switches to work coordinate system slot (1 = G54 ... 6 = G59) """
+
+        command = f'G{53 + slot}'
+        return command
+
     def velocity_to_feedrate(velocity):
         return f"F{velocity:.1f}"
     
@@ -108,3 +242,58 @@ class GCodeWriter:
             command += ' Z0'
         
         return command
+
+    def serialize(ops, x=None, y=None, z=None, value=None,
+                  precision: int = 3, i=None, j=None) -> bytes:
+        """ Batch version of the commands above. Translates an array of op
+        codes (OP_* constants) and arrays of their arguments into a single
+        buffer of newline terminated GCODE, ready to be written to the serial
+        port. NaN marks an unused field, the same way None does for the single
+        commands, and every number is written with precision decimals """
+
+        ops = np.asarray(ops)
+        fields = {}
+        for name, column in (('x', x), ('y', y), ('z', z), ('i', i), ('j', j),
+                             ('value', value)):
+            if column is None:
+                fields[name] = np.full(len(ops), np.nan)
+            else:
+                fields[name] = np.asarray(column, dtype=float)
+        fields['seconds'] = fields['value'] / 1000
+
+        lines = np.full(len(ops), None, dtype=object)
+
+        rows = np.flatnonzero(ops == OP_POSITIONING)
+        lines[rows] = np.where(fields['value'][rows] == 1, 'G91', 'G90')
+
+        # rows sharing an op code and the same set of used fields share one
+        # format string, so each group is formatted in one go
+        for op, (letters, words) in BATCH_WORDS.items():
+            rows = np.flatnonzero(ops == op)
+            if len(rows) == 0:
+                continue
+
+            used = np.zeros(len(rows), dtype=int)
+            for bit, (_, field) in enumerate(words):
+                used |= ~np.isnan(fields[field][rows]) << bit
+
+            for signature in np.unique(used):
+                group = rows[used == signature]
+                present = [(word, field) for bit, (word, field) in enumerate(words)
+                           if signature >> bit & 1]
+                template = letters + ''.join(f' {word}%.{precision}f'
+                                             for word, _ in present)
+                if present:
+                    columns = [fields[field][group].tolist()
+                               for _, field in present]
+                    lines[group] = list(map(template.__mod__, zip(*columns)))
+                else:
+                    lines[group] = template
+
+        unknown = np.flatnonzero(lines == None)
+        if len(unknown):
+            raise ValueError(f"Unknown op code {ops[unknown[0]]}")
+        if len(lines) == 0:
+            return b''
+
+        return ('\n'.join(lines.tolist()) + '\n').encode('ascii')
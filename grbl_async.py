@@ -0,0 +1,242 @@
+""" This Python module is an asyncio driver for GRBL. Every line sent returns
+a future that resolves when GRBL answers it, and alarms, status reports and
+messages each arrive on their own queue, so motion, vision and UI work can
+share one event loop without fighting over the serial port """
+
+# imports
+import asyncio
+import threading
+from collections import deque
+import serial
+from grbl_realtime import RealtimeControl, STATUS_REPORT
+from grbl_status import MachineState, STATUS_RATE
+from grbl_stream import RX_BUFFER_SIZE, SYNC_COMMAND, is_eeprom_command
+
+# constants
+STATUS_BACKLOG  = 100 # status reports kept for readers, the oldest are dropped
+
+class GrblError(Exception):
+    """ GRBL rejected a line with error:N """
+
+    def __init__(self, command: str, response: str):
+        super().__init__(f"{response} on: {command}")
+        self.command = command
+        self.code = int(response.partition(':')[2] or 0)
+
+################################### Driver ####################################
+class AsyncGrbl:
+    """ Drives GRBL from an event loop. A reader thread does the blocking
+    reads and hands every line to the loop, where:
+        - ok/error:N resolve the future of the oldest line in flight
+        - status reports update state and go on status_reports (only the
+            latest STATUS_BACKLOG are kept)
+        - ALARM:N lines go on alarms
+        - everything else ([MSG:...], [GC:...], the startup banner) goes on
+            messages
+    Lines are streamed with the character counting protocol (see
+    grbl_stream.py), so awaiting send only waits for room in GRBL's receive
+    buffer, not for the line to be answered. If the port drops, every line
+    in flight and every later send fails with the port's error. Use as an
+    async context manager so the reader thread is always stopped """
+
+    def __init__(self, ser, rx_buffer: int = RX_BUFFER_SIZE,
+                 state: MachineState = None):
+        """ parameters:
+            ser: open serial port connected to GRBL. Its read timeout is
+                        shortened so the reader thread can be stopped
+            rx_buffer: size of GRBL's receive buffer (in bytes)
+            state: snapshot to keep up to date, a new one if None
+        """
+        self.ser = ser
+        self.rx_buffer = rx_buffer
+        self.state = MachineState() if state is None else state
+        self.alarms = asyncio.Queue()
+        self.status_reports = asyncio.Queue(maxsize=STATUS_BACKLOG)
+        self.messages = asyncio.Queue()
+        self.control = RealtimeControl(ser) # feed hold and overrides
+        self.error = None # what stopped the reader thread, if the port dropped
+
+        self._pending = deque() # (command, bytes, future) not answered yet
+        self._in_flight = 0
+        self._room = asyncio.Event()
+        self._send_lock = asyncio.Lock()
+        self._stop = threading.Event()
+        self._reader = None
+        self._loop = None
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def start(self) -> None:
+        """ Starts the reader thread, handing lines to the running loop """
+
+        self._loop = asyncio.get_running_loop()
+        self.ser.timeout = 0.1
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+
+    async def close(self) -> None:
+        """ Stops the reader thread and cancels every unanswered line """
+
+        self._stop.set()
+        await asyncio.to_thread(self._reader.join)
+        while self._pending:
+            self._pending.popleft()[2].cancel()
+
+    async def send(self, command: str) -> asyncio.Future:
+        """ Sends one line as soon as there is room for it in GRBL's receive
+        buffer. Lines go out in the order send is called
+        returns:
+            answer: future resolving to 'ok', or failing with GrblError
+        """
+        line = (command.strip() + '\n').encode('ascii')
+        if len(line) > self.rx_buffer:
+            raise ValueError(f"Command longer than the receive buffer: {command}")
+
+        async with self._send_lock:
+            self.check()
+            while self._in_flight + len(line) > self.rx_buffer:
+                self._room.clear()
+                await self._room.wait()
+                self.check()
+
+            answer = self._loop.create_future()
+            self._pending.append((command, len(line), answer))
+            self._in_flight += len(line)
+            self.ser.write(line)
+
+        return answer
+
+    def check(self) -> None:
+        """ Raises the error that stopped the reader thread, if any
+        raises:
+            serial.SerialException: if the port to GRBL dropped
+        """
+        if self.error is not None:
+            raise self.error
+
+    async def drain(self) -> None:
+        """ Waits until every line sent so far has been answered """
+
+        answers = [answer for _, _, answer in self._pending]
+        await asyncio.gather(*answers, return_exceptions=True)
+        self.check()
+
+    async def command(self, command: str) -> str:
+        """ Sends one line and waits for GRBL to answer it """
+
+        return await (await self.send(command))
+
+    def realtime(self, command: bytes) -> None:
+        """ Sends a realtime command (?, !, ~, overrides). These bypass the
+        receive buffer and are never answered (see also control) """
+
+        self.control.send(command)
+
+    async def sync(self) -> None:
+        """ Waits until GRBL has finished every move sent so far """
+
+        await self.command(SYNC_COMMAND)
+
+    async def poll_status(self, rate: float = STATUS_RATE) -> None:
+        """ Requests a status report rate times a second until cancelled.
+        Run it as a task alongside the job """
+
+        while True:
+            self.realtime(STATUS_REPORT)
+            await asyncio.sleep(1 / rate)
+
+    async def stream(self, commands, host_wait=None) -> list:
+        """ Streams commands to GRBL, keeping its receive buffer full
+        parameters:
+            commands: any iterable of GCODE commands
+            host_wait: optional function giving how long (in s) to wait once
+                        a command has been carried out (see
+                        grbl_stream.GrblStreamer.stream)
+        returns:
+            errors: GrblError for every line GRBL rejected
+        """
+        answers = []
+        for command in commands:
+            if is_eeprom_command(command):
+                # nothing may arrive while GRBL writes EEPROM, so the buffer
+                # is emptied first and nothing follows until it answers
+                await self.drain()
+                answers.append(await self.send(command))
+                await self.drain()
+                continue
+
+            answers.append(await self.send(command))
+
+            wait = host_wait(command) if host_wait is not None else 0
+            if wait:
+                await self.sync()
+                await asyncio.sleep(wait)
+
+        results = await asyncio.gather(*answers, return_exceptions=True)
+        self.check()
+        return [result for result in results if isinstance(result, GrblError)]
+
+    def _read(self) -> None:
+        """ Reader thread: blocking reads, handed to the loop line by line.
+        Reads can time out halfway through a line, so partial lines are kept
+        until the rest arrives """
+
+        partial = b''
+        while not self._stop.is_set():
+            try:
+                partial += self.ser.readline()
+            except (serial.SerialException, OSError) as error:
+                self._loop.call_soon_threadsafe(self._fail, error)
+                return
+            if not partial.endswith(b'\n'):
+                continue
+
+            line = partial.decode('ascii', errors='replace').strip()
+            partial = b''
+            if line:
+                self._loop.call_soon_threadsafe(self._dispatch, line)
+
+    def _fail(self, error: Exception) -> None:
+        """ Fails every line in flight with the port's error and wakes any
+        send waiting for room, runs on the loop """
+
+        self.error = error
+        while self._pending:
+            _, _, answer = self._pending.popleft()
+            if not answer.done():
+                answer.set_exception(error)
+                answer.exception() # raised through check, not each future
+        self._in_flight = 0
+        self._room.set()
+
+    def _dispatch(self, line: str) -> None:
+        """ Routes one line from GRBL, runs on the loop """
+
+        if line == 'ok' or line.startswith('error'):
+            if not self._pending:
+                self.messages.put_nowait(line)
+                return
+
+            command, size, answer = self._pending.popleft()
+            self._in_flight -= size
+            self._room.set()
+            if answer.done():
+                return
+            if line == 'ok':
+                answer.set_result(line)
+            else:
+                answer.set_exception(GrblError(command, line))
+        elif line.startswith('<'):
+            self.state.update(line)
+            if self.status_reports.full():
+                self.status_reports.get_nowait()
+            self.status_reports.put_nowait(line)
+        elif line.startswith('ALARM'):
+            self.alarms.put_nowait(line)
+        else:
+            self.messages.put_nowait(line)
@@ -5,17 +5,46 @@ GRBL """
 import serial
 import time
 import json
+import queue
+import threading
 from serial.tools import list_ports
 from gcodewriter import GCodeWriter as writer
+from job_cache import JobCache
+from job_compiler import Job, compile_job
+from motion import estimate_job_time
+from panel import panel_gcode, panel_job, work_offset_gcode
+from path_planner import (PathPlanner, ColumnSweepPlanner, merge_lines,
+                          PLANNERS, PLANNER_VERSION)
+from zhop_planner import ZHopPlanner
+from grbl_stream import ANSWER_TIMEOUT, GrblAlarm, GrblStreamer
+from grbl_status import MachineState, StatusMonitor, STATUS_RATE, CHECK_INTERVAL
+from grbl_session import GrblSession, get_session
+from job_journal import JobJournal, load_journal, resume_commands
+from old_330_code.config import hole_pitch, robot_config
 
 # constants
 PORT                    = "COM7" # change to correct port
+BOARD_FILE              = "board_data.json" # board sent from the GUI
+PANEL_OFFSETS           = [] # fixture origins (x, y in mm) for step-and-repeat, empty for a single board
 BAUDRATE                = 115200
 HEIGHT                  = 1 # (in mm)
 LINE_FEEDRATE           = 50 # TO DO: figure out the best feedrate for soldering lines
-SCALE                   = 2.5 # distance between holes (in mm) <-- i think? need to double check
+FILLET_RADIUS           = 0.5 # corners of lines are rounded off with arcs this big (in mm), 0 for sharp corners
+SCALE                   = hole_pitch # distance between holes (in mm), shared with the UI's calibration
 SOLDER_TIME             = 5000 # how long the solder is held over a point (in ms)
 SOLDER_DISPENSE_RATE    = 160 # spool feed motor speed (in rpm, lowest speed: 160)
+DISPENSE_DELAY          = 3000 # how long solder is dispensed before moving on (in ms)
+CONTROLLER_TIMING       = True # time the solder and dispense waits with G4 dwells instead of host sleeps
+PLANNER                 = "timed" # joint order: "sweep" (column by column), "tour" (shortest travel) or "timed" (quickest travel, see motion.py)
+STREAM_GCODE            = False # plan while sending instead of before sending
+STREAM_CHUNK            = 64 # points/lines compiled at a time when streaming
+QUEUE_SIZE              = 256 # commands planned ahead of the sender when streaming
+QUEUE_TIMEOUT           = 0.5 # how often a planner waiting on a full queue checks the sender is still there (in s)
+CHARACTER_COUNTING      = True # keep GRBL's receive buffer full instead of waiting for every ok
+SYNC_SETTINGS           = True # write the robot_config settings that differ from GRBL's on connect
+JOURNAL_FILE            = "job.journal" # acknowledged commands of the last job, for resuming it
+RESUME_JOB              = False # finish an interrupted job from its journal instead of starting over (only set it once the board is back in the fixture untouched)
+BOARD_ID                = None # label of the physical board being soldered, a journal is only resumed on the same board
 
 ############################## Helper Functions ###############################
 def list_available_ports():
@@ -29,19 +58,55 @@ def list_available_ports():
         for port in ports:
             print(f"  {port.device}")
 
-def poll_grbl(ser):
-    """Polls GRBL until it reports Idle."""
-    while True:
-        ser.write(b"?")   # status report
-        time.sleep(0.1)
+def queue_commands(commands, maxsize: int = QUEUE_SIZE):
+    """ Runs a command generator on a background thread so planning carries
+    on while the commands are being sent. At most maxsize commands are held
+    between the two, so memory use does not grow with the job. If the
+    consumer stops early (e.g. the port dropped) the planner stops too
+    instead of waiting on the full queue forever
+    parameters:
+        commands: iterable of GCODE commands (e.g. stream_gcode)
+        maxsize: most commands buffered ahead of the consumer
+    returns:
+        generator yielding the commands in order
+    """
+    buffer = queue.Queue(maxsize=maxsize)
+    finished = object()
+    stop = threading.Event() # set once the consumer is gone
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=QUEUE_TIMEOUT)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for command in commands:
+                if not put(command):
+                    return
+            put(finished)
+        except Exception as error:
+            put(error)
 
-        if ser.in_waiting:
-            status = ser.readline().decode().strip()
-            print("STATUS:", status)
+    threading.Thread(target=produce, name="queue_commands", daemon=True).start()
 
-            if "Idle" in status:
+    try:
+        while True:
+            command = buffer.get()
+            if command is finished:
                 return
-        time.sleep(0.2)
+            if isinstance(command, Exception):
+                raise command
+            yield command
+    finally:
+        # runs when the consumer stops early too (the generator is closed)
+        stop.set()
+        while not buffer.empty():
+            buffer.get_nowait()
 
 def gcode_test(serial_port):
     """ Test basic movement of gantry 
@@ -121,7 +186,7 @@ def load_json() -> dict:
     data = {}
 
     try:
-        with open('board_data.json', 'r') as file:
+        with open(BOARD_FILE, 'r') as file:
             data = json.load(file)
     
     except FileNotFoundError:
@@ -150,82 +215,225 @@ def format_json(json_data: dict) -> list:
         end = line["end"]
         solder_list.append(("line", start, end))
 
-    # TO DO: get corner coordinates
-    # use corner coordinates to determine last column
-
     return solder_list
 
-def generate_gcode(data_list: list, last_col) -> list:
+def format_components(json_data: dict) -> list:
+    """ Reads the components already sitting on the board from the json file
+    parameters:
+        json_data: data loaded in from the json file. Each entry in
+                    "components" covers the holes from "start" to "end" and
+                    stands "height" mm above the board
+    returns:
+        components: list of (x0, y0, x1, y1, height) footprints in mm
+    """
+    components = []
+
+    for component in json_data.get("components", []):
+        (start_x, start_y), (end_x, end_y) = component["start"], component["end"]
+
+        # footprint reaches halfway to the neighbouring holes
+        x0 = (min(start_x, end_x) - 0.5) * SCALE
+        y0 = (min(start_y, end_y) - 0.5) * SCALE
+        x1 = (max(start_x, end_x) + 0.5) * SCALE
+        y1 = (max(start_y, end_y) + 0.5) * SCALE
+        components.append((x0, y0, x1, y1, component["height"]))
+
+    return components
+
+def dwell_times() -> dict:
+    """ Dwells compiled into the job (see compile_job) when the controller
+    times the solder and dispense waits, none when the host does """
+
+    if not CONTROLLER_TIMING:
+        return {}
+    return {"solder_time": SOLDER_TIME, "dispense_delay": DISPENSE_DELAY}
+
+def compile_board(data_list: list, planner: PathPlanner = None,
+                  merge: bool = True, zhop: ZHopPlanner = None) -> Job:
+    """ Plans and compiles the points/lines in the json file into a job
+    parameters:
+        data_list: list of points and lines from the json file
+        planner: path planner used to order the points/lines. If None, the
+                    board is swept column by column
+        merge: if True, lines that touch are soldered as one continuous drag
+        zhop: if given, picks the height of every hop between joints
+    returns:
+        job: the compiled job
+    """
+    if planner is None:
+        planner = ColumnSweepPlanner(scale=SCALE)
+    if merge:
+        data_list = merge_lines(data_list)
+
+    job = compile_job(planner.plan(data_list), SCALE, HEIGHT, LINE_FEEDRATE,
+                      SOLDER_DISPENSE_RATE, fillet_radius=FILLET_RADIUS,
+                      **dwell_times())
+    if zhop is not None:
+        job = zhop.plan(job)
+
+    return job
+
+def compile_settings(planner: PathPlanner, zhop: ZHopPlanner = None) -> dict:
+    """ Everything besides the board itself that changes the compiled job,
+    used to key the job cache
+    parameters:
+        planner: path planner used to order the points/lines
+        zhop: Z-hop stage, if used
+    returns:
+        settings: machine constants and planner identity
+    """
+    return {
+        "scale": SCALE,
+        "height": HEIGHT,
+        "line_feedrate": LINE_FEEDRATE,
+        "fillet_radius": FILLET_RADIUS,
+        **dwell_times(),
+        "dispense_rate": SOLDER_DISPENSE_RATE,
+        "planner": planner.name,
+        "planner_version": PLANNER_VERSION,
+        "zhop": zhop.settings() if zhop is not None else None,
+    }
+
+def generate_gcode(data_list: list, planner: PathPlanner = None,
+                   merge: bool = True, zhop: ZHopPlanner = None) -> list:
     """ Generates a list of GCODE commands based on the points/lines in the 
     json file. This function conducts the 'path planning' 
     parameters:
         data_list: list of points and lines from the json file
-        last_col: last column on the protoboard
+        planner: path planner used to order the points/lines. If None, the
+                    board is swept column by column
+        merge: if True, lines that touch are soldered as one continuous drag
+        zhop: if given, picks the height of every hop between joints
     returns:
         commands: list of GCODE commands
     """
-    commands = []
-
+    return compile_board(data_list, planner, merge, zhop).to_gcode()
+
+def stream_gcode(data_list: list, planner: PathPlanner = None,
+                 merge: bool = True):
+    """ Generator version of generate_gcode. The setup commands are yielded
+    straight away (so the gantry can start homing while the board is being
+    planned) and the rest are compiled STREAM_CHUNK points/lines at a time as
+    they are consumed. The Z-hop stage is not applied, as it needs to see the
+    whole job
+    parameters:
+        data_list: list of points and lines from the json file
+        planner: path planner used to order the points/lines. If None, the
+                    board is swept column by column
+        merge: if True, lines that touch are soldered as one continuous drag
+    yields:
+        command: the next GCODE command
+    """
     # reset and go to reference point
-    commands.append(writer.positioning('absolute'))
-    commands.append(writer.reset())
-
-    for col in range(0, last_col):
-        for data in data_list:
-            x, y = data[1]
-
-            if x == col and data[0] == "point":
-                # move to point
-                x_coord = x * SCALE
-                y_coord = y * SCALE
-                commands.append(writer.rapid_positioning(x_coord, y_coord))
-
-                # lower end effector and solder
-                commands.append(writer.move_up_down(-HEIGHT))   # TO DO: figure out vertical distance required
-                commands.append(writer.start_dispensing(SOLDER_DISPENSE_RATE))
-                commands.append(writer.stop_dispensing())
-                #commands.append(writer.retract_solder(SOLDER_DISPENSE_RATE))
-
-                # raise end effector once soldering is complete
-                commands.append(writer.move_up_down(HEIGHT))
-            elif x == col and data[0] == "line":
-                # move to point and lower end effector
-                x_coord = x * SCALE
-                y_coord = y * SCALE
-                commands.append(writer.rapid_positioning(x_coord, y_coord))
-                commands.append(writer.move_up_down(-HEIGHT))
-
-                # start dispensing solder
-                commands.append(writer.start_dispensing(SOLDER_DISPENSE_RATE))
-
-                # slowly drag solder to create line
-                end_x, end_y = data[2]
-                x_coord = end_x * SCALE
-                y_coord = end_y * SCALE
-                commands.append(writer.linear_interpolation(x_coord, y_coord, 
-                                                            LINE_FEEDRATE))
-                
-                # stop soldering
-                commands.append(writer.stop_dispensing())
-                #commands.append(writer.retract_solder(SOLDER_DISPENSE_RATE))
-                commands.append(writer.move_up_down(HEIGHT))
-    
-    commands.append(writer.reset())
-
-    return commands
-
-def send_commands(serial_port: str, commands: list) -> None:
+    yield writer.positioning('absolute')
+    yield writer.reset()
+
+    if planner is None:
+        planner = ColumnSweepPlanner(scale=SCALE)
+    if merge:
+        data_list = merge_lines(data_list)
+    planned = planner.plan(data_list)
+
+    for start in range(0, len(planned), STREAM_CHUNK):
+        job = compile_job(planned[start:start + STREAM_CHUNK], SCALE, HEIGHT,
+                          LINE_FEEDRATE, SOLDER_DISPENSE_RATE, home=False,
+                          fillet_radius=FILLET_RADIUS, **dwell_times())
+        yield from job.iter_gcode()
+
+    yield writer.reset()
+
+def host_wait(command: str) -> float:
+    """ How long the host has to wait (in s) once a command has been carried
+    out, before the next one can run. Controller timed jobs already carry
+    their waits as G4 dwells """
+
+    if CONTROLLER_TIMING:
+        return 0
+
+    # wait after lowering end effector
+    if command == writer.move_up_down(-HEIGHT):
+        return SOLDER_TIME/1000
+    elif command == writer.start_dispensing(SOLDER_DISPENSE_RATE):
+        return DISPENSE_DELAY/1000
+    return 0
+
+def wait_for_answer(monitor: StatusMonitor) -> str:
+    """ Waits for GRBL to answer the last command sent. Other lines
+    ([MSG:...], the startup banner) are printed and skipped, so they are
+    never taken for the answer
+    parameters:
+        monitor: StatusMonitor reading the port
+    returns:
+        response: ok or error:N
+    raises:
+        GrblAlarm: if GRBL raises an alarm instead
+        serial.SerialException: if the port failed
+        TimeoutError: if GRBL does not answer within ANSWER_TIMEOUT
+    """
+    deadline = time.monotonic() + ANSWER_TIMEOUT
+    while True:
+        try:
+            response = monitor.responses.get(timeout=CHECK_INTERVAL)
+        except queue.Empty:
+            monitor.check()
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"GRBL did not answer within {ANSWER_TIMEOUT} s")
+            continue
+
+        if isinstance(response, Exception):
+            raise response
+        if response == 'ok' or response.startswith('error'):
+            return response
+        if response.startswith('ALARM'):
+            raise GrblAlarm(response)
+        print(f"Received message: {response}")
+
+def send_commands(serial_port: str, commands: list,
+                  streaming: bool = CHARACTER_COUNTING,
+                  state: MachineState = None,
+                  journal: JobJournal = None) -> None:
     """ Sends GCODE command to gantry microcontroller by writing to serial 
     port.
     parameters:
         serial_port: the COM port connecting the laptop to the gantry's 
-                    microcontroller
-        commands: list of GCODE commands to send to microcontroller
+                    microcontroller, or a port that is already open
+        commands: list of GCODE commands to send to microcontroller (any
+                    iterable works, e.g. queue_commands(stream_gcode(...)))
+        streaming: if True, commands are streamed with the character counting
+                    protocol (see grbl_stream.py) instead of one at a time
+        state: machine state kept up to date from GRBL's status reports
+                    while sending, e.g. for the UI to display
+        journal: started JobJournal. Every command GRBL acknowledges is
+                    recorded to it, and the job is marked done at the end
     returns: None
     """
     # point to serial port and clear any startup messages from the buffer
-    ser = serial.Serial(port=serial_port, baudrate=BAUDRATE)
-    time.sleep(2)
+    if isinstance(serial_port, str):
+        ser = serial.Serial(port=serial_port, baudrate=BAUDRATE)
+        time.sleep(2)
+    else:
+        ser = serial_port
+
+    if streaming:
+        ser.reset_input_buffer()
+        with StatusMonitor(ser, STATUS_RATE, state) as monitor:
+            def record(index, command, response):
+                if response == 'ok':
+                    journal.record(index, monitor.state.snapshot().get("mpos"))
+
+            streamer = GrblStreamer(ser, responses=monitor.responses,
+                                    on_answer=record if journal else None)
+
+            # unlock GRBL
+            streamer.send("$X")
+            streamer.drain()
+
+            errors = streamer.stream(commands, host_wait)
+        if journal and not errors:
+            # a run GRBL rejected lines of is left resumable
+            journal.finish()
+        print(f"Soldering complete ({len(errors)} errors)")
+        return
 
     # unlock GRBL
     ser.write(b"$X\n")
@@ -234,40 +442,32 @@ def send_commands(serial_port: str, commands: list) -> None:
         print("Unlock:", ser.readline().decode().strip()) 
 
     # send gcode commands
-    for command in commands:
-        ser.write((command + '\n').encode())
-        print(command)
-
-        start = time.time()
-        
-        while True:
-            if ser.in_waiting:
-                response = ser.readline().decode('utf-8').strip()
-                print(f"Received response: {response}")
-
-                # Check for the 'ok' response to know when it's safe to send the 
-                # next command. Check is skipped is command was wait
-                if command == writer.wait(SOLDER_TIME):
-                    break
-                elif "ok" in response.lower(): 
-                    break
-            
-            if time.time() - start > 10:
-                print("Timeout waiting for response")
-                break
-
-        # get grbl status while sending commands
-        poll_grbl(ser)
-
-        # wait after lowering end effector
-        if command == writer.move_up_down(-HEIGHT):
-            print("waiting")
-            time.sleep(SOLDER_TIME/1000)
-        elif command == writer.start_dispensing(SOLDER_DISPENSE_RATE):
-            print("dispensing")
-            time.sleep(3)
-
-    print("Soldering complete")
+    errors = [] # (command, response) for every line GRBL rejected
+    with StatusMonitor(ser, STATUS_RATE, state) as monitor:
+        for index, command in enumerate(commands):
+            ser.write((command + '\n').encode())
+            print(command)
+
+            # wait for the 'ok' response to know when it's safe to send the
+            # next command
+            response = wait_for_answer(monitor)
+            print(f"Received response: {response}")
+            if response.startswith('error'):
+                errors.append((command, response))
+
+            # let the gantry finish the command
+            monitor.wait_idle()
+            if journal and response == 'ok':
+                journal.record(index, monitor.state.snapshot().get("mpos"))
+
+            wait = host_wait(command)
+            if wait:
+                print("waiting")
+                time.sleep(wait)
+
+    if journal and not errors:
+        journal.finish()
+    print(f"Soldering complete ({len(errors)} errors)")
     
 def set_reference():
     # move to initial hard coded reference point
@@ -280,17 +480,130 @@ def set_reference():
     return
 
 ################################ Main Function ################################
+def open_session(port: str):
+    """ Opens (or reuses) the long lived connection to the gantry and brings
+    GRBL's settings in line with robot_config
+    parameters:
+        port: the COM port connecting the laptop to the gantry's
+                microcontroller
+    returns:
+        session: open GrblSession, None if the gantry cannot be reached
+    """
+    try:
+        session = get_session(port, BAUDRATE)
+        if SYNC_SETTINGS:
+            written = session.sync_settings(robot_config["parameters"])
+            if written:
+                print(f"Updated GRBL settings: {written}")
+        return session
+    except (serial.SerialException, TimeoutError, ValueError) as error:
+        print(error)
+        return None
+
+def run_job(session: GrblSession, commands, journal_file: str = None,
+            resume: bool = False, board: str = None, setup: list = None) -> None:
+    """ Sends a job over a session. If the connection drops or GRBL raises an
+    alarm, the job stops with its journal kept and the session is closed, so
+    the next job reconnects (which also resets GRBL out of the alarm)
+    parameters:
+        session: open GrblSession
+        commands: GCODE commands of the job
+        journal_file: if given, the job is journaled there (see
+                    job_journal.py)
+        resume: finish an unfinished journal of the same job and board
+                    instead of starting over. Never set by default: the
+                    board may have been moved or swapped since
+        board: identifies the board being soldered
+        setup: commands sent before the job and not journaled with it, e.g.
+                    the work offsets from panel.work_offset_gcode
+    """
+    journal = JobJournal(journal_file) if journal_file else None
+    try:
+        if setup:
+            send_commands(session.ensure_open(), setup)
+
+        if journal is None:
+            send_commands(session.ensure_open(), commands)
+            return
+
+        commands = list(commands)
+        previous = load_journal(journal_file)
+        if previous is not None and not previous["done"] and not resume:
+            print(f"Starting over, discarding the unfinished journal in {journal_file}")
+            previous = None
+        if previous is not None and not previous["done"]:
+            try:
+                homing = (session.settings or robot_config["parameters"]).get("$22")
+                preamble, start = resume_commands(commands, previous, board,
+                                                  homing=bool(homing))
+                print(f"Resuming interrupted job from command {start} "
+                      f"of {len(commands)}")
+                journal.resume(preamble, start)
+                commands = preamble + commands[start:]
+            except ValueError as error:
+                print(f"Not resuming: {error}")
+                previous = None
+        if previous is None or previous["done"]:
+            journal.start(commands, board)
+        send_commands(session.ensure_open(), commands, journal=journal)
+    except (serial.SerialException, OSError) as error:
+        print(f"Lost connection to the gantry: {error}")
+        session.close()
+    except GrblAlarm as alarm:
+        print(f"Job stopped, {alarm}")
+        session.close()
+    finally:
+        if journal is not None:
+            journal.close()
+
 def main():
-    # test port connection
-    connection = check_ports(PORT)
+    # connect once, the session is reused by every job
+    session = open_session(PORT)
   
     # read json file
-    if connection is True:
+    if session is not None:
         data = load_json()
         solder_list = format_json(data)
-        commands = generate_gcode(solder_list, 24)  # TO DO: change 24 to last_col
+        planner = PLANNERS[PLANNER](scale=SCALE)
+
+        # only the work offsets GRBL does not already hold are written
+        current = session.work_offsets()
+        offsets = PANEL_OFFSETS if PANEL_OFFSETS else [(0, 0)]
+        setup = work_offset_gcode(offsets, current)
+
+        if STREAM_GCODE:
+            run_job(session, queue_commands(stream_gcode(solder_list, planner)),
+                    setup=setup)
+            print(planner.report())
+            return
+
+        # reuse the compiled job if this board has been planned before
+        zhop = ZHopPlanner(format_components(data))
+        cache = JobCache()
+        key = cache.key(BOARD_FILE, compile_settings(planner, zhop))
+        job = cache.get(key)
+
+        if job is None:
+            job = compile_board(solder_list, planner, zhop=zhop)
+            cache.put(key, job)
+            print(planner.report())
+            print(zhop.report())
+        else:
+            print("Loaded compiled job from cache")
+
+        if PANEL_OFFSETS:
+            commands = panel_gcode(job, PANEL_OFFSETS)
+            estimate = estimate_job_time(panel_job(job, PANEL_OFFSETS))
+        else:
+            commands = job.to_gcode()
+            estimate = estimate_job_time(job)
+
+        print(f"Estimated job time: {estimate['total']:.1f} s (travel "
+              f"{estimate['travel']:.1f} s, z {estimate['z']:.1f} s, drag "
+              f"{estimate['drag']:.1f} s, dwell {estimate['dwell']:.1f} s)")
         # set_reference()
-        send_commands(PORT, commands)
+        run_job(session, commands, JOURNAL_FILE, resume=RESUME_JOB,
+                board=BOARD_ID, setup=setup)
     else: 
         print(f"Unable to connect to gantry through {PORT}")
 
@@ -0,0 +1,106 @@
+""" This Python module sends GRBL's realtime commands: single bytes that GRBL
+acts on the moment they arrive, even in the middle of a line, and that never
+take up room in its receive buffer. They are used to pause, resume and tune
+the feed and rapid speeds of a job while it is streaming """
+
+# constants
+STATUS_REPORT       = b'?'
+FEED_HOLD           = b'!'
+CYCLE_START         = b'~'
+SOFT_RESET          = b'\x18'
+JOG_CANCEL          = b'\x85'
+
+FEED_OVERRIDE_RESET = b'\x90' # back to 100%
+FEED_PLUS_10        = b'\x91'
+FEED_MINUS_10       = b'\x92'
+FEED_PLUS_1         = b'\x93'
+FEED_MINUS_1        = b'\x94'
+RAPID_OVERRIDES     = {100: b'\x95', 50: b'\x96', 25: b'\x97'}
+SPINDLE_OVERRIDE_RESET = b'\x99'
+SPINDLE_PLUS_10     = b'\x9A'
+SPINDLE_MINUS_10    = b'\x9B'
+SPINDLE_PLUS_1      = b'\x9C'
+SPINDLE_MINUS_1     = b'\x9D'
+
+FEED_LIMITS         = (10, 200) # feed override range GRBL allows (in %)
+SPINDLE_LIMITS      = (10, 200) # spindle override range GRBL allows (in %)
+
+############################## Helper Functions ###############################
+def _override_bytes(percent: int, limits: tuple, reset: bytes, plus_10: bytes,
+                    minus_10: bytes, plus_1: bytes, minus_1: bytes):
+    """ Bytes that take an override from 100% to percent, in steps of 10%
+    then 1% (GRBL has no command to set a value directly)
+    returns:
+        percent: the override GRBL ends up at, clamped to limits
+        command: realtime bytes to send
+    """
+    percent = int(round(min(max(percent, limits[0]), limits[1])))
+    change = percent - 100
+    tens, ones = divmod(abs(change), 10)
+    if change >= 0:
+        return percent, reset + plus_10 * tens + plus_1 * ones
+    return percent, reset + minus_10 * tens + minus_1 * ones
+
+################################## Control ####################################
+class RealtimeControl:
+    """ Out of band control of a running job. Every call writes straight to
+    the port, bypassing whatever line queue is streaming on it, so it can be
+    used from any thread (e.g. the UI) while send_commands or AsyncGrbl is
+    busy. GRBL reports the overrides it applied in the Ov field of its
+    status reports (see grbl_status.py) """
+
+    def __init__(self, ser):
+        """ parameters:
+            ser: open serial port connected to GRBL
+        """
+        self.ser = ser
+        self.feed_override = 100
+        self.rapid_override = 100
+        self.spindle_override = 100
+
+    def send(self, command: bytes) -> None:
+        """ Sends raw realtime bytes """
+
+        self.ser.write(command)
+
+    def feed_hold(self) -> None:
+        """ Decelerates to a stop and holds, keeping the rest of the job """
+
+        self.send(FEED_HOLD)
+
+    def resume(self) -> None:
+        """ Resumes after a feed hold """
+
+        self.send(CYCLE_START)
+
+    def soft_reset(self) -> None:
+        """ Stops immediately and throws away everything buffered. Position
+        may be lost if the machine was moving """
+
+        self.send(SOFT_RESET)
+
+    def set_feed_override(self, percent: int) -> None:
+        """ Scales every G1/G2/G3 feedrate, e.g. to trim the drag speed
+        (10% to 200%) """
+
+        self.feed_override, command = _override_bytes(
+            percent, FEED_LIMITS, FEED_OVERRIDE_RESET, FEED_PLUS_10,
+            FEED_MINUS_10, FEED_PLUS_1, FEED_MINUS_1)
+        self.send(command)
+
+    def set_rapid_override(self, percent: int) -> None:
+        """ Slows rapids (G0) down to 100%, 50% or 25% of the max rate """
+
+        if percent not in RAPID_OVERRIDES:
+            raise ValueError(f"Rapid override must be one of "
+                             f"{sorted(RAPID_OVERRIDES)}, not {percent}")
+        self.send(RAPID_OVERRIDES[percent])
+        self.rapid_override = percent
+
+    def set_spindle_override(self, percent: int) -> None:
+        """ Scales the spindle (spool feed motor) speed (10% to 200%) """
+
+        self.spindle_override, command = _override_bytes(
+            percent, SPINDLE_LIMITS, SPINDLE_OVERRIDE_RESET, SPINDLE_PLUS_10,
+            SPINDLE_MINUS_10, SPINDLE_PLUS_1, SPINDLE_MINUS_1)
+        self.send(command)
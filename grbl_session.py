@@ -0,0 +1,162 @@
+""" This Python module keeps one connection to GRBL open for as long as the
+program runs. Opening the port resets the Arduino, so instead of opening it
+for every job (and sleeping while GRBL boots) the port is opened once, GRBL
+is known to be ready as soon as its startup banner arrives, and the same
+session is reused by every job. A port that drops is reopened on next use """
+
+# imports
+import time
+import serial
+from grbl_realtime import RealtimeControl
+from grbl_settings import read_offsets, sync_settings
+
+# constants
+BAUDRATE            = 115200
+BANNER              = b'Grbl' # start of the line GRBL prints when it boots
+BANNER_TIMEOUT      = 3.0 # longest wait for the banner after opening (in s)
+PROBE_TIMEOUT       = 1.0 # longest wait for GRBL to answer a probe (in s)
+RECONNECT_ATTEMPTS  = 5
+RECONNECT_DELAY     = 1.0 # wait between reconnect attempts (in s)
+
+# one session per port, shared by every job
+_sessions = {}
+
+############################## Helper Functions ###############################
+def get_session(port: str, baudrate: int = BAUDRATE):
+    """ Returns the session for port, opening it the first time
+    parameters:
+        port: the COM port connecting the laptop to the gantry's
+                microcontroller
+        baudrate: serial baudrate
+    returns:
+        session: open GrblSession
+    """
+    session = _sessions.get(port)
+    if session is None:
+        session = _sessions[port] = GrblSession(port, baudrate)
+    session.ensure_open()
+    return session
+
+################################### Session ###################################
+class GrblSession:
+    """ A long lived connection to GRBL """
+
+    def __init__(self, port: str, baudrate: int = BAUDRATE):
+        """ parameters:
+            port: the COM port connecting the laptop to the gantry's
+                    microcontroller
+            baudrate: serial baudrate
+        """
+        self.port = port
+        self.baudrate = baudrate
+        self.ser = None
+        self.banner = None # startup banner, e.g. Grbl 1.1h ['$' for help]
+        self.opened = 0 # times the port has been opened
+        self.settings = None # last known $ settings, kept across reconnects
+
+    def __enter__(self):
+        self.ensure_open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def is_open(self) -> bool:
+        return self.ser is not None and self.ser.is_open
+
+    def open(self) -> None:
+        """ Opens the port and waits until GRBL is ready to take commands.
+        Boards that reset on open print a banner once GRBL has booted. If
+        none arrives (the board did not reset), GRBL is probed with an empty
+        line instead, which it answers with ok without touching its state
+        raises:
+            serial.SerialException: if the port cannot be opened or GRBL
+                never answers
+        """
+        self.ser = serial.Serial(port=self.port, baudrate=self.baudrate,
+                                 timeout=0.1)
+        self.opened += 1
+
+        self.banner = self._wait_for(lambda line: line.startswith(BANNER),
+                                     BANNER_TIMEOUT)
+        if self.banner is None:
+            self.ser.write(b'\n')
+            if self._wait_for(lambda line: line == b'ok', PROBE_TIMEOUT) is None:
+                self.close()
+                raise serial.SerialException(f"GRBL did not answer on {self.port}")
+
+        # drop whatever else GRBL printed while booting
+        self.ser.reset_input_buffer()
+
+    def close(self) -> None:
+        """ Closes the port. The next ensure_open reopens it """
+
+        if self.ser is not None:
+            try:
+                self.ser.close()
+            except serial.SerialException:
+                pass
+        self.ser = None
+
+    def ensure_open(self):
+        """ Returns the open port, reconnecting first if it has dropped """
+
+        if not self.is_open:
+            self.reconnect()
+        return self.ser
+
+    def reconnect(self, attempts: int = RECONNECT_ATTEMPTS,
+                  delay: float = RECONNECT_DELAY) -> None:
+        """ Closes and reopens the port, retrying while the board comes back
+        raises:
+            serial.SerialException: if every attempt fails
+        """
+        self.close()
+        for attempt in range(attempts):
+            try:
+                self.open()
+                return
+            except serial.SerialException as error:
+                print(f"Connecting to {self.port} failed ({error}), "
+                      f"{attempts - attempt - 1} attempts left")
+                if attempt + 1 < attempts:
+                    time.sleep(delay)
+
+        raise serial.SerialException(f"Unable to connect to GRBL on {self.port}")
+
+    def control(self) -> RealtimeControl:
+        """ Realtime control (feed hold, overrides) of whatever job is
+        running on this session. Safe to use from another thread while
+        send_commands is streaming """
+
+        return RealtimeControl(self.ensure_open())
+
+    def sync_settings(self, wanted: dict) -> dict:
+        """ Makes GRBL's $ settings match wanted (see
+        grbl_settings.sync_settings). The settings are remembered, so syncing
+        again after a reconnect does not touch the port when nothing changed
+        returns:
+            written: the settings that were written
+        """
+        self.settings, written = sync_settings(self.ensure_open(), wanted,
+                                               self.settings)
+        return written
+
+    def work_offsets(self) -> dict:
+        """ GRBL's work coordinate offsets (see grbl_settings.read_offsets).
+        Always read afresh, as jobs change them """
+
+        return read_offsets(self.ensure_open())
+
+    def _wait_for(self, match, timeout: float):
+        """ Reads lines until one matches or timeout seconds pass
+        returns:
+            line: the matching line (stripped bytes), None on timeout
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            line = self.ser.readline().strip()
+            if line and match(line):
+                return line
+        return None
@@ -0,0 +1,138 @@
+""" This Python module brings GRBL's $ settings in line with a config (see
+old_330_code/config.py). The current settings are read once with $$ and
+only the ones that differ are written, so unchanged settings never cost an
+EEPROM write. Work coordinate offsets are read the same way (with $#), so
+the offsets a job needs are only written when GRBL does not hold them """
+
+# imports
+import time
+
+# constants
+DECIMALS        = 3 # GRBL reports settings to this many decimals
+ANSWER_TIMEOUT  = 2.0 # longest wait for GRBL to answer a $ command (in s)
+
+############################## Helper Functions ###############################
+def parse_settings(lines) -> dict:
+    """ Parses the $N=value lines GRBL prints for $$
+    parameters:
+        lines: lines of the $$ answer (other lines are skipped)
+    returns:
+        settings: value of every setting, keyed by "$N"
+    """
+    settings = {}
+    for line in lines:
+        key, equals, value = line.strip().partition('=')
+        if not equals or not key.startswith('$') or not key[1:].isdigit():
+            continue
+        try:
+            settings[key] = float(value)
+        except ValueError:
+            continue
+
+    return settings
+
+def parse_offsets(lines) -> dict:
+    """ Parses the [G54:x,y,z] ... [G59:x,y,z] lines GRBL prints for $#
+    parameters:
+        lines: lines of the $# answer (other lines are skipped)
+    returns:
+        offsets: x, y of every work coordinate system, keyed by slot
+                    (1 = G54 ... 6 = G59)
+    """
+    offsets = {}
+    for line in lines:
+        name, colon, values = line.strip().strip('[]').partition(':')
+        if not colon or name not in ('G54', 'G55', 'G56', 'G57', 'G58', 'G59'):
+            continue
+        try:
+            x, y = (float(value) for value in values.split(',')[:2])
+        except ValueError:
+            continue
+        offsets[int(name[1:]) - 53] = (x, y)
+
+    return offsets
+
+def offsets_diff(current: dict, wanted: list) -> dict:
+    """ Work offsets in wanted (x, y of slot 1, 2, ...) that GRBL does not
+    already hold, compared at the precision GRBL reports them with """
+
+    return {slot: (x, y) for slot, (x, y) in enumerate(wanted, start=1)
+            if slot not in current
+            or [round(float(value), DECIMALS) for value in current[slot]]
+            != [round(float(x), DECIMALS), round(float(y), DECIMALS)]}
+
+def settings_diff(current: dict, wanted: dict) -> dict:
+    """ Settings in wanted that GRBL does not already have, compared at the
+    precision GRBL reports them with """
+
+    return {key: value for key, value in wanted.items()
+            if key not in current
+            or round(float(current[key]), DECIMALS) != round(float(value), DECIMALS)}
+
+def _command(ser, command: str, timeout: float = ANSWER_TIMEOUT):
+    """ Sends one line and collects what GRBL prints until it answers
+    returns:
+        lines: everything printed before the answer
+        answer: ok or error:N
+    raises:
+        TimeoutError: if GRBL does not answer in time
+    """
+    ser.write((command + '\n').encode('ascii'))
+
+    lines = []
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        line = ser.readline().decode('ascii', errors='replace').strip()
+        if line == 'ok' or line.startswith('error'):
+            return lines, line
+        if line:
+            lines.append(line)
+
+    raise TimeoutError(f"GRBL did not answer {command}")
+
+################################# Settings Sync ###############################
+def read_settings(ser) -> dict:
+    """ Reads every setting from GRBL with $$ """
+
+    lines, answer = _command(ser, '$$')
+    if answer != 'ok':
+        raise ValueError(f"GRBL refused $$: {answer}")
+    return parse_settings(lines)
+
+def read_offsets(ser) -> dict:
+    """ Reads every work coordinate offset from GRBL with $# """
+
+    lines, answer = _command(ser, '$#')
+    if answer != 'ok':
+        raise ValueError(f"GRBL refused $#: {answer}")
+    return parse_offsets(lines)
+
+def sync_settings(ser, wanted: dict, known: dict = None):
+    """ Writes the settings that differ from wanted. Each write waits for its
+    ok before the next is sent, with no fixed sleeps: GRBL stops listening to
+    the serial port while it writes EEPROM, so lines streamed behind a
+    setting could be lost
+    parameters:
+        ser: open serial port connected to GRBL (idle or in alarm)
+        wanted: settings to apply, keyed by "$N"
+        known: settings GRBL is already known to have (e.g. from the last
+                sync on this port). If none of wanted differ from them, GRBL
+                is not asked at all
+    returns:
+        settings: GRBL's settings after the sync, to pass back in as known
+        written: the settings that were written
+    raises:
+        ValueError: if GRBL refuses a setting
+    """
+    if known is not None and not settings_diff(known, wanted):
+        return known, {}
+
+    settings = read_settings(ser)
+    written = settings_diff(settings, wanted)
+    for key, value in written.items():
+        _, answer = _command(ser, f'{key}={value}')
+        if answer != 'ok':
+            raise ValueError(f"GRBL refused {key}={value}: {answer}")
+        settings[key] = float(value)
+
+    return settings, written
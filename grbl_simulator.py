@@ -0,0 +1,497 @@
+""" This Python module simulates a GRBL 1.1 controller on a pseudo-terminal,
+so the sender can be run and timed without the gantry attached. Pass the
+simulator's port (e.g. /dev/pts/3) wherever a COM port is expected. Motion
+is timed from the max rates and accelerations in old_330_code/config.py.
+POSIX only (pty) """
+
+# imports
+import math
+import os
+import re
+import select
+import threading
+import time
+import tty
+from collections import deque
+from motion import move_time
+from old_330_code.config import robot_config
+
+# constants
+RX_BUFFER_SIZE  = 128 # bytes in GRBL's serial receive buffer
+PLANNER_BLOCKS  = 15 # motion blocks GRBL can plan ahead
+BANNER          = "Grbl 1.1h ['$' for help]"
+WCO_EVERY       = 10 # status reports between work coordinate offset reports
+TICK            = 0.001 # longest the simulator sleeps between updates (in s)
+
+# GRBL 1.1 defaults, overridden by the config the simulator is built with
+DEFAULT_SETTINGS = {
+    "$0": 10, "$1": 25, "$2": 0, "$3": 0, "$4": 0, "$5": 0, "$6": 0,
+    "$10": 1, "$11": 0.010, "$12": 0.002, "$13": 0,
+    "$20": 0, "$21": 0, "$22": 0, "$23": 0, "$24": 25.0, "$25": 500.0,
+    "$26": 250, "$27": 1.0, "$30": 1000.0, "$31": 0.0, "$32": 0,
+    "$100": 250.0, "$101": 250.0, "$102": 250.0,
+    "$110": 500.0, "$111": 500.0, "$112": 500.0,
+    "$120": 10.0, "$121": 10.0, "$122": 10.0,
+    "$130": 200.0, "$131": 200.0, "$132": 200.0,
+}
+INTEGER_SETTINGS = {"$0", "$1", "$2", "$3", "$4", "$5", "$6", "$10", "$13",
+                    "$20", "$21", "$22", "$23", "$26", "$32"}
+
+# realtime commands, acted on as soon as they arrive
+STATUS_REQUEST  = ord('?')
+FEED_HOLD       = ord('!')
+CYCLE_START     = ord('~')
+SOFT_RESET      = 0x18
+FEED_OVERRIDES  = {0x91: 10, 0x92: -10, 0x93: 1, 0x94: -1} # change in %
+RAPID_OVERRIDES = {0x95: 100, 0x96: 50, 0x97: 25}
+SPINDLE_OVERRIDES = {0x9A: 10, 0x9B: -10, 0x9C: 1, 0x9D: -1}
+FEED_OVERRIDE_RESET = 0x90
+SPINDLE_OVERRIDE_RESET = 0x99
+
+# GRBL error codes used by the simulator
+ERROR_EXPECTED_COMMAND  = 1
+ERROR_BAD_NUMBER        = 2
+ERROR_INVALID_STATEMENT = 3
+ERROR_SETTING_DISABLED  = 5
+ERROR_ALARM_LOCK        = 9
+ERROR_UNSUPPORTED       = 20
+ERROR_UNDEFINED_FEED    = 22
+
+WORD = re.compile(r'([A-Z])([-+]?(?:\d+\.?\d*|\.\d+))')
+
+############################## Helper Functions ###############################
+def _strip_comments(line: str) -> str:
+    """ Removes (comments), ; comments and spaces, and upper cases the rest """
+
+    line = re.sub(r'\(.*?\)', '', line).split(';')[0]
+    return line.replace(' ', '').upper()
+
+def _arc_length(start, end, centre, clockwise: bool) -> float:
+    """ Length of an xy arc from start to end around start + centre """
+
+    start_x, start_y = -centre[0], -centre[1]
+    end_x = end[0] - start[0] - centre[0]
+    end_y = end[1] - start[1] - centre[1]
+    sweep = math.atan2(start_x * end_y - start_y * end_x,
+                       start_x * end_x + start_y * end_y)
+    if clockwise:
+        sweep = -sweep
+    sweep %= 2 * math.pi
+    return math.hypot(*centre) * (sweep or 2 * math.pi)
+
+################################## Simulator ##################################
+class GrblSimulator:
+    """ A GRBL 1.1 look-alike on a pseudo-terminal. It has:
+        - a 128 byte receive buffer. Bytes that do not fit are dropped and
+            counted, like on the real board
+        - a 15 block planner. Motion lines are answered as soon as they are
+            planned, and wait in the receive buffer while the planner is full
+        - ok/error:N answers, ? status reports, ! and ~ feed hold, ctrl-x
+            soft reset, feed/rapid/spindle overrides, $$ $N=value $X $H $#
+            $G $I
+        - G0 G1 G2 G3 G4 G10 L2 G17 G21 G28 G28.1 G54-G59 G90 G91 M3 M4 M5
+    Each block takes as long as a start-stop move under the configured rates
+    and accelerations (see motion.move_time), divided by speed. G4, spindle
+    and $ commands wait for the planner to empty first, as on GRBL.
+    Use as a context manager so the pty is always closed """
+
+    def __init__(self, config: dict = robot_config, speed: float = 1.0,
+                 rx_buffer: int = RX_BUFFER_SIZE,
+                 planner_blocks: int = PLANNER_BLOCKS):
+        """ parameters:
+            config: GRBL config ("parameters" dict of $ settings)
+            speed: how many times faster than real time the gantry moves
+            rx_buffer: size of the receive buffer (in bytes)
+            planner_blocks: number of blocks the planner holds
+        """
+        self.settings = dict(DEFAULT_SETTINGS)
+        self.settings.update(config["parameters"])
+        self.speed = speed
+        self.rx_buffer = rx_buffer
+        self.planner_blocks = planner_blocks
+        self.port = None
+        self.stats = {}
+
+        self._master = None
+        self._slave = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._reset()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        """ Opens the pty and starts answering on it, returns the simulator """
+
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """ Stops the simulator and closes the pty """
+
+        self._stop.set()
+        self._thread.join()
+        os.close(self._master)
+        os.close(self._slave)
+
+    ############################### Machine State #############################
+    def _reset(self) -> None:
+        """ Power up / soft reset: empties the buffers and, with homing
+        enabled, locks the machine until it is homed or unlocked """
+
+        self._rx = bytearray()
+        self._planner = deque() # [duration, start, end, rapid] in machine mm
+        self._elapsed = 0.0 # sim time spent on the head block
+        self._busy = 0.0 # sim time left on a dwell or homing cycle
+        self._busy_answer = None
+        self._hold = False
+        self._alarm = bool(self.settings["$22"])
+        self._position = [0.0, 0.0, 0.0] # where the last planned block ends
+        self._home = [0.0, 0.0, 0.0] # G28 position
+        self._offsets = {slot: [0.0, 0.0, 0.0] for slot in range(1, 7)}
+        self._slot = 1
+        self._relative = False
+        self._motion = 0
+        self._feed = 0.0
+        self._spindle = 0.0
+        self._reports = 0
+        self._overrides = [100, 100, 100] # feed, rapid, spindle (in %)
+        self.stats = {"lines": 0, "bytes": 0, "overflows": 0, "max_rx": 0,
+                      "blocks": 0, "occupancy": 0.0, "moving": 0.0}
+
+    def _state(self) -> str:
+        if self._alarm:
+            return "Alarm"
+        if self._hold:
+            return "Hold:0"
+        if self._planner or self._busy > 0:
+            return "Run"
+        return "Idle"
+
+    def _machine_position(self) -> list:
+        """ Where the tool is right now, part way along the head block """
+
+        if not self._planner:
+            return list(self._position)
+
+        duration, start, end, _ = self._planner[0]
+        fraction = min(self._elapsed / duration, 1.0) if duration else 1.0
+        return [a + (b - a) * fraction for a, b in zip(start, end)]
+
+    def _status_report(self) -> str:
+        mpos = ','.join(f'{value:.3f}' for value in self._machine_position())
+        rx_free = self.rx_buffer - len(self._rx)
+        blocks_free = self.planner_blocks - len(self._planner)
+        feed = self._feed if self._planner else 0
+        report = (f'<{self._state()}|MPos:{mpos}|Bf:{blocks_free},{rx_free}'
+                  f'|FS:{feed:g},{self._spindle:g}'
+                  f'|Ov:{",".join(str(value) for value in self._overrides)}')
+        if self._reports % WCO_EVERY == 0:
+            wco = ','.join(f'{value:.3f}' for value in self._offsets[self._slot])
+            report += f'|WCO:{wco}'
+        self._reports += 1
+        return report + '>'
+
+    ################################## I/O ###################################
+    def _write(self, text: str) -> None:
+        os.write(self._master, (text + '\r\n').encode('ascii'))
+
+    def _run(self) -> None:
+        """ Simulator thread: reads the pty, advances the clock, runs lines """
+
+        last = time.monotonic()
+        while not self._stop.is_set():
+            readable, _, _ = select.select([self._master], [], [], TICK)
+            if readable:
+                try:
+                    self._receive(os.read(self._master, 1024))
+                except OSError:
+                    break # host hung up
+
+            now = time.monotonic()
+            self._advance((now - last) * self.speed)
+            last = now
+            self._execute()
+
+    def _receive(self, data: bytes) -> None:
+        """ Acts on realtime commands straight away and buffers the rest """
+
+        for byte in data:
+            if byte == STATUS_REQUEST:
+                self._write(self._status_report())
+            elif byte == FEED_HOLD:
+                self._hold = bool(self._planner) or self._busy > 0
+            elif byte == CYCLE_START:
+                self._hold = False
+            elif byte == SOFT_RESET:
+                self._reset()
+                self._write('')
+                self._write(BANNER)
+            elif byte >= 0x80:
+                self._override(byte)
+            elif len(self._rx) >= self.rx_buffer:
+                self.stats["overflows"] += 1
+            else:
+                self._rx.append(byte)
+        self.stats["max_rx"] = max(self.stats["max_rx"], len(self._rx))
+
+    def _override(self, byte: int) -> None:
+        """ Applies a feed, rapid or spindle override byte """
+
+        feed, rapid, spindle = self._overrides
+        if byte == FEED_OVERRIDE_RESET:
+            feed = 100
+        elif byte in FEED_OVERRIDES:
+            feed = min(max(feed + FEED_OVERRIDES[byte], 10), 200)
+        elif byte in RAPID_OVERRIDES:
+            rapid = RAPID_OVERRIDES[byte]
+        elif byte == SPINDLE_OVERRIDE_RESET:
+            spindle = 100
+        elif byte in SPINDLE_OVERRIDES:
+            spindle = min(max(spindle + SPINDLE_OVERRIDES[byte], 10), 200)
+        self._overrides = [feed, rapid, spindle]
+
+    def _advance(self, dt: float) -> None:
+        """ Moves the simulated clock on by dt seconds of machine time """
+
+        if self._hold or dt <= 0:
+            return
+
+        self.stats["occupancy"] += len(self._planner) * dt
+        if self._planner:
+            self.stats["moving"] += dt
+
+        if self._busy > 0:
+            self._busy -= dt
+            if self._busy <= 0 and self._busy_answer is not None:
+                self._finish_busy()
+            return
+
+        # overrides speed up or slow down the block being run
+        if self._planner:
+            dt *= self._overrides[1 if self._planner[0][3] else 0] / 100
+        self._elapsed += dt
+        while self._planner and self._elapsed >= self._planner[0][0]:
+            self._elapsed -= self._planner.popleft()[0]
+        if not self._planner:
+            self._elapsed = 0.0
+
+    def _finish_busy(self) -> None:
+        answer, self._busy_answer = self._busy_answer, None
+        for line in answer:
+            self._write(line)
+
+    def _execute(self) -> None:
+        """ Runs buffered lines for as long as the machine can take them """
+
+        while self._busy <= 0:
+            end = next((k for k, byte in enumerate(self._rx)
+                        if byte in b'\r\n'), None)
+            if end is None:
+                return
+
+            line = self._rx[:end].decode('ascii', errors='replace')
+            clean = _strip_comments(line)
+            if self._needs_room(clean) and len(self._planner) >= self.planner_blocks:
+                return
+            if self._needs_sync(clean) and (self._planner or self._busy > 0):
+                return
+
+            del self._rx[:end + 1]
+            self.stats["lines"] += 1
+            self.stats["bytes"] += end + 1
+
+            answer = self._line(clean)
+            if self._busy > 0:
+                self._busy_answer = answer
+            else:
+                for reply in answer:
+                    self._write(reply)
+
+    def _needs_room(self, line: str) -> bool:
+        """ Lines that add a block to the planner """
+
+        return bool(line) and line[0] != '$' and not self._needs_sync(line)
+
+    def _needs_sync(self, line: str) -> bool:
+        """ Lines GRBL only runs once every planned move has finished """
+
+        if line.startswith('$'):
+            return True
+        codes = {letter + number for letter, number in WORD.findall(line)
+                 if letter in 'GM'}
+        return (any(code[0] == 'M' for code in codes)
+                or bool(codes & {'G4', 'G10', 'G28.1'}))
+
+    ################################# Commands ###############################
+    def _line(self, line: str) -> list:
+        """ Runs one line
+        returns:
+            answer: lines to send back, ending in ok or error:N
+        """
+        if not line:
+            return ['ok']
+        if line.startswith('$'):
+            return self._system(line)
+        if self._alarm:
+            return [f'error:{ERROR_ALARM_LOCK}']
+        return self._gcode(line)
+
+    def _system(self, line: str) -> list:
+        """ $ commands """
+
+        if line == '$$':
+            return [f'{key}={self._format_setting(key)}'
+                    for key in sorted(self.settings, key=lambda k: int(k[1:]))] + ['ok']
+        if line == '$X':
+            self._alarm = False
+            return ['[MSG:Caution: Unlocked]', 'ok']
+        if line == '$H':
+            if not self.settings["$22"]:
+                return [f'error:{ERROR_SETTING_DISABLED}']
+            distance = math.hypot(*self._position)
+            self._busy = distance / (self.settings["$24"] / 60) + 1.0
+            self._position = [0.0, 0.0, 0.0]
+            self._alarm = False
+            return ['ok']
+        if line == '$#':
+            return [f'[G{53 + slot}:' + ','.join(f'{v:.3f}' for v in offset) + ']'
+                    for slot, offset in self._offsets.items()] \
+                + ['[G28:' + ','.join(f'{v:.3f}' for v in self._home) + ']', 'ok']
+        if line == '$G':
+            return [f'[GC:G{self._motion} G{53 + self._slot} G17 G21 '
+                    f'G{91 if self._relative else 90} G94 '
+                    f'M{3 if self._spindle else 5} M9 T0 F{self._feed:g} '
+                    f'S{self._spindle:g}]', 'ok']
+        if line == '$I':
+            return ['[VER:1.1h.20190825:]',
+                    f'[OPT:V,{self.planner_blocks},{self.rx_buffer}]', 'ok']
+
+        key, equals, value = line.partition('=')
+        if equals and key[1:].isdigit():
+            try:
+                self.settings[key] = float(value)
+            except ValueError:
+                return [f'error:{ERROR_BAD_NUMBER}']
+            return ['ok']
+        return [f'error:{ERROR_INVALID_STATEMENT}']
+
+    def _format_setting(self, key: str) -> str:
+        value = self.settings[key]
+        if key in INTEGER_SETTINGS:
+            return str(int(value))
+        return f'{value:.3f}'
+
+    def _gcode(self, line: str) -> list:
+        """ G and M code lines """
+
+        words = WORD.findall(line)
+        if ''.join(letter + number for letter, number in words) != line:
+            return [f'error:{ERROR_EXPECTED_COMMAND}']
+
+        values = {}
+        codes = []
+        for letter, number in words:
+            if letter in 'GM':
+                codes.append(letter + number.rstrip('0').rstrip('.')
+                             if '.' in number else letter + str(int(number)))
+            else:
+                values[letter] = float(number)
+
+        motion = None
+        for code in codes:
+            if code in ('G0', 'G1', 'G2', 'G3'):
+                motion = int(code[1])
+            elif code == 'G4':
+                self._busy = values.get('P', 0.0)
+                return ['ok']
+            elif code == 'G10':
+                if values.get('L') != 2 or 'P' not in values:
+                    return [f'error:{ERROR_UNSUPPORTED}']
+                offset = self._offsets[int(values['P']) or self._slot]
+                for axis, letter in enumerate('XYZ'):
+                    if letter in values:
+                        offset[axis] = values[letter]
+                return ['ok']
+            elif code == 'G28':
+                self._plan(0, list(self._home))
+                return ['ok']
+            elif code == 'G28.1':
+                self._home = list(self._position)
+                return ['ok']
+            elif code in ('G54', 'G55', 'G56', 'G57', 'G58', 'G59'):
+                self._slot = int(code[1:]) - 53
+            elif code in ('G90', 'G91'):
+                self._relative = code == 'G91'
+            elif code in ('M3', 'M4'):
+                self._spindle = values.get('S', self._spindle)
+            elif code == 'M5':
+                self._spindle = 0.0
+            elif code not in ('G17', 'G21', 'G94'):
+                return [f'error:{ERROR_UNSUPPORTED}']
+
+        if 'F' in values:
+            self._feed = values['F']
+        if motion is not None:
+            self._motion = motion
+        if not any(letter in values for letter in 'XYZ'):
+            return ['ok']
+
+        # target in machine coordinates
+        offset = self._offsets[self._slot]
+        target = list(self._position)
+        for axis, letter in enumerate('XYZ'):
+            if letter in values:
+                if self._relative:
+                    target[axis] += values[letter]
+                else:
+                    target[axis] = values[letter] + offset[axis]
+
+        if self._motion != 0 and self._feed <= 0:
+            return [f'error:{ERROR_UNDEFINED_FEED}']
+        centre = (values.get('I', 0.0), values.get('J', 0.0))
+        self._plan(self._motion, target, centre)
+        return ['ok']
+
+    def _plan(self, motion: int, target: list, centre=(0.0, 0.0)) -> None:
+        """ Adds a block moving to target to the planner """
+
+        start = list(self._position)
+        delta = [b - a for a, b in zip(start, target)]
+        feed = None if motion == 0 else self._feed
+
+        if motion in (2, 3):
+            length = _arc_length(start, target, centre, motion == 2)
+            chord = math.hypot(delta[0], delta[1])
+            stretch = length / chord if chord else 1.0
+            delta = [delta[0] * stretch if chord else length, delta[1] * stretch,
+                     delta[2]]
+
+        config = {"parameters": self.settings}
+        duration = float(move_time(*delta, feedrate=feed, config=config))
+        if duration > 0:
+            self._planner.append([duration, start, target, motion == 0])
+            self.stats["blocks"] += 1
+        self._position = target
+
+def main():
+    """ Runs a simulator until interrupted, e.g. to point the GUI at it """
+
+    with GrblSimulator() as simulator:
+        print(f"Simulated GRBL on {simulator.port}")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+""" This Python module keeps track of what the gantry is doing. A background
+thread asks GRBL for a status report at a fixed rate and keeps the latest one
+in a shared snapshot, so the sender and the UI never have to poll the port
+themselves """
+
+# imports
+import queue
+import threading
+import time
+import serial
+
+# constants
+STATUS_RATE     = 10 # status reports requested per second (GRBL handles 5-20)
+IDLE_TIMEOUT    = 120.0 # longest wait for the gantry to finish a move (in s)
+CHECK_INTERVAL  = 0.5 # how often waits check that the port is still alive (in s)
+
+############################## Helper Functions ###############################
+def _field_value(value: str):
+    """ Converts a status report field to a tuple of numbers when it is one
+    (MPos, FS, Bf, ...) and leaves it as text otherwise (Pn, A) """
+
+    try:
+        return tuple(float(number) for number in value.split(','))
+    except ValueError:
+        return value
+
+def parse_status(report: str) -> dict:
+    """ Parses a GRBL 1.1 status report
+    parameters:
+        report: status report, e.g. <Run|MPos:1.000,2.000,0.000|FS:500,0>
+    returns:
+        status: "state" (Idle, Run, Hold, Alarm, ...), "substate" for states
+                    that have one (Hold:0) and one entry per field, named in
+                    lower case (mpos, wpos, wco, fs, bf, ov, pn, ...)
+    """
+    fields = report.strip().strip('<>').split('|')
+    state, _, substate = fields[0].partition(':')
+    status = {"state": state}
+    if substate:
+        status["substate"] = int(substate)
+
+    for field in fields[1:]:
+        name, _, value = field.partition(':')
+        status[name.lower()] = _field_value(value)
+
+    return status
+
+################################ Machine State ################################
+class MachineState:
+    """ Thread safe snapshot of the latest status report. The work
+    coordinate offset (WCO) is only sent every few reports, so the last one
+    seen is kept and used to fill in whichever of mpos/wpos is missing.
+    Threads can wait on the idle and alarm events instead of polling """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._updated = threading.Condition(self._lock)
+        self._status = {}
+        self._reports = 0
+        self.idle = threading.Event()
+        self.alarm = threading.Event()
+
+    def update(self, report: str) -> None:
+        """ Merges a new status report into the snapshot and wakes up anyone
+        waiting on it """
+
+        status = parse_status(report)
+
+        with self._lock:
+            if "wco" not in status and "wco" in self._status:
+                status["wco"] = self._status["wco"]
+            if "wco" in status:
+                offset = status["wco"]
+                if "mpos" in status:
+                    status["wpos"] = tuple(m - o for m, o in zip(status["mpos"], offset))
+                elif "wpos" in status:
+                    status["mpos"] = tuple(w + o for w, o in zip(status["wpos"], offset))
+            status["time"] = time.monotonic()
+
+            self._status = status
+            self._reports += 1
+            self._updated.notify_all()
+
+        (self.idle.set if status["state"] == "Idle" else self.idle.clear)()
+        (self.alarm.set if status["state"] == "Alarm" else self.alarm.clear)()
+
+    def snapshot(self) -> dict:
+        """ Copy of the latest status (empty until the first report) """
+
+        with self._lock:
+            return dict(self._status)
+
+    def wait_for(self, predicate, timeout: float = None) -> bool:
+        """ Blocks until a status report arrives that predicate(status) is True
+        for, or timeout seconds pass. Only reports received after the call
+        count, so a stale Idle from before the last command is not mistaken
+        for the machine having finished it
+        returns:
+            met: False if it timed out
+        """
+        with self._updated:
+            seen = self._reports
+            return self._updated.wait_for(
+                lambda: self._reports > seen and predicate(self._status),
+                timeout)
+
+    def wait_idle(self, timeout: float = None) -> bool:
+        """ Blocks until GRBL reports Idle (see wait_for) """
+
+        return self.wait_for(lambda status: status["state"] == "Idle", timeout)
+
+################################ Status Monitor ###############################
+class StatusMonitor:
+    """ Background thread that owns reading from the serial port. It sends the
+    realtime status request (?) rate times a second, feeds every status
+    report into state, and queues every other line GRBL sends (ok, error:N,
+    ALARM:N, [MSG:...]) on responses for the sender to consume.
+    If the port fails, the exception is kept in error and also queued on
+    responses, so a sender waiting for an answer raises it instead of
+    waiting forever. Use as a context manager so the thread is always
+    stopped """
+
+    def __init__(self, ser, rate: float = STATUS_RATE, state: MachineState = None):
+        """ parameters:
+            ser: open serial port connected to GRBL. Its read timeout is
+                        shortened so the thread can keep polling, and put
+                        back when the monitor stops
+            rate: status reports requested per second
+            state: snapshot to keep up to date, a new one if None
+        """
+        self.ser = ser
+        self.rate = rate
+        self.state = MachineState() if state is None else state
+        self.responses = queue.Queue()
+        self.error = None # exception that stopped the thread
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._timeout = None # the port's own read timeout
+
+    def start(self):
+        """ Starts polling, returns the monitor """
+
+        self._timeout = self.ser.timeout
+        self.ser.timeout = 0.5 / self.rate
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """ Stops polling, waits for the thread to finish and gives the port
+        its read timeout back """
+
+        self._stop.set()
+        self._thread.join()
+        try:
+            self.ser.timeout = self._timeout
+        except (serial.SerialException, OSError):
+            pass # the port is gone
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def check(self) -> None:
+        """ Raises the error that stopped the thread, if there was one """
+
+        if self.error is not None:
+            raise self.error
+
+    def wait_idle(self, timeout: float = IDLE_TIMEOUT) -> None:
+        """ Blocks until GRBL reports Idle
+        raises:
+            serial.SerialException: if the port failed while waiting
+            TimeoutError: if GRBL is not Idle within timeout seconds
+        """
+        deadline = time.monotonic() + timeout
+        while not self.state.wait_idle(CHECK_INTERVAL):
+            self.check()
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"GRBL not Idle after {timeout} s")
+
+    def _run(self) -> None:
+        """ Reads until stopped, handing any port error to the sender """
+
+        try:
+            self._poll()
+        except (serial.SerialException, OSError) as error:
+            self.error = error
+            self.responses.put(error)
+
+    def _poll(self) -> None:
+        """ Polls and reads until stopped. Reads can time out halfway through
+        a line, so partial lines are kept until the rest arrives """
+
+        next_poll = 0.0
+        partial = b''
+
+        while not self._stop.is_set():
+            now = time.monotonic()
+            if now >= next_poll:
+                self.ser.write(b'?')
+                next_poll = now + 1 / self.rate
+
+            partial += self.ser.readline()
+            if not partial.endswith(b'\n'):
+                continue
+
+            line = partial.decode('ascii', errors='replace').strip()
+            partial = b''
+            if line.startswith('<'):
+                self.state.update(line)
+            elif line:
+                self.responses.put(line)
@@ -0,0 +1,155 @@
+""" This Python module streams GCODE to GRBL with the character counting
+protocol: instead of waiting for an ok after every line, it keeps as many
+lines in flight as fit in GRBL's serial receive buffer, so the planner buffer
+never runs dry between moves """
+
+# imports
+import queue
+import time
+from collections import deque
+from grbl_realtime import RealtimeControl
+
+# constants
+RX_BUFFER_SIZE  = 128 # bytes GRBL can hold in its serial receive buffer
+SYNC_COMMAND    = 'G4 P0' # GRBL only acknowledges this once every move
+                          # before it has finished
+EEPROM_COMMANDS = ('G10', 'G28.1', 'G30.1', '$') # GRBL stores these in EEPROM and
+                                                 # stops reading serial meanwhile
+ANSWER_TIMEOUT  = 120.0 # longest wait for GRBL to answer a line (in s), a
+                        # sync can wait for a full planner of slow moves
+
+class GrblAlarm(Exception):
+    """ GRBL reported ALARM:N and stopped. It takes no more motion until it
+    is unlocked or reset, and its position may be lost """
+
+    def __init__(self, response: str):
+        super().__init__(f"GRBL alarm: {response}")
+        self.code = int(response.partition(':')[2] or 0)
+
+############################## Helper Functions ###############################
+def is_eeprom_command(command: str) -> bool:
+    """ True for lines GRBL stores in EEPROM (work offsets, stored positions,
+    $ settings), during which it drops serial input """
+
+    command = command.strip().upper()
+    return command.startswith('$') or command.split(' ', 1)[0] in EEPROM_COMMANDS
+
+################################## Streamer ###################################
+class GrblStreamer:
+    """ Sends GCODE lines to GRBL while tracking how many bytes are sitting
+    unacknowledged in its receive buffer. GRBL answers every line with ok or
+    error:N, in order, so each answer is matched back to the oldest line in
+    flight. Anything else GRBL sends (status reports, [MSG:...]) is printed """
+
+    def __init__(self, ser, rx_buffer: int = RX_BUFFER_SIZE, responses=None,
+                 on_answer=None):
+        """ parameters:
+            ser: open serial port connected to GRBL
+            rx_buffer: size of GRBL's receive buffer (in bytes)
+            responses: queue to take GRBL's answers from when another thread
+                        owns reading the port (see grbl_status.StatusMonitor).
+                        If None, they are read from the port directly
+            on_answer: optional function called as on_answer(index, command,
+                        response) whenever GRBL answers one of the commands
+                        passed to stream, index being its position there
+        """
+        self.ser = ser
+        self.rx_buffer = rx_buffer
+        self.responses = responses
+        self.on_answer = on_answer
+        self.pending = deque() # (index, command, bytes) not answered yet
+        self.in_flight = 0
+        self.errors = [] # (command, response) for every line GRBL rejected
+        self.control = RealtimeControl(ser) # feed hold and overrides
+
+    def send(self, command: str, index: int = None) -> None:
+        """ Sends one line, first waiting for answers until there is room for
+        it in GRBL's receive buffer. index is passed back to on_answer """
+
+        line = (command.strip() + '\n').encode('ascii')
+        if len(line) > self.rx_buffer:
+            raise ValueError(f"Command longer than the receive buffer: {command}")
+
+        while self.in_flight + len(line) > self.rx_buffer:
+            self._receive()
+
+        self.ser.write(line)
+        self.pending.append((index, command, len(line)))
+        self.in_flight += len(line)
+
+    def drain(self) -> None:
+        """ Waits until every line sent so far has been answered. This only
+        means GRBL has accepted them, not that the moves are done """
+
+        while self.pending:
+            self._receive()
+
+    def sync(self) -> None:
+        """ Waits until GRBL has finished every move sent so far """
+
+        self.send(SYNC_COMMAND)
+        self.drain()
+
+    def stream(self, commands, host_wait=None) -> list:
+        """ Streams commands to GRBL, keeping its receive buffer full
+        parameters:
+            commands: any iterable of GCODE commands
+            host_wait: optional function giving how long (in s) the host has
+                        to wait once a command has been carried out, e.g.
+                        while solder melts. Those commands become sync
+                        points: the stream is drained, the machine is left
+                        to finish, then the host sleeps
+        returns:
+            errors: (command, response) for every line GRBL rejected
+        """
+        for index, command in enumerate(commands):
+            if is_eeprom_command(command):
+                # nothing may arrive while GRBL writes EEPROM, so the buffer
+                # is emptied first and nothing follows until it answers
+                self.drain()
+                self.send(command, index)
+                self.drain()
+                continue
+
+            self.send(command, index)
+
+            wait = host_wait(command) if host_wait is not None else 0
+            if wait:
+                self.sync()
+                time.sleep(wait)
+
+        self.drain()
+        return self.errors
+
+    def _receive(self) -> None:
+        """ Reads one line from GRBL and, if it answers a command, frees that
+        command's bytes
+        raises:
+            serial.SerialException: if the reading thread lost the port
+            TimeoutError: if GRBL does not answer within ANSWER_TIMEOUT
+            GrblAlarm: if GRBL raises an alarm
+        """
+        response = ''
+        while not response:
+            if self.responses is not None:
+                try:
+                    response = self.responses.get(timeout=ANSWER_TIMEOUT)
+                except queue.Empty:
+                    raise TimeoutError(f"GRBL did not answer within {ANSWER_TIMEOUT} s")
+                if isinstance(response, Exception):
+                    raise response
+            else:
+                response = self.ser.readline().decode('ascii', errors='replace').strip()
+
+        if response == 'ok' or response.startswith('error'):
+            index, command, size = self.pending.popleft()
+            self.in_flight -= size
+            if index is not None and self.on_answer is not None:
+                self.on_answer(index, command, response)
+            if response != 'ok':
+                self.errors.append((command, response))
+                print(f"{response} on: {command}")
+        elif response.startswith('ALARM'):
+            raise GrblAlarm(response)
+        else:
+            print(f"Received response: {response}")
@@ -0,0 +1,97 @@
+""" This Python module keeps compiled jobs on disk so a board design that has
+already been planned can be sent again without planning it again """
+
+# imports
+import hashlib
+import json
+import os
+import numpy as np
+from job_compiler import Job, OP_DTYPE
+
+# constants
+CACHE_DIR       = "job_cache"           # where compiled jobs are kept
+CACHE_SIZE      = 64 * 1024 * 1024      # most bytes kept before evicting
+
+class JobCache:
+    """ Content addressed cache of compiled jobs. A job is stored under a hash
+    of the board file and of every setting that changes how the board is
+    compiled, so editing either one simply misses the cache. When the cache
+    grows past max_bytes the least recently used jobs are deleted """
+
+    def __init__(self, directory: str = CACHE_DIR, max_bytes: int = CACHE_SIZE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def key(self, board_path: str, settings: dict) -> str:
+        """ Hashes a board file together with the compile settings
+        parameters:
+            board_path: path of the board json file
+            settings: everything else the compiled job depends on (machine
+                        constants, planner name and version...)
+        returns:
+            key: hex digest identifying the compiled job
+        """
+        digest = hashlib.sha256()
+
+        with open(board_path, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 16), b''):
+                digest.update(block)
+        digest.update(json.dumps(settings, sort_keys=True).encode())
+
+        return digest.hexdigest()
+
+    def get(self, key: str):
+        """ Loads a cached job
+        returns:
+            job: the cached job, or None if it is not in the cache
+        """
+        path = self._path(key)
+
+        try:
+            ops = np.load(path, allow_pickle=False)
+        except (OSError, ValueError):
+            return None
+        if ops.dtype != OP_DTYPE:
+            return None
+
+        # mark as recently used
+        os.utime(path)
+
+        return Job(ops)
+
+    def put(self, key: str, job: Job) -> None:
+        """ Stores a compiled job, then evicts old jobs if the cache is full """
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+
+        # write to a temporary file first so a crash never leaves a partly
+        # written job behind
+        temporary = path + '.tmp'
+        with open(temporary, 'wb') as file:
+            np.save(file, job.ops, allow_pickle=False)
+        os.replace(temporary, path)
+
+        self._evict()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + '.npy')
+
+    def _evict(self) -> None:
+        """ Deletes the least recently used jobs until the cache fits """
+
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.npy'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
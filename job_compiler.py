@@ -0,0 +1,235 @@
+""" This Python module compiles the formatted solder list into a job: a typed,
+array-backed list of machine operations that later passes can inspect or
+rewrite before it is turned into GCODE """
+
+# imports
+import numpy as np
+from gcodewriter import GCodeWriter as writer
+from gcodewriter import (OP_POSITIONING, OP_HOME, OP_RAPID, OP_LINEAR,
+                         OP_PLUNGE, OP_DISPENSE_ON, OP_DISPENSE_OFF, OP_DWELL,
+                         OP_ARC_CW, OP_ARC_CCW, fillet_corners)
+from path_planner import endpoints
+
+# one row per operation, unused fields are NaN
+OP_DTYPE = np.dtype([
+    ("op", np.uint8),
+    ("x", np.float64),
+    ("y", np.float64),
+    ("z", np.float64),
+    ("i", np.float64),      # arc centre, relative to the start of the arc
+    ("j", np.float64),
+    ("value", np.float64),  # feedrate, spool speed, dwell time or mode
+])
+
+POINT_OPS = 5 # rapid, plunge, dispense on, dispense off, raise (lines add
+              # one drag per segment and one arc per rounded corner, and
+              # controller timed jobs add up to two dwells)
+
+############################## Helper Functions ###############################
+def _number(value: float):
+    """ Converts a stored value back to what GCodeWriter expects: None for
+    unused fields and ints for whole numbers (so Z-1 does not become Z-1.0) """
+
+    if np.isnan(value):
+        return None
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+def empty_ops(count: int):
+    """ Allocates count operations with every field unused """
+
+    ops = np.empty(count, dtype=OP_DTYPE)
+    ops["x"] = ops["y"] = ops["z"] = ops["i"] = ops["j"] = ops["value"] = np.nan
+    return ops
+
+##################################### Job #####################################
+class Job:
+    """ A compiled solder job. ops is a structured array with the fields of
+    OP_DTYPE, in the order the operations are sent to the gantry """
+
+    def __init__(self, ops=None):
+        self.ops = empty_ops(0) if ops is None else ops
+
+    def __len__(self):
+        return len(self.ops)
+
+    def count(self, op: int) -> int:
+        """ Number of operations with the given op code """
+
+        return int(np.count_nonzero(self.ops["op"] == op))
+
+    def to_gcode(self) -> list:
+        """ Translates the job into a list of GCODE commands """
+
+        return list(self.iter_gcode())
+
+    def iter_gcode(self):
+        """ Translates the job into GCODE one command at a time, so the
+        commands never all have to be held in memory """
+
+        for op, x, y, z, i, j, value in self.ops.tolist():
+            x, y, z, value = _number(x), _number(y), _number(z), _number(value)
+
+            if op == OP_RAPID:
+                command = writer.rapid_positioning(x, y)
+                if z is not None:
+                    command += f' Z{z}'
+            elif op == OP_LINEAR:
+                command = writer.linear_interpolation(x, y, value)
+            elif op in (OP_ARC_CW, OP_ARC_CCW):
+                command = writer.circular_interpolation(
+                    x, y, _number(i), _number(j), value, op == OP_ARC_CW)
+            elif op == OP_PLUNGE:
+                command = writer.move_up_down(z)
+            elif op == OP_DISPENSE_ON:
+                command = writer.start_dispensing(value)
+            elif op == OP_DISPENSE_OFF:
+                command = writer.stop_dispensing()
+            elif op == OP_DWELL:
+                command = writer.wait(value)
+            elif op == OP_HOME:
+                command = writer.reset()
+            elif op == OP_POSITIONING:
+                command = writer.positioning("relative" if value else "absolute")
+            else:
+                raise ValueError(f"Unknown op code {op}")
+
+            yield command
+
+    def to_bytes(self, precision: int = 3) -> bytes:
+        """ Translates the job into one buffer of newline terminated GCODE
+        with numbers written to a fixed number of decimals """
+
+        return writer.serialize(self.ops["op"], self.ops["x"], self.ops["y"],
+                                self.ops["z"], self.ops["value"], precision,
+                                self.ops["i"], self.ops["j"])
+
+################################## Compiler ###################################
+def compile_job(data_list: list, scale: float, height: float,
+                line_feedrate: float, dispense_rate: float,
+                home: bool = True, fillet_radius: float = 0,
+                solder_time: float = 0, dispense_delay: float = 0) -> Job:
+    """ Compiles an ordered solder list into a job in a single pass. Every
+    point and line is soldered in the order given, so plan the list first
+    parameters:
+        data_list: ordered list of points and lines (see format_json)
+        scale: distance between holes (in mm)
+        height: how far the end effector is lowered to solder (in mm)
+        line_feedrate: feedrate used to drag solder along lines
+        dispense_rate: spool feed motor speed
+        home: if True, the job starts and ends at the reference point.
+                Leave it out when compiling a job in pieces
+        fillet_radius: radius (in mm) of the arcs that round off the corners
+                of multi-segment lines, so they are dragged in one continuous
+                motion. 0 keeps sharp corners
+        solder_time: how long (in ms) the lowered end effector heats the
+                joint before dispensing, as a G4 dwell. 0 leaves timing to
+                the host
+        dispense_delay: how long (in ms) the solder is dispensed before the
+                end effector moves on, as a G4 dwell. 0 leaves timing to the
+                host
+    returns:
+        job: the compiled job
+    """
+    n = len(data_list)
+    lines = [data for data in data_list if data[0] == "line"]
+    segments = np.fromiter((len(data) - 2 if data[0] == "line" else 0
+                            for data in data_list), dtype=int, count=n)
+    starts, _ = endpoints(data_list)
+
+    # every vertex of every line, and the ones the end effector is dragged to
+    # (all but the first of each line)
+    vertices = np.array([vertex for data in lines for vertex in data[1:]],
+                        dtype=float).reshape(-1, 2) * scale
+    line_segments = segments[segments > 0]
+    line_first = np.cumsum(line_segments + 1) - line_segments - 1
+    targets = np.ones(len(vertices), dtype=bool)
+    targets[line_first] = False
+    targets = np.flatnonzero(targets)
+
+    # corners (targets that are not the last vertex of their line) get an arc
+    corners = np.ones(len(vertices), dtype=bool)
+    corners[line_first + line_segments] = False
+    corners = np.flatnonzero(corners[targets])
+    rounded = np.zeros(len(targets), dtype=bool)
+    if fillet_radius > 0 and len(corners):
+        at = targets[corners]
+        entry, exit, centre, clockwise, rounded_corners = fillet_corners(
+            vertices[at - 1], vertices[at], vertices[at + 1], fillet_radius)
+        rounded[corners] = rounded_corners
+        entry, exit, centre, clockwise = (entry[rounded_corners],
+                                          exit[rounded_corners],
+                                          centre[rounded_corners],
+                                          clockwise[rounded_corners])
+
+    # drag ops of every line: one per target, plus one per rounded corner
+    drags_per_target = 1 + rounded
+    drags_per_line = line_segments
+    if len(targets):
+        line_targets = line_first - np.arange(len(line_first))
+        drags_per_line = np.add.reduceat(drags_per_target, line_targets)
+    drag_ops = np.zeros(n, dtype=int)
+    drag_ops[segments > 0] = drags_per_line
+
+    # ops before the drags of every point/line: rapid, plunge, [dwell],
+    # dispense on, [dwell]
+    heat = 2 if solder_time > 0 else None
+    dispense = 2 + (heat is not None)
+    delay = dispense + 1 if dispense_delay > 0 else None
+    lead = dispense + 1 + (delay is not None)
+
+    # first op of every point/line, after the setup ops
+    setup = 2 if home else 0
+    sizes = POINT_OPS + drag_ops + lead - 3
+    first = setup + np.cumsum(sizes) - sizes
+
+    ops = empty_ops(int(sizes.sum()) + (3 if home else 0))
+
+    # reset and go to reference point
+    if home:
+        ops["op"][0], ops["value"][0] = OP_POSITIONING, 0
+        ops["op"][1] = OP_HOME
+        ops["op"][-1] = OP_HOME
+
+    # move to the joint, lower end effector and start dispensing
+    ops["op"][first] = OP_RAPID
+    ops["x"][first] = starts[0] * scale
+    ops["y"][first] = starts[1] * scale
+    ops["op"][first + 1] = OP_PLUNGE
+    ops["z"][first + 1] = -height
+    ops["op"][first + dispense] = OP_DISPENSE_ON
+    ops["value"][first + dispense] = dispense_rate
+    if heat is not None:
+        ops["op"][first + heat] = OP_DWELL
+        ops["value"][first + heat] = solder_time
+    if delay is not None:
+        ops["op"][first + delay] = OP_DWELL
+        ops["value"][first + delay] = dispense_delay
+
+    # slowly drag solder along every segment of the lines. A rounded corner
+    # is a drag to where its arc starts followed by the arc itself
+    drag_first = np.repeat(first[segments > 0] + lead, drags_per_line)
+    drags = drag_first + np.arange(len(drag_first)) - np.repeat(
+        np.cumsum(drags_per_line) - drags_per_line, drags_per_line)
+    linear = drags[np.cumsum(drags_per_target) - drags_per_target]
+    ops["op"][drags] = OP_LINEAR
+    ops["value"][drags] = line_feedrate
+    ops["x"][linear] = vertices[targets, 0]
+    ops["y"][linear] = vertices[targets, 1]
+    if rounded.any():
+        ops["x"][linear[rounded]] = entry[:, 0]
+        ops["y"][linear[rounded]] = entry[:, 1]
+        arcs = linear[rounded] + 1
+        ops["op"][arcs] = np.where(clockwise, OP_ARC_CW, OP_ARC_CCW)
+        ops["x"][arcs] = exit[:, 0]
+        ops["y"][arcs] = exit[:, 1]
+        ops["i"][arcs] = centre[:, 0]
+        ops["j"][arcs] = centre[:, 1]
+
+    # stop soldering and raise end effector
+    last = first + lead + drag_ops
+    ops["op"][last] = OP_DISPENSE_OFF
+    ops["op"][last + 1] = OP_PLUNGE
+    ops["z"][last + 1] = height
+
+    return Job(ops)
@@ -0,0 +1,255 @@
+""" This Python module keeps a crash safe journal of how far a job got, so a
+job interrupted by a dropped link or an alarm can be resumed instead of
+soldering the whole board again. The journal is an append-only text file:
+a JSON header naming the job and the board it was soldering, then one line
+per command GRBL acknowledged with the machine position at that time """
+
+# imports
+import hashlib
+import json
+import os
+import time
+from gcodewriter import GCodeWriter as writer
+
+# constants
+JOURNAL_BATCH       = 64 # records written between fsyncs
+JOURNAL_INTERVAL    = 1.0 # longest time between fsyncs (in s)
+DONE                = "done"
+
+############################## Helper Functions ###############################
+def job_digest(commands: list) -> str:
+    """ Identifies a job by its commands """
+
+    digest = hashlib.sha256()
+    for command in commands:
+        digest.update(command.encode('ascii') + b'\n')
+    return digest.hexdigest()
+
+def load_journal(path: str):
+    """ Reads a journal back
+    parameters:
+        path: journal file
+    returns:
+        journal: dict with "job" (digest), "board", "lines", "acked" (set of command
+                    indices), "position" (last machine position, or None) and
+                    "done", None if there is no readable journal
+    """
+    try:
+        with open(path, 'r') as file:
+            header = json.loads(file.readline())
+            acked = set()
+            position = None
+            done = False
+            for line in file:
+                fields = line.split()
+                if fields == [DONE]:
+                    done = True
+                elif len(fields) in (1, 4) and line.endswith('\n'):
+                    # a torn last line (crash mid-write) is skipped
+                    acked.add(int(fields[0]))
+                    if len(fields) == 4:
+                        position = tuple(float(value) for value in fields[1:])
+    except (OSError, ValueError):
+        return None
+
+    return {"job": header["job"], "board": header.get("board"),
+            "lines": header["lines"], "acked": acked, "position": position,
+            "done": done}
+
+def joints(commands: list) -> list:
+    """ Splits a job into joints: from the rapid to a joint to its M5
+    returns:
+        joints: (first, last) command index of every joint
+    """
+    spans = []
+    start = None
+    rapid = None
+    for index, command in enumerate(commands):
+        if command.startswith('G0 X') or command.startswith('G0 Y'):
+            rapid = index
+        elif command.startswith('M3'):
+            start = rapid if rapid is not None else index
+        elif command.startswith('M5') and start is not None:
+            spans.append((start, index))
+            start = None
+
+    return spans
+
+def resume_point(commands: list, acked: set) -> int:
+    """ Index to restart a job from: the start of the first joint whose M5 was
+    not acknowledged. GRBL only acknowledges M5 once every move before it
+    has run, so an acknowledged M5 means the whole joint is on the board.
+    Returns len(commands) if every joint is done """
+
+    for first, last in joints(commands):
+        if last not in acked:
+            return first
+    return len(commands)
+
+def _word(command: str, letter: str):
+    """ Value of one word (e.g. X) of a GCODE command, None if it has none """
+
+    for word in command.split()[1:]:
+        if word[0] == letter:
+            return float(word[1:])
+    return None
+
+def resume_commands(commands: list, journal: dict, board: str = None,
+                    homing: bool = False):
+    """ Works out how to finish an interrupted job: re-home, restore the
+    modal state the remaining commands rely on, rise to the job's travel
+    height and rapid over the resume point, then carry on from
+    resume_point. The first resumed command is then only a descent, never a
+    diagonal move the Z-hop planner did not check. Send
+    preamble + commands[start:]
+    parameters:
+        commands: the job's full list of GCODE commands
+        journal: the job's journal (see load_journal)
+        board: the board being soldered, must be the one the journal was
+                    written for
+        homing: run the homing cycle ($H) first. Reopening the port resets
+                    GRBL, which then takes wherever the gantry stopped as
+                    machine zero, so G28 alone would shift every resumed
+                    joint. Needs homing enabled ($22=1)
+    returns:
+        preamble: commands that re-home and restore the modal state
+        start: index of the first job command left to send
+                    (len(commands) if the job is done)
+    raises:
+        ValueError: if the journal belongs to another job or board
+    """
+    if journal["job"] != job_digest(commands) or journal["lines"] != len(commands):
+        raise ValueError("Journal does not belong to this job")
+    if journal["board"] != board:
+        raise ValueError(f"Journal belongs to board {journal['board']}, not {board}")
+
+    start = resume_point(commands, journal["acked"])
+    if start == len(commands):
+        return [], start
+
+    # modal state set before the resume point
+    work_offset = None
+    feed = None
+    for command in commands[:start]:
+        words = command.split()
+        if words[0] in ('G54', 'G55', 'G56', 'G57', 'G58', 'G59'):
+            work_offset = words[0]
+        feed = next((word for word in words if word.startswith('F')), feed)
+
+    preamble = [writer.stop_dispensing()]
+    if homing:
+        preamble.append(writer.homing_cycle())
+    preamble += [writer.positioning('absolute'), writer.reset()]
+    if work_offset is not None:
+        preamble.append(work_offset)
+    if feed is not None:
+        preamble.append(feed)
+
+    # the highest Z the job travels at is clear of everything on the board
+    heights = [z for z in (_word(command, 'Z') for command in commands
+                           if command.startswith(('G0 ', 'G1 '))) if z is not None]
+    if heights:
+        preamble.append(f'G0 Z{max(heights):g}')
+
+    # XY of the resume point: the rapid into the joint, or wherever the
+    # job was before it if the rapid leaves one axis out
+    x = y = None
+    for command in commands[:start + 1]:
+        if command.startswith(('G0 ', 'G1 ', 'G2 ', 'G3 ')):
+            x = _word(command, 'X') if _word(command, 'X') is not None else x
+            y = _word(command, 'Y') if _word(command, 'Y') is not None else y
+    if x is not None and y is not None:
+        preamble.append(f'G0 X{x:g} Y{y:g}')
+
+    return preamble, start
+
+################################### Journal ###################################
+class JobJournal:
+    """ Appends acknowledged commands to the journal file. Records are
+    flushed to disk in batches (every JOURNAL_BATCH records or
+    JOURNAL_INTERVAL seconds), so at worst the last batch is lost, which
+    only means a joint is redone. Use as a context manager """
+
+    def __init__(self, path: str, batch: int = JOURNAL_BATCH,
+                 interval: float = JOURNAL_INTERVAL):
+        """ parameters:
+            path: journal file
+            batch: records written between fsyncs
+            interval: longest time between fsyncs (in s)
+        """
+        self.path = path
+        self.batch = batch
+        self.interval = interval
+        self.file = None
+        self._skip = 0 # commands sent before the job's own (resume preamble)
+        self._start = 0 # job index of the first of the job's commands sent
+        self._unsynced = 0
+        self._last_sync = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def start(self, commands: list, board: str = None) -> None:
+        """ Starts journaling a job from scratch
+        parameters:
+            commands: the job's full list of GCODE commands
+            board: identifies the board being soldered (e.g. its label), so
+                    a journal is never resumed on another board of the same
+                    design
+        """
+        self.file = open(self.path, 'w')
+        self.file.write(json.dumps({"job": job_digest(commands), "board": board,
+                                    "lines": len(commands)}) + '\n')
+        self._sync()
+
+    def resume(self, preamble: list, start: int) -> None:
+        """ Carries on journaling an interrupted job (see resume_commands)
+        parameters:
+            preamble: resume preamble sent ahead of the job's commands
+            start: job index of the first of the job's commands sent
+        """
+        self.file = open(self.path, 'a')
+        self._skip = len(preamble)
+        self._start = start
+
+    def record(self, sent: int, position=None) -> None:
+        """ Records that GRBL acknowledged a command
+        parameters:
+            sent: index of the command among those sent
+            position: machine position (x, y, z) when the answer arrived
+        """
+        if sent < self._skip:
+            return
+        index = sent - self._skip + self._start
+
+        if position is None:
+            self.file.write(f'{index}\n')
+        else:
+            x, y, z = position
+            self.file.write(f'{index} {x:.3f} {y:.3f} {z:.3f}\n')
+
+        self._unsynced += 1
+        if (self._unsynced >= self.batch
+                or time.monotonic() - self._last_sync >= self.interval):
+            self._sync()
+
+    def finish(self) -> None:
+        """ Marks the job as complete """
+
+        self.file.write(DONE + '\n')
+        self._sync()
+
+    def close(self) -> None:
+        if self.file is not None:
+            self._sync()
+            self.file.close()
+            self.file = None
+
+    def _sync(self) -> None:
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
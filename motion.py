@@ -0,0 +1,225 @@
+""" This Python module estimates how long gantry moves and whole jobs take,
+using the max rates and accelerations GRBL is configured with (see
+old_330_code/config.py) """
+
+# imports
+import numpy as np
+from gcodewriter import (OP_RAPID, OP_LINEAR, OP_PLUNGE, OP_DWELL, OP_HOME,
+                         OP_ARC_CW, OP_ARC_CCW)
+from old_330_code.config import robot_config
+
+############################## Helper Functions ###############################
+def axis_limits(config: dict = robot_config):
+    """ Reads the per axis limits out of a GRBL config
+    parameters:
+        config: GRBL config with a "parameters" dict of $ settings
+    returns:
+        rates: x, y, z max rates (in mm/s)
+        accels: x, y, z accelerations (in mm/s^2)
+    """
+    parameters = config["parameters"]
+    rates = np.array([parameters["$110"], parameters["$111"],
+                      parameters["$112"]], dtype=float) / 60
+    accels = np.array([parameters["$120"], parameters["$121"],
+                       parameters["$122"]], dtype=float)
+
+    return rates, accels
+
+def move_time(dx, dy, dz, feedrate=None, config: dict = robot_config):
+    """ Time taken by straight moves that start and end at rest, following a
+    trapezoidal (or triangular, for short moves) speed profile. Like GRBL, the
+    speed and acceleration along the move are capped so that no single axis
+    goes over its own limit. Works on whole arrays of moves
+    parameters:
+        dx, dy, dz: distance moved along each axis (in mm)
+        feedrate: requested feedrate (in mm/min), None for rapid moves
+        config: GRBL config to read the limits from
+    returns:
+        time: time taken by each move (in s)
+    """
+    rates, accels = axis_limits(config)
+    dx, dy, dz = (np.abs(np.asarray(d, dtype=float)) for d in (dx, dy, dz))
+
+    # for the axis that limits the move: time it would take at full speed,
+    # and the square of the time it would take at full acceleration
+    cruise = np.maximum(np.maximum(dx / rates[0], dy / rates[1]), dz / rates[2])
+    ramp = np.maximum(np.maximum(dx / accels[0], dy / accels[1]),
+                      dz / accels[2])
+
+    if feedrate is not None:
+        length = np.sqrt(dx * dx + dy * dy + dz * dz)
+        cruise = np.maximum(cruise, length * 60 / np.asarray(feedrate, dtype=float))
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        time = np.where(cruise * cruise >= ramp, cruise + ramp / cruise,
+                        2 * np.sqrt(ramp))
+
+    return np.where(cruise > 0, time, 0.0)
+
+def _segment_time(length, entry, exit, speed, accel):
+    """ Time to cover length starting at entry speed and ending at exit speed,
+    cruising at speed if there is room (trapezoid) and peaking early if not
+    (triangle). Works on whole arrays of segments """
+
+    accelerating = (speed * speed - entry * entry) / (2 * accel)
+    braking = (speed * speed - exit * exit) / (2 * accel)
+    cruising = length - accelerating - braking
+
+    peak = np.sqrt(np.maximum((2 * accel * length + entry * entry
+                               + exit * exit) / 2, 0))
+    peak = np.where(cruising >= 0, speed, peak)
+
+    return ((peak - entry) / accel + (peak - exit) / accel
+            + np.maximum(cruising, 0) / speed)
+
+def _arc_geometry(delta, centre, clockwise):
+    """ Length and start/end directions of xy arcs. Works on whole arrays of
+    arcs
+    parameters:
+        delta: (n, 2) move from the start to the end of each arc
+        centre: (n, 2) offset from the start of each arc to its centre
+        clockwise: True for G2 arcs, False for G3
+    returns:
+        length: length along each arc
+        start, end: (n, 2) unit directions the arc starts and ends in
+    """
+    start_radius = -centre
+    end_radius = delta - centre
+    radius = np.sqrt(np.sum(centre * centre, axis=1))
+
+    cross = (start_radius[:, 0] * end_radius[:, 1]
+             - start_radius[:, 1] * end_radius[:, 0])
+    dot = np.sum(start_radius * end_radius, axis=1)
+    sweep = np.arctan2(np.where(clockwise, -cross, cross), dot) % (2 * np.pi)
+    sweep[sweep == 0] = 2 * np.pi # same start and end is a full circle
+
+    # tangents are the radii turned a quarter in the direction of travel
+    turn = np.where(clockwise, -1.0, 1.0)[:, None]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        start = np.stack((-start_radius[:, 1], start_radius[:, 0]), axis=1) \
+            * turn / radius[:, None]
+        end = np.stack((-end_radius[:, 1], end_radius[:, 0]), axis=1) \
+            * turn / radius[:, None]
+
+    return radius * sweep, start, end
+
+################################ Job Estimates ################################
+def simulate_job(job, config: dict = robot_config):
+    """ Simulates the motion of a compiled job the way GRBL plans it: every
+    move follows a trapezoidal speed profile, back to back moves blend
+    through their corners (limited by the junction deviation, $11), arcs run
+    at their feedrate along their full length and the machine comes to a
+    stop around any non-motion op (spindle, dwell). The machine starts at
+    rest at the origin
+    parameters:
+        job: compiled job (see job_compiler.py)
+        config: GRBL config to read the limits from
+    returns:
+        times: time taken by each op (in s)
+    """
+    ops = job.ops
+    op = ops["op"]
+    rates, accels = axis_limits(config)
+    deviation = config["parameters"].get("$11", 0.010)
+
+    # where the machine is after every op: axes an op does not move keep
+    # the value of the last op that did
+    position = np.stack((ops["x"], ops["y"], ops["z"]), axis=1)
+    position[op == OP_HOME, :2] = 0
+    previous = np.vstack(([0.0, 0.0, 0.0], position))
+    for axis in range(3):
+        known = np.where(np.isnan(previous[:, axis]), 0,
+                         np.arange(len(previous)))
+        previous[:, axis] = previous[np.maximum.accumulate(known), axis]
+    delta = np.diff(previous, axis=0)
+
+    times = np.zeros(len(ops))
+    dwells = op == OP_DWELL
+    times[dwells] = ops["value"][dwells] / 1000
+
+    arc_ops = (OP_ARC_CW, OP_ARC_CCW)
+    moving = np.isin(op, (OP_RAPID, OP_LINEAR, OP_PLUNGE, OP_HOME) + arc_ops)
+    moves = np.flatnonzero(moving & (np.any(delta != 0, axis=1)
+                                     | np.isin(op, arc_ops)))
+    if len(moves) == 0:
+        return times
+
+    delta = delta[moves]
+    length = np.sqrt(np.sum(delta * delta, axis=1))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        unit = delta / length[:, None]
+    start_unit = unit.copy()
+    end_unit = unit.copy()
+
+    # arcs: the axis limits are taken along the chord, corners are taken
+    # against the direction the arc starts and ends in
+    arcs = np.isin(op[moves], arc_ops)
+    if arcs.any():
+        centre = np.stack((ops["i"][moves[arcs]], ops["j"][moves[arcs]]), axis=1)
+        arc_length, arc_start, arc_end = _arc_geometry(
+            delta[arcs, :2], centre, op[moves[arcs]] == OP_ARC_CW)
+        closed = arcs & (length == 0)
+        length[arcs] = arc_length
+        start_unit[arcs] = np.column_stack((arc_start, np.zeros(arcs.sum())))
+        end_unit[arcs] = np.column_stack((arc_end, np.zeros(arcs.sum())))
+        unit[closed] = start_unit[closed]
+
+    with np.errstate(divide="ignore"):
+        speed = np.min(rates / np.abs(unit), axis=1)
+        accel = np.min(accels / np.abs(unit), axis=1)
+    feeds = np.isin(op[moves], (OP_LINEAR,) + arc_ops)
+    speed[feeds] = np.minimum(speed[feeds], ops["value"][moves[feeds]] / 60)
+
+    # fastest speed each move can go through the corner into the next one
+    cos_theta = -np.sum(end_unit[:-1] * start_unit[1:], axis=1)
+    sin_half = np.sqrt(np.clip(0.5 * (1 - cos_theta), 0, 1))
+    with np.errstate(divide="ignore"):
+        junction = np.sqrt(np.minimum(accel[:-1], accel[1:]) * deviation
+                           * sin_half / (1 - sin_half))
+    junction = np.minimum(junction, np.minimum(speed[:-1], speed[1:]))
+    stops = np.cumsum(~moving)
+    junction[stops[moves[1:]] != stops[moves[:-1]]] = 0
+    exits = np.append(junction, 0.0)
+
+    # backward pass: brake in time for every corner and the final stop
+    for k in range(len(moves) - 2, -1, -1):
+        exits[k] = min(exits[k], np.sqrt(exits[k + 1] ** 2
+                                         + 2 * accel[k + 1] * length[k + 1]))
+    # forward pass: only reach what the previous move could accelerate to
+    entries = np.concatenate(([0.0], exits[:-1]))
+    for k in range(len(moves)):
+        exits[k] = min(exits[k], np.sqrt(entries[k] ** 2
+                                         + 2 * accel[k] * length[k]))
+        if k + 1 < len(moves):
+            entries[k + 1] = exits[k]
+
+    times[moves] = _segment_time(length, entries, exits, speed, accel)
+    return times
+
+def estimate_job_time(job, config: dict = robot_config) -> dict:
+    """ Estimates how long a compiled job takes to run on the gantry. Only
+    what is in the job is counted, waits done by the host while sending are
+    not
+    parameters:
+        job: compiled job (see job_compiler.py)
+        config: GRBL config to read the limits from
+    returns:
+        estimate: total time and its breakdown (in s) into
+                    travel: rapids between joints and homing
+                    z: raising and lowering the end effector
+                    drag: dragging solder along lines and arcs
+                    dwell: G4 pauses
+    """
+    times = simulate_job(job, config)
+    op = job.ops["op"]
+    xy_rapid = (op == OP_RAPID) & ~np.isnan(job.ops["x"])
+
+    estimate = {
+        "travel": float(times[xy_rapid | (op == OP_HOME)].sum()),
+        "z": float(times[(op == OP_PLUNGE) | ((op == OP_RAPID) & ~xy_rapid)].sum()),
+        "drag": float(times[np.isin(op, (OP_LINEAR, OP_ARC_CW, OP_ARC_CCW))].sum()),
+        "dwell": float(times[op == OP_DWELL].sum()),
+    }
+    estimate["total"] = float(times.sum())
+
+    return estimate
@@ -2,6 +2,7 @@ steps_per_revolution = 800
 microsteps = 1/4
 mm_per_rev = 2
 steps_per_mm = (steps_per_revolution * microsteps) / mm_per_rev
+hole_pitch = 2.5  # distance between protoboard holes, mm
 
 robot_config = {
     "parameters":
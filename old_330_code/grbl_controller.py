@@ -1,6 +1,7 @@
 import time
 from .gcode_processor import GcodeProcessor
 import serial
+from grbl_settings import sync_settings
 
 
 class GRBLController(GcodeProcessor):
@@ -14,6 +15,7 @@ class GRBLController(GcodeProcessor):
         self.homed = False
         self.relative = False
         self.initialized = False
+        self.settings = None  # GRBL's settings as of the last sync
         # TODO: implement position tracking
         self.x = None
         self.y = None
@@ -122,11 +124,11 @@ class GRBLController(GcodeProcessor):
         try:
             self.ser.flushInput()
 
-            for parameter, value in self.parameters.items():
-                gcode = f"{parameter}={value}\n"
-                self.ser.write(gcode.encode())
-                time.sleep(0.1)
-                self.read()
+            # only the settings that differ are written, each after the
+            # last one's ok (see grbl_settings.py)
+            self.settings, written = sync_settings(self.ser, self.parameters, self.settings)
+            if written:
+                print(f"GRBL: updated settings {written}")
 
             return True
         except Exception as e:
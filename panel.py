@@ -0,0 +1,153 @@
+""" This Python module builds step-and-repeat panels: one board design
+soldered on several fixtures, each fixture getting its own GRBL work
+coordinate system (G54 to G59). GRBL keeps work offsets in EEPROM, so they
+are written apart from the job and only when GRBL does not hold them yet """
+
+# imports
+import itertools
+import numpy as np
+from gcodewriter import GCodeWriter as writer
+from gcodewriter import OP_HOME, OP_POSITIONING
+from grbl_settings import offsets_diff
+from job_compiler import Job, empty_ops
+
+# constants
+MAX_BOARDS      = 6 # GRBL has six work coordinate systems, G54 to G59
+
+############################## Helper Functions ###############################
+def job_ends(job: Job):
+    """ Where a job first moves to and where it finishes
+    parameters:
+        job: compiled job
+    returns:
+        entry: x, y of the first move
+        exit: x, y of the last move
+    """
+    moves = np.flatnonzero(~np.isnan(job.ops["x"]) & (job.ops["op"] != OP_HOME))
+    if len(moves) == 0:
+        return np.zeros(2), np.zeros(2)
+
+    entry = np.array([job.ops["x"][moves[0]], job.ops["y"][moves[0]]])
+    exit = np.array([job.ops["x"][moves[-1]], job.ops["y"][moves[-1]]])
+
+    return entry, exit
+
+def order_boards(offsets: list, entry, exit, origin: tuple = (0.0, 0.0)) -> list:
+    """ Finds the order to solder the boards in that travels the least. Each
+    board is entered at offset + entry and left at offset + exit, starting
+    and ending at origin. There are at most MAX_BOARDS boards, so every order
+    is tried
+    parameters:
+        offsets: x, y origin of every fixture (in mm)
+        entry, exit: where the board job starts and finishes (in mm)
+        origin: where the gantry starts and ends (in mm)
+    returns:
+        order: fixture indices in soldering order
+    """
+    offsets = np.asarray(offsets, dtype=float).reshape(-1, 2)
+    entries = offsets + entry
+    exits = offsets + exit
+    origin = np.asarray(origin, dtype=float)
+
+    # hops[i, j] = travel from leaving board i to entering board j
+    hops = np.linalg.norm(entries[None, :, :] - exits[:, None, :], axis=2)
+    start = np.linalg.norm(entries - origin, axis=1)
+    finish = np.linalg.norm(exits - origin, axis=1)
+
+    best, best_travel = None, np.inf
+    for order in itertools.permutations(range(len(offsets))):
+        travel = start[order[0]] + finish[order[-1]] + sum(
+            hops[a, b] for a, b in zip(order, order[1:]))
+        if travel < best_travel:
+            best, best_travel = list(order), travel
+
+    return best
+
+def board_body(job: Job) -> Job:
+    """ The board's own operations, without its setup and homing, which a
+    panel does once for every board """
+
+    return Job(job.ops[~np.isin(job.ops["op"], (OP_HOME, OP_POSITIONING))])
+
+def _check_size(offsets: list) -> None:
+    """ Raises a ValueError if a panel cannot hold that many boards """
+
+    if not 0 < len(offsets) <= MAX_BOARDS:
+        raise ValueError(f"A panel holds 1 to {MAX_BOARDS} boards, "
+                         f"got {len(offsets)}")
+
+################################ Panel Builder ################################
+def work_offset_gcode(offsets: list, current: dict = None) -> list:
+    """ Generates the GCODE storing the fixtures' work offsets, skipping the
+    ones GRBL already holds, so running the same panel again writes nothing.
+    Send it before the job (see grbl_controller.run_job)
+    parameters:
+        offsets: x, y machine position of every fixture's origin (in mm),
+                    the first stored as G54
+        current: offsets GRBL holds now (see grbl_settings.read_offsets),
+                    None to write every one
+    returns:
+        commands: list of G10 commands, empty if nothing changed
+    """
+    if current is None:
+        current = {}
+    return [writer.set_work_offset(slot, x, y)
+            for slot, (x, y) in offsets_diff(current, offsets).items()]
+
+def panel_gcode(job: Job, offsets: list) -> list:
+    """ Generates the GCODE for soldering the same board on every fixture.
+    The board's commands are generated once and repeated, each time in the
+    fixture's own work coordinate system, so the joints are not recompiled
+    per board. The fixtures' offsets are not part of it, see
+    work_offset_gcode
+    parameters:
+        job: compiled board job, in the board's own coordinates
+        offsets: x, y machine position of every fixture's origin (in mm)
+    returns:
+        commands: list of GCODE commands for the whole panel
+    """
+    _check_size(offsets)
+    body = board_body(job)
+    board = body.to_gcode()
+    entry, exit = job_ends(body)
+
+    commands = [writer.positioning('absolute'), writer.reset()]
+
+    for fixture in order_boards(offsets, entry, exit):
+        commands.append(writer.work_coordinates(fixture + 1))
+        commands.extend(board)
+
+    # single board jobs run in G54, whose offset they set back if needed
+    commands.append(writer.work_coordinates(1))
+    commands.append(writer.reset())
+
+    return commands
+
+def panel_job(job: Job, offsets: list) -> Job:
+    """ The whole panel as one job in machine coordinates: the same moves as
+    panel_gcode, in the same board order, with every board shifted by its
+    fixture's offset. GRBL runs the panel in work coordinates instead, this
+    is for estimating it, travel between boards included (see
+    motion.estimate_job_time)
+    parameters:
+        job: compiled board job, in the board's own coordinates
+        offsets: x, y machine position of every fixture's origin (in mm)
+    returns:
+        panel: job soldering every board, homed before and after
+    """
+    _check_size(offsets)
+    body = board_body(job)
+    entry, exit = job_ends(body)
+    offsets = np.asarray(offsets, dtype=float).reshape(-1, 2)
+
+    boards = []
+    for fixture in order_boards(offsets, entry, exit):
+        ops = body.ops.copy()
+        ops["x"] += offsets[fixture, 0]
+        ops["y"] += offsets[fixture, 1]
+        boards.append(ops)
+
+    home = empty_ops(1)
+    home["op"] = OP_HOME
+
+    return Job(np.concatenate([home] + boards + [home]))
@@ -0,0 +1,415 @@
+""" This Python module contains the path planners used by generate_gcode to
+decide the order in which points and lines are soldered """
+
+# imports
+import math
+import time
+import numpy as np
+from motion import move_time
+from old_330_code.config import robot_config
+
+# constants
+PLANNER_VERSION = 1         # bump whenever planning changes the jobs produced
+TIME_BUDGET     = 0.5       # time allowed for planning a tour (in s)
+MAX_SEGMENT     = 3         # longest run of joints moved by an Or-opt step
+MIN_GAIN        = 1e-9      # smallest improvement that is still applied
+
+############################## Helper Functions ###############################
+def endpoints(data_list: list):
+    """ Splits a formatted solder list into start and end coordinates
+    parameters:
+        data_list: list of points/lines from format_json
+    returns:
+        starts: (2, n) array, row 0 is x and row 1 is y of the first
+                coordinate of every item
+        ends: (2, n) array of the last coordinate of every item (same as
+                starts for points)
+    """
+    starts = np.empty((2, len(data_list)), dtype=float)
+    ends = np.empty((2, len(data_list)), dtype=float)
+
+    for i, data in enumerate(data_list):
+        starts[:, i] = data[1]
+        ends[:, i] = data[-1]
+
+    return starts, ends
+
+def orient(data: tuple, flipped: bool) -> tuple:
+    """ Returns a solder item travelling in the requested direction. Only
+    lines can be flipped, points are returned unchanged """
+
+    if flipped and data[0] == "line":
+        return (data[0],) + tuple(reversed(data[1:]))
+    return data
+
+def _straightness(previous: tuple, current: tuple, following: tuple) -> float:
+    """ Cosine of the turn made at current when going from previous to
+    following (1 = straight ahead, -1 = straight back) """
+
+    ax, ay = current[0] - previous[0], current[1] - previous[1]
+    bx, by = following[0] - current[0], following[1] - current[1]
+
+    return (ax * bx + ay * by) / (math.hypot(ax, ay) * math.hypot(bx, by))
+
+def _simplify(chain: list) -> list:
+    """ Drops vertices that sit in the middle of a straight run """
+
+    simplified = [chain[0]]
+    for current, following in zip(chain[1:-1], chain[2:]):
+        if _straightness(simplified[-1], current, following) < 1 - MIN_GAIN:
+            simplified.append(current)
+    simplified.append(chain[-1])
+
+    return simplified
+
+################################# Pre-passes ##################################
+def merge_lines(data_list: list) -> list:
+    """ Chains lines that share end points into polylines so each chain is
+    soldered as one continuous drag (one plunge and one dispense start/stop)
+    instead of one per line. At a junction the chain carries on in the
+    straightest direction, and vertices in the middle of a straight run are
+    dropped. Duplicate lines are soldered once. Open chains start at their
+    left-most end (the planner may still reverse them), closed loops start
+    where they were first found
+    parameters:
+        data_list: list of points/lines from format_json
+    returns:
+        merged: points and zero length lines unchanged, followed by the
+                chains as ("line", p0, p1, ..., pk) items
+    """
+    merged = []
+    segments = {}
+
+    for data in data_list:
+        vertices = [tuple(vertex) for vertex in data[1:]]
+        if data[0] != "line" or all(v == vertices[0] for v in vertices):
+            merged.append(data)
+            continue
+
+        for a, b in zip(vertices, vertices[1:]):
+            if a != b:
+                segments.setdefault(frozenset((a, b)), (a, b))
+
+    neighbours = {}
+    for a, b in segments.values():
+        neighbours.setdefault(a, []).append(b)
+        neighbours.setdefault(b, []).append(a)
+
+    # walking from odd vertices first keeps open chains in one piece
+    used = set()
+    starts = sorted(neighbours, key=lambda v: len(neighbours[v]) % 2 == 0)
+    for start in starts:
+        while True:
+            chain = [start]
+            while True:
+                free = [v for v in neighbours[chain[-1]]
+                        if frozenset((chain[-1], v)) not in used]
+                if not free:
+                    break
+                if len(chain) > 1:
+                    free.sort(key=lambda v: -_straightness(chain[-2],
+                                                           chain[-1], v))
+                used.add(frozenset((chain[-1], free[0])))
+                chain.append(free[0])
+
+            if len(chain) == 1:
+                break
+
+            chain = _simplify(chain)
+            if chain[0] != chain[-1] and chain[-1] < chain[0]:
+                chain.reverse()
+            merged.append(("line",) + tuple(list(vertex) for vertex in chain))
+
+    return merged
+
+def _positions(starts, ends, order, flipped):
+    """ Entry and exit coordinates of every position in a tour """
+
+    entries = np.where(flipped, ends[:, order], starts[:, order])
+    exits = np.where(flipped, starts[:, order], ends[:, order])
+
+    return entries, exits
+
+################################## Planners ###################################
+class PathPlanner:
+    """ Base class for path planners. A planner takes the list returned by
+    format_json and returns the same items in the order they should be
+    soldered. Lines may come back with their start and end swapped.
+
+    Travel is measured from the reference point to the first joint, between
+    joints and back to the reference point, since generate_gcode starts and
+    ends the job with a reset """
+
+    name = None
+    units = "mm"
+
+    def __init__(self, scale: float = 1.0, origin: tuple = (0.0, 0.0)):
+        self.scale = scale
+        self.origin = np.asarray(origin, dtype=float).reshape(2, 1)
+        self.stats = {}
+
+    def plan(self, data_list: list) -> list:
+        raise NotImplementedError
+
+    def distance(self, dx, dy):
+        """ Cost of a move by dx, dy grid units. Works on whole arrays of
+        moves so planners can score many candidates in one call. Subclasses
+        can override this to plan on something other than straight line
+        distance, but it must stay symmetric """
+
+        return np.sqrt(dx * dx + dy * dy) * self.scale
+
+    def cost(self, a, b):
+        """ Cost of moving from coordinates a to coordinates b, both given as
+        (2, ...) arrays """
+
+        return self.distance(b[0] - a[0], b[1] - a[1])
+
+    def travel(self, data_list: list) -> float:
+        """ Total travel cost (excluding line drags) needed to solder
+        data_list in the given order """
+
+        if not data_list:
+            return 0.0
+
+        starts, ends = endpoints(data_list)
+        entries = np.hstack((starts, self.origin))
+        exits = np.hstack((self.origin, ends))
+
+        return float(self.cost(exits, entries).sum())
+
+    def report(self) -> str:
+        """ Human readable summary of the last call to plan """
+
+        if not self.stats:
+            return f"{self.name}: nothing planned"
+
+        before = self.stats["travel_before"]
+        after = self.stats["travel_after"]
+        saved = 100 * (before - after) / before if before else 0.0
+
+        return (f"{self.name}: travel {before:.1f} -> {after:.1f} {self.units} "
+                f"({saved:.1f}% saved) in {self.stats['time'] * 1000:.0f} ms")
+
+    def _finish(self, data_list: list, planned: list, start: float) -> list:
+        """ Records travel statistics for a finished plan """
+
+        self.stats = {
+            "travel_before": self.travel(data_list),
+            "travel_after": self.travel(planned),
+            "time": time.perf_counter() - start,
+        }
+        return planned
+
+class ColumnSweepPlanner(PathPlanner):
+    """ Visits joints column by column, left to right, keeping the order of
+    format_json within a column. This is the original generate_gcode order """
+
+    name = "sweep"
+
+    def plan(self, data_list: list) -> list:
+        start = time.perf_counter()
+        planned = sorted(data_list, key=lambda data: data[1][0])
+
+        return self._finish(data_list, planned, start)
+
+class TourPlanner(PathPlanner):
+    """ Orders joints into a short tour. The tour is seeded with a nearest
+    neighbour walk from the reference point and then improved with 2-opt and
+    Or-opt moves until no move helps or the time budget runs out. Both moves
+    may reverse lines so each line is dragged in whichever direction is
+    cheaper """
+
+    name = "tour"
+
+    def __init__(self, scale: float = 1.0, origin: tuple = (0.0, 0.0),
+                 time_budget: float = TIME_BUDGET):
+        super().__init__(scale, origin)
+        self.time_budget = time_budget
+
+    def plan(self, data_list: list) -> list:
+        start = time.perf_counter()
+        if len(data_list) < 2:
+            return self._finish(data_list, list(data_list), start)
+
+        starts, ends = endpoints(data_list)
+        order, flipped = self._nearest_neighbour(starts, ends)
+
+        # pad the tour with the reference point at both ends so the first
+        # and last moves are optimized like any other
+        depot = len(data_list)
+        starts = np.hstack((starts, self.origin))
+        ends = np.hstack((ends, self.origin))
+        order = np.concatenate(([depot], order, [depot]))
+        flipped = np.concatenate(([False], flipped, [False]))
+
+        deadline = start + self.time_budget
+        improved = True
+        while improved and time.perf_counter() < deadline:
+            improved = self._two_opt(starts, ends, order, flipped, deadline)
+            order, flipped, moved = self._or_opt(starts, ends, order, flipped,
+                                                 deadline)
+            improved = improved or moved
+
+        planned = [orient(data_list[i], f)
+                   for i, f in zip(order[1:-1], flipped[1:-1])]
+
+        return self._finish(data_list, planned, start)
+
+    def _nearest_neighbour(self, starts, ends):
+        """ Greedy tour: always go to the closest unvisited line end or point.
+        The seed only has to be roughly right, so it uses straight line
+        distance whatever cost the planner optimizes
+        returns:
+            order: indices into starts/ends in visiting order
+            flipped: True where a line is entered from its end
+        """
+        n = starts.shape[1]
+        order = np.empty(n, dtype=int)
+        flipped = np.zeros(n, dtype=bool)
+
+        # every start and end lives in one pool; endpoint k belongs to item
+        # k % n. Visited endpoints are swapped past the end of the pool so
+        # each step only looks at a contiguous block of unvisited ones
+        pool = np.hstack((starts, ends))
+        ids = np.arange(2 * n)
+        slot = np.arange(2 * n)
+        size = 2 * n
+
+        position = self.origin[:, 0]
+        for k in range(n):
+            dx = pool[0, :size] - position[0]
+            dy = pool[1, :size] - position[1]
+            best = ids[int(np.argmin(dx * dx + dy * dy))]
+            order[k] = best % n
+            flipped[k] = best >= n
+            position = (starts if flipped[k] else ends)[:, order[k]]
+
+            for endpoint in (order[k], order[k] + n):
+                size -= 1
+                i, other = slot[endpoint], ids[size]
+                pool[:, [i, size]] = pool[:, [size, i]]
+                ids[i], ids[size] = other, endpoint
+                slot[other], slot[endpoint] = i, size
+
+        return order, flipped
+
+    def _two_opt(self, starts, ends, order, flipped, deadline) -> bool:
+        """ Reverses stretches of the tour in place while that shortens it
+        returns:
+            True if the tour was changed
+        """
+        entries, exits = _positions(starts, ends, order, flipped)
+        last = len(order) - 2
+        changed = False
+
+        for i in range(1, last + 1):
+            if time.perf_counter() > deadline:
+                break
+
+            # gain of reversing positions i..j for every j at once
+            gain = (self.cost(exits[:, i - 1], entries[:, i])
+                    + self.cost(exits[:, i:last + 1], entries[:, i + 1:])
+                    - self.cost(exits[:, i - 1, None], exits[:, i:last + 1])
+                    - self.cost(entries[:, i, None], entries[:, i + 1:]))
+            best = int(np.argmax(gain))
+            if gain[best] <= MIN_GAIN:
+                continue
+
+            j = i + best
+            order[i:j + 1] = order[i:j + 1][::-1]
+            flipped[i:j + 1] = ~flipped[i:j + 1][::-1]
+            entries[:, i:j + 1], exits[:, i:j + 1] = (
+                exits[:, i:j + 1][:, ::-1].copy(),
+                entries[:, i:j + 1][:, ::-1].copy())
+            changed = True
+
+        return changed
+
+    def _or_opt(self, starts, ends, order, flipped, deadline):
+        """ Moves short runs of joints (optionally reversed) to wherever they
+        are cheapest to visit
+        returns:
+            order, flipped: the updated tour
+            changed: True if the tour was changed
+        """
+        changed = False
+
+        for length in range(1, MAX_SEGMENT + 1):
+            entries, exits = _positions(starts, ends, order, flipped)
+            s = 1
+            while s + length < len(order):
+                if time.perf_counter() > deadline:
+                    return order, flipped, changed
+
+                e = s + length - 1
+                removed = (self.cost(exits[:, s - 1], entries[:, s])
+                           + self.cost(exits[:, e], entries[:, e + 1])
+                           - self.cost(exits[:, s - 1], entries[:, e + 1]))
+                if removed <= MIN_GAIN:
+                    s += 1
+                    continue
+
+                # cost of inserting the run after position k, for every k
+                edges = self.cost(exits[:, :-1], entries[:, 1:])
+                forward = (self.cost(exits[:, :-1], entries[:, s, None])
+                           + self.cost(exits[:, e, None], entries[:, 1:])
+                           - edges)
+                backward = (self.cost(exits[:, :-1], exits[:, e, None])
+                            + self.cost(entries[:, s, None], entries[:, 1:])
+                            - edges)
+                forward[s - 1:e + 1] = np.inf
+                backward[s - 1:e + 1] = np.inf
+
+                k_forward = int(np.argmin(forward))
+                k_backward = int(np.argmin(backward))
+                reverse = backward[k_backward] < forward[k_forward]
+                k = k_backward if reverse else k_forward
+                added = backward[k] if reverse else forward[k]
+                if added >= removed - MIN_GAIN:
+                    s += 1
+                    continue
+
+                run = np.arange(s, e + 1)
+                rest = np.concatenate((np.arange(s),
+                                       np.arange(e + 1, len(order))))
+                at = k + 1 if k < s else k + 1 - length
+                if reverse:
+                    run = run[::-1]
+                new_positions = np.concatenate((rest[:at], run, rest[at:]))
+
+                order = order[new_positions]
+                flipped = flipped[new_positions]
+                if reverse:
+                    flipped[at:at + length] = ~flipped[at:at + length]
+                entries, exits = _positions(starts, ends, order, flipped)
+                changed = True
+
+        return order, flipped, changed
+
+class TimedTourPlanner(TourPlanner):
+    """ TourPlanner that minimizes the time spent on rapids (as estimated from
+    the GRBL max rates and accelerations) instead of the distance travelled.
+    With the slower Y axis and short hops dominated by acceleration, the
+    quickest tour is not always the shortest one """
+
+    name = "timed"
+    units = "s"
+
+    def __init__(self, scale: float = 1.0, origin: tuple = (0.0, 0.0),
+                 time_budget: float = TIME_BUDGET, config: dict = robot_config):
+        super().__init__(scale, origin, time_budget)
+        self.config = config
+
+    def distance(self, dx, dy):
+        """ Time of a rapid by dx, dy grid units, starting and ending at rest
+        (see motion.move_time, the same estimate estimate_job_time uses) """
+
+        return move_time(dx * self.scale, dy * self.scale, 0, config=self.config)
+
+# planners selectable by name
+PLANNERS = {
+    ColumnSweepPlanner.name: ColumnSweepPlanner,
+    TourPlanner.name: TourPlanner,
+    TimedTourPlanner.name: TimedTourPlanner,
+}
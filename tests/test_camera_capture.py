@@ -0,0 +1,33 @@
+""" Tests that a restarted capture only ever hands out frames of the new run """
+
+# imports
+import os
+import sys
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.camera_capture import CameraCapture
+
+def _source(directory, width, height, value):
+    """ Image directory standing in for a camera, every frame filled with value """
+
+    os.makedirs(directory)
+    cv2.imwrite(os.path.join(directory, "frame.png"),
+                np.full((height, width, 3), value, dtype=np.uint8))
+    return str(directory)
+
+def test_restart_forgets_old_frames(tmp_path):
+    capture = CameraCapture(_source(tmp_path / "first", 64, 48, 10))
+    with capture:
+        assert capture.wait_for_frame()
+        assert capture.snapshot().shape == (48, 64, 3)
+
+    capture.source = _source(tmp_path / "second", 32, 32, 200)
+    with capture:
+        frame = capture.latest_frame()
+        assert frame is None or frame[0, 0, 0] == 200
+        assert capture.wait_for_frame()
+        frame = capture.snapshot()
+    assert frame.shape == (32, 32, 3)
+    assert (frame == 200).all()
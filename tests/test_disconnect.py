@@ -0,0 +1,133 @@
+""" Tests that a sender stops with an error instead of hanging when the port
+to GRBL drops or GRBL raises an alarm in the middle of a job """
+
+# imports
+import asyncio
+import os
+import queue
+import sys
+import threading
+import time
+import pytest
+import serial
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import grbl_controller
+from grbl_async import AsyncGrbl
+from benchmark_streaming import synthetic_job
+from grbl_simulator import GrblSimulator
+from grbl_stream import GrblAlarm, GrblStreamer
+
+# constants
+DROP_AFTER  = 0.5 # how long the job runs before the port drops (in s)
+GIVE_UP     = 10.0 # longest the sender may take to notice (in s)
+
+def _send_and_drop(streaming: bool):
+    """ Sends a long job to the simulator and stops the simulator halfway
+    returns:
+        error: what send_commands raised, None if it returned
+        alive: True if send_commands was still blocked after GIVE_UP
+    """
+    simulator = GrblSimulator(speed=5).start()
+    ser = serial.Serial(simulator.port, grbl_controller.BAUDRATE)
+    outcome = {}
+
+    def send():
+        try:
+            grbl_controller.send_commands(ser, synthetic_job(2000), streaming=streaming)
+        except Exception as error:
+            outcome["error"] = error
+
+    sender = threading.Thread(target=send, daemon=True)
+    sender.start()
+    time.sleep(DROP_AFTER)
+    simulator.stop()
+    sender.join(GIVE_UP)
+    ser.close()
+    return outcome.get("error"), sender.is_alive()
+
+@pytest.mark.parametrize("streaming", [True, False])
+def test_port_drop_raises(streaming):
+    error, alive = _send_and_drop(streaming)
+
+    assert not alive
+    assert isinstance(error, (serial.SerialException, OSError))
+
+def test_async_port_drop_raises():
+    simulator = GrblSimulator(speed=5).start()
+    ser = serial.Serial(simulator.port, grbl_controller.BAUDRATE)
+
+    async def send():
+        async with AsyncGrbl(ser) as grbl:
+            streaming = asyncio.ensure_future(grbl.stream(['$X'] + synthetic_job(2000)))
+            await asyncio.sleep(DROP_AFTER)
+            await asyncio.to_thread(simulator.stop)
+            await asyncio.wait_for(streaming, GIVE_UP)
+
+    with pytest.raises((serial.SerialException, OSError)) as error:
+        asyncio.run(send())
+    ser.close()
+    # still blocked after GIVE_UP (TimeoutError is an OSError too)
+    assert not isinstance(error.value, TimeoutError)
+
+def test_run_job_closes_session_and_keeps_journal(tmp_path):
+    from grbl_session import GrblSession
+    from job_journal import load_journal
+
+    journal_file = str(tmp_path / "job.journal")
+    commands = synthetic_job(2000)
+    simulator = GrblSimulator(speed=5).start()
+    session = GrblSession(simulator.port)
+    session.open()
+
+    runner = threading.Thread(
+        target=grbl_controller.run_job, args=(session, commands, journal_file),
+        daemon=True)
+    runner.start()
+    time.sleep(DROP_AFTER)
+    simulator.stop()
+    runner.join(GIVE_UP)
+
+    assert not runner.is_alive()
+    assert not session.is_open
+    journal = load_journal(journal_file)
+    assert journal is not None and not journal["done"]
+    assert 0 < len(journal["acked"]) < len(commands)
+
+class _Port:
+    """ Stand-in serial port that takes every write """
+
+    def write(self, data):
+        return len(data)
+
+def test_alarm_raises_grbl_alarm():
+    responses = queue.Queue()
+    for response in ('ok', 'ALARM:2'):
+        responses.put(response)
+    streamer = GrblStreamer(_Port(), responses=responses)
+
+    with pytest.raises(GrblAlarm) as alarm:
+        streamer.stream(['G0 X1', 'G0 X1000', 'G0 X2'])
+    assert alarm.value.code == 2
+
+def test_run_job_survives_alarm(tmp_path, monkeypatch):
+    from grbl_session import GrblSession
+    from job_journal import load_journal
+
+    def alarm(ser, commands, journal=None, **kwargs):
+        journal.record(0)
+        raise GrblAlarm('ALARM:1')
+
+    closed = []
+    session = GrblSession("unused")
+    monkeypatch.setattr(session, "ensure_open", lambda: _Port())
+    monkeypatch.setattr(session, "close", lambda: closed.append(True))
+    monkeypatch.setattr(grbl_controller, "send_commands", alarm)
+
+    journal_file = str(tmp_path / "job.journal")
+    grbl_controller.run_job(session, synthetic_job(10), journal_file)
+
+    assert closed
+    journal = load_journal(journal_file)
+    assert journal is not None and not journal["done"]
+    assert journal["acked"] == {0}
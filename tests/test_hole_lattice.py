@@ -0,0 +1,24 @@
+""" Tests that the hole lattice fit gives up on holes that cannot describe a
+grid instead of crashing """
+
+# imports
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.hole_lattice import fit_lattice
+
+# constants
+PITCH       = 10.0 # distance between holes (in pixels)
+
+def test_single_row_gives_none():
+    row = np.column_stack([np.arange(20) * PITCH, np.zeros(20)])
+    assert fit_lattice(row) is None
+    assert fit_lattice(row[:, ::-1]) is None # a single column
+
+def test_grid_is_fitted():
+    cols, rows = np.meshgrid(np.arange(6), np.arange(4))
+    lattice = fit_lattice(np.column_stack([cols.ravel(), rows.ravel()]) * PITCH)
+    assert (lattice.rows, lattice.cols) == (4, 6)
+    assert np.isclose(lattice.pitch, PITCH)
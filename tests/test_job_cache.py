@@ -0,0 +1,44 @@
+""" Tests that the job cache key changes with every setting that changes
+the compiled job """
+
+# imports
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import grbl_controller
+import zhop_planner
+from job_cache import JobCache
+from motion import move_time
+from path_planner import PLANNERS, TourPlanner
+from zhop_planner import ZHopPlanner
+
+# constants
+BOARD_FILE  = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           "board_data.json")
+
+def _key(zhop):
+    settings = grbl_controller.compile_settings(TourPlanner(), zhop)
+    return JobCache().key(BOARD_FILE, settings)
+
+def test_key_follows_zhop_settings(monkeypatch):
+    plain = _key(None)
+    zhop = _key(ZHopPlanner())
+    assert plain != zhop
+    assert _key(ZHopPlanner(short_hop=5.0)) != zhop
+
+    monkeypatch.setattr(zhop_planner, "CLEARANCE", 0.5)
+    assert _key(ZHopPlanner()) != zhop
+    monkeypatch.undo()
+    assert _key(ZHopPlanner()) == zhop
+    monkeypatch.setattr(zhop_planner, "ZHOP_VERSION", zhop_planner.ZHOP_VERSION + 1)
+    assert _key(ZHopPlanner()) != zhop
+
+def test_key_follows_planner():
+    keys = {JobCache().key(BOARD_FILE, grbl_controller.compile_settings(planner()))
+            for planner in PLANNERS.values()}
+    assert len(keys) == len(PLANNERS)
+
+def test_timed_tour_costs_rapids_with_move_time():
+    planner = PLANNERS["timed"](scale=2.0)
+    assert planner.distance(3, 4) == move_time(6.0, 8.0, 0)
@@ -0,0 +1,75 @@
+""" Tests that an interrupted job resumes homed, from a safe height and only
+on the board it was journaled for, and that a run with rejected lines stays
+resumable """
+
+# imports
+import os
+import sys
+import pytest
+import serial
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import grbl_controller
+from grbl_simulator import GrblSimulator
+from job_journal import JobJournal, load_journal, resume_commands
+
+# constants
+# two joints, the second reached by a Z-hop merged into the rapid
+COMMANDS        = ['G90', 'G28', 'F50',
+                   'G0 X2.5 Y0', 'G0 Z-1', 'G4 P5', 'M3 S160', 'G4 P3', 'M5',
+                   'G0 Z1',
+                   'G0 X55 Y0 Z-0.7', 'G0 Z-1', 'G4 P5', 'M3 S160', 'G4 P3', 'M5',
+                   'G0 Z1']
+FIRST_M5        = 8
+SECOND_RAPID    = 10
+
+def _interrupt(path, board):
+    """ Journals the job as if the link dropped after the first joint """
+
+    journal = JobJournal(path)
+    journal.start(COMMANDS, board)
+    for index in range(FIRST_M5 + 2):
+        journal.record(index)
+    journal.close()
+    return load_journal(path)
+
+def test_resume_rises_before_moving(tmp_path):
+    journal = _interrupt(str(tmp_path / "job.journal"), "board-1")
+    preamble, start = resume_commands(COMMANDS, journal, "board-1")
+
+    assert start == SECOND_RAPID
+    assert preamble[:3] == ['M5', 'G90', 'G28']
+    # travel height, then over the joint, then the job's own descent
+    assert preamble[-2:] == ['G0 Z1', 'G0 X55 Y0']
+    assert preamble.index('G0 Z1') < preamble.index('G0 X55 Y0')
+
+def test_resume_homes_when_asked(tmp_path):
+    journal = _interrupt(str(tmp_path / "job.journal"), None)
+    preamble, _ = resume_commands(COMMANDS, journal, homing=True)
+
+    # machine zero is found again before anything moves to it
+    assert preamble[:4] == ['M5', '$H', 'G90', 'G28']
+    assert '$H' not in resume_commands(COMMANDS, journal)[0]
+
+def test_resume_refuses_another_board(tmp_path):
+    journal = _interrupt(str(tmp_path / "job.journal"), "board-1")
+    assert journal["board"] == "board-1"
+    with pytest.raises(ValueError):
+        resume_commands(COMMANDS, journal, "board-2")
+    with pytest.raises(ValueError):
+        resume_commands(COMMANDS[:-1], journal, "board-1")
+
+@pytest.mark.parametrize("streaming", [True, False])
+def test_rejected_lines_leave_journal_unfinished(tmp_path, streaming):
+    path = str(tmp_path / "job.journal")
+    journal = JobJournal(path)
+    commands = ['G90', 'G0 X1 Y1', 'G99', 'G0 X2 Y2']
+    journal.start(commands)
+    with GrblSimulator() as simulator:
+        ser = serial.Serial(simulator.port, grbl_controller.BAUDRATE)
+        grbl_controller.send_commands(ser, commands, streaming=streaming,
+                                      journal=journal)
+        ser.close()
+    journal.close()
+
+    assert not load_journal(path)["done"]
@@ -0,0 +1,34 @@
+""" Tests that a panel is estimated as every board it solders plus the travel
+between them, not as a single board """
+
+# imports
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import grbl_controller
+from motion import estimate_job_time
+from panel import MAX_BOARDS, board_body, panel_job
+
+# constants
+SOLDER_LIST = [("point", [1, 1]), ("point", [3, 1]), ("line", [1, 4], [4, 4])]
+OFFSETS     = [(10, 20), (60, 20), (10, 80)]
+
+def test_panel_estimate_covers_every_board():
+    job = grbl_controller.compile_board(SOLDER_LIST)
+    board = estimate_job_time(job)
+    panel = estimate_job_time(panel_job(job, OFFSETS))
+
+    assert len(panel_job(job, OFFSETS)) == 3 * len(board_body(job)) + 2
+    # every joint is soldered on every board
+    assert panel["dwell"] == pytest.approx(3 * board["dwell"])
+    assert panel["drag"] == pytest.approx(3 * board["drag"])
+    # and the gantry travels out to the fixtures and between them
+    assert panel["travel"] > 3 * board["travel"]
+    assert panel["total"] > 3 * board["total"]
+
+def test_panel_job_refuses_too_many_boards():
+    job = grbl_controller.compile_board(SOLDER_LIST)
+    with pytest.raises(ValueError):
+        panel_job(job, [(0, 0)] * (MAX_BOARDS + 1))
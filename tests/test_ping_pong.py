@@ -0,0 +1,43 @@
+""" Tests that the wait-for-every-ok sender pairs each command with its own
+answer, and that the status monitor leaves the port as it found it """
+
+# imports
+import os
+import queue
+import sys
+import pytest
+import serial
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import grbl_controller
+from grbl_simulator import GrblSimulator
+from grbl_status import StatusMonitor
+from grbl_stream import GrblAlarm
+
+class _Monitor:
+    """ Stand-in StatusMonitor handing out canned lines """
+
+    def __init__(self, lines):
+        self.responses = queue.Queue()
+        for line in lines:
+            self.responses.put(line)
+
+    def check(self):
+        pass
+
+def test_messages_are_not_answers():
+    monitor = _Monitor(['[MSG:Caution: Unlocked]', 'Grbl 1.1h', 'ok', 'error:20'])
+    assert grbl_controller.wait_for_answer(monitor) == 'ok'
+    assert grbl_controller.wait_for_answer(monitor) == 'error:20'
+
+def test_alarm_raises():
+    with pytest.raises(GrblAlarm):
+        grbl_controller.wait_for_answer(_Monitor(['[MSG:Reset to continue]', 'ALARM:1']))
+
+def test_monitor_restores_timeout():
+    with GrblSimulator() as simulator:
+        ser = serial.Serial(simulator.port, grbl_controller.BAUDRATE, timeout=2.0)
+        with StatusMonitor(ser):
+            assert ser.timeout != 2.0
+        assert ser.timeout == 2.0
+        ser.close()
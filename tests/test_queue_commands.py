@@ -0,0 +1,30 @@
+""" Tests that the planner thread behind queue_commands stops when the
+sender stops early instead of blocking on a full queue forever """
+
+# imports
+import itertools
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import grbl_controller
+
+# constants
+GIVE_UP     = 5.0 # longest the planner may take to notice (in s)
+
+def test_keeps_order():
+    commands = [f'G0 X{index}' for index in range(1000)]
+    assert list(grbl_controller.queue_commands(iter(commands), maxsize=8)) == commands
+
+def test_planner_stops_when_sender_stops():
+    before = set(threading.enumerate())
+    planned = itertools.count()
+    commands = grbl_controller.queue_commands(
+        (f'G0 X{next(planned)}' for _ in itertools.count()), maxsize=8)
+    assert next(commands) == 'G0 X0'
+    planner, = set(threading.enumerate()) - before
+    commands.close() # the sender gave up, e.g. the port dropped
+
+    planner.join(GIVE_UP)
+    assert not planner.is_alive()
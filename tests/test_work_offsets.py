@@ -0,0 +1,90 @@
+""" Tests that work offsets are only written to GRBL's EEPROM when they
+change, and that nothing is streamed around an EEPROM write """
+
+# imports
+import asyncio
+import os
+import sys
+import serial
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from grbl_async import AsyncGrbl
+from grbl_settings import read_offsets
+from grbl_simulator import GrblSimulator
+from grbl_stream import GrblStreamer, is_eeprom_command
+from panel import work_offset_gcode
+
+# constants
+OFFSETS     = [(10, 20), (60, 20.5)]
+JOB         = ['$X', 'G90', 'G0 X1 Y1', 'G0 X2 Y2', 'G10 L2 P1 X5 Y5', 'G0 X3 Y3',
+               '$110=500', 'G28.1', 'G0 X4 Y4']
+
+def test_eeprom_commands():
+    assert is_eeprom_command('G10 L2 P1 X0 Y0')
+    assert is_eeprom_command('$110=500')
+    assert is_eeprom_command('G28.1')
+    assert not is_eeprom_command('G28')
+    assert not is_eeprom_command('G1 X10')
+
+def test_stream_empties_buffer_around_eeprom_writes():
+    with GrblSimulator() as simulator:
+        ser = serial.Serial(simulator.port, 115200, timeout=1)
+        streamer = GrblStreamer(ser)
+        in_flight = [] # (command, lines in flight when it was sent)
+        send = streamer.send
+
+        def record(command, index=None):
+            in_flight.append((command, len(streamer.pending)))
+            send(command, index)
+
+        streamer.send = record
+        assert streamer.stream(JOB) == []
+        ser.close()
+
+    for previous, (command, pending) in zip([None] + in_flight, in_flight):
+        if is_eeprom_command(command):
+            assert pending == 0
+        if previous is not None and is_eeprom_command(previous[0]):
+            assert pending == 0
+
+def test_async_stream_empties_buffer_around_eeprom_writes():
+    in_flight = [] # (command, lines in flight when it was sent)
+
+    async def stream(ser):
+        async with AsyncGrbl(ser) as grbl:
+            send = grbl.send
+
+            async def record(command):
+                in_flight.append((command, len(grbl._pending)))
+                return await send(command)
+
+            grbl.send = record
+            return await grbl.stream(JOB)
+
+    with GrblSimulator() as simulator:
+        ser = serial.Serial(simulator.port, 115200, timeout=1)
+        assert asyncio.run(stream(ser)) == []
+        ser.close()
+
+    for previous, (command, pending) in zip([None] + in_flight, in_flight):
+        if is_eeprom_command(command):
+            assert pending == 0
+        if previous is not None and is_eeprom_command(previous[0]):
+            assert pending == 0
+
+def test_unchanged_offsets_are_not_written():
+    with GrblSimulator() as simulator:
+        ser = serial.Serial(simulator.port, 115200, timeout=1)
+        streamer = GrblStreamer(ser)
+        streamer.stream(['$X']) # the simulator boots in alarm
+
+        setup = work_offset_gcode(OFFSETS, read_offsets(ser))
+        assert len(setup) == 2
+        assert streamer.stream(setup) == []
+
+        current = read_offsets(ser)
+        assert current[1] == (10, 20) and current[2] == (60, 20.5)
+        assert work_offset_gcode(OFFSETS, current) == []
+        # only the fixture that moved is written again
+        assert work_offset_gcode([(10, 20), (61, 20.5)], current) == ['G10 L2 P2 X61 Y20.5']
+        ser.close()
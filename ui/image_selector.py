@@ -12,16 +12,31 @@ from PyQt6.QtWidgets import (
     QWidget
 )
 from PyQt6.QtGui import QPixmap, QPainter, QPen, QColor, QImage
-from PyQt6.QtCore import Qt, pyqtSignal
+from PyQt6.QtCore import Qt, QTimer, pyqtSignal
 import cv2
+import numpy as np
+import os
 import sys
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # repo root, for core/
+from core.calibration import BoardCalibration, CalibrationCache
+from core.camera_capture import CameraCapture
+from core.image_loader import ImageLoader, LoadedImage
+from core.hole_lattice import detect_lattice
+
 PIXEL_TO_MM = 27.5 ## 2.54 mm hole spacing
+LENS_LEVEL_OVERSAMPLE = 2  # lens samples at most this many pyramid pixels per output pixel
+CAMERA_SOURCE = 0  # camera index, or a video file / image directory standing in for the camera
+CAMERA_ID = None  # name saved calibrations are kept under, defaults to CAMERA_SOURCE
+FIXTURE_ID = "fixture-1"  # fixture boards are placed in, change it when the fixture is swapped
+PREVIEW_INTERVAL = 33  # ms between live preview updates
 
 class ImageSelector(QGraphicsView):
     corners_selected_signal = pyqtSignal(list)
+    board_detected_signal = pyqtSignal(list, int, int, object)  # corners, rows, cols, BoardCalibration
+    image_loaded_signal = pyqtSignal(object)  # LoadedImage, from the loader thread
     
-    def __init__(self, scene, zoom_factor=4, lens_size=150):
+    def __init__(self, scene, zoom_factor=4, lens_size=150, camera=CAMERA_ID, fixture=FIXTURE_ID):
         super().__init__(scene)
         self.image_item = None
         self.corners = []
@@ -36,57 +51,162 @@ class ImageSelector(QGraphicsView):
         self.lens.setWindowFlags(Qt.WindowType.ToolTip)
         self.lens.resize(lens_size, lens_size)
 
+        # The lens is drawn into one preallocated buffer wrapped by a QImage,
+        # at most once per display refresh however fast the mouse reports
+        self.lens_buffer = np.zeros((lens_size, lens_size, 3), dtype=np.uint8)
+        self.lens_image = QImage(self.lens_buffer.data, lens_size, lens_size,
+                                 lens_size * 3, QImage.Format.Format_RGB888)
+        self.lens_timer = QTimer(self)
+        self.lens_timer.setSingleShot(True)
+        self.lens_timer.timeout.connect(self.update_lens)
+        self.lens_scene_pos = None
+        self.lens_global_pos = None
+
         self.cv_image = None  # store original image for magnifier
+        self.pyramid = []  # cv_image and its halved copies, sampled by the lens
+
+        # Images are decoded once, off the UI thread
+        self.loader = ImageLoader()
+        self.image_loaded_signal.connect(self.show_image)
+        self.lattice = None  # hole grid found in the image, if any
+
+        # Calibration is kept per camera and fixture, boards placed in the
+        # same fixture reuse it
+        self.camera = CAMERA_SOURCE if camera is None else camera
+        self.fixture = fixture
+        self.calibration_cache = CalibrationCache()
+        self.calibration = None
+        self.calibration_key = None  # camera the shown image is calibrated under
 
     def load_image(self, path):
-        pixmap = QPixmap(path)
-        self.image_item = QGraphicsPixmapItem(pixmap)
+        """Starts decoding path in the background, show_image runs once it is ready"""
+        self.loader.load(path, self.image_loaded_signal.emit)
+
+    def load_frame(self, frame):
+        """Loads an RGB frame grabbed from the camera (see core/camera_capture.py)"""
+        self.show_image(LoadedImage(frame))
+
+    def show_image(self, image):
+        if image is None:
+            return
+
+        # Qt and the magnifier share the decoded RGB buffer
+        height, width, _ = image.rgb.shape
+        qimage = QImage(image.rgb.data, width, height, image.rgb.strides[0], QImage.Format.Format_RGB888)
+        self.image_item = QGraphicsPixmapItem(QPixmap.fromImage(qimage))
         self.scene().clear()
         self.scene().addItem(self.image_item)
         self.corners = []
+        self.cv_image = image.rgb
+        self.pyramid = image.pyramid
+
+        # camera frames share the camera's calibration, a photo opened from
+        # a file was taken from anywhere so it gets its own
+        if image.digest is None:
+            self.calibration_key = f"{self.camera}@{width}x{height}"
+        else:
+            self.calibration_key = f"image-{image.digest}"
+
+        calibration = self.calibration_cache.get(self.calibration_key, self.fixture)
+        if calibration is not None:
+            print(f"Using saved calibration for {self.calibration_key}/{self.fixture}")
+            self.use_calibration(calibration)
+        else:
+            self.detect_board()
+
+    def recalibrate(self):
+        """Forgets the saved calibration (e.g. after the camera or fixture
+        was moved) and detects the board in the shown image again."""
+        if self.cv_image is None:
+            return
+        self.calibration_cache.remove(self.calibration_key, self.fixture)
+        self.calibration = None
+        self.corners = []
+        for item in self.scene().items():
+            if item is not self.image_item:
+                self.scene().removeItem(item)
+        self.detect_board()
+
+    def detect_board(self):
+        """Finds the hole grid so the corners do not have to be clicked.
+        Clicking four corners still works if nothing is found."""
+        self.lattice = detect_lattice(self.cv_image)
+        if self.lattice is None:
+            print("No hole grid found, select the four corners")
+            return None
+
+        print(f"Board detected: {self.lattice.rows} rows x {self.lattice.cols} cols, "
+              f"pitch {self.lattice.pitch:.1f} px")
+        self.save_calibration(BoardCalibration.from_lattice(self.lattice))
+        return self.lattice
+
+    def save_calibration(self, calibration):
+        self.calibration_cache.put(self.calibration_key, self.fixture, calibration)
+        self.use_calibration(calibration)
+
+    def use_calibration(self, calibration):
+        self.calibration = calibration
+        self.calibrated_corners = calibration.corners()
+        for x, y in self.calibrated_corners:
+            self.mark_point(x, y)
 
-        # Load image with OpenCV for magnifier
-        self.cv_image = cv2.cvtColor(cv2.imread(path), cv2.COLOR_BGR2RGB)
+        self.board_detected_signal.emit(self.calibrated_corners,
+                                        calibration.rows, calibration.cols, calibration)
+
+    def mark_point(self, x, y):
+        dot = QGraphicsEllipseItem(x - 4, y - 4, 8, 8)
+        dot.setPen(QPen(Qt.GlobalColor.red, 2))
+        dot.setBrush(QColor(255, 0, 0, 120))
+        self.scene().addItem(dot)
 
     def mouseMoveEvent(self, event):
         if self.cv_image is None:
             return
 
-        pos = self.mapToScene(event.position().toPoint())
-        x, y = int(pos.x()), int(pos.y())
-        h, w, _ = self.cv_image.shape
+        # Only remember where the mouse is, the lens is redrawn by the timer
+        self.lens_scene_pos = self.mapToScene(event.position().toPoint())
+        self.lens_global_pos = event.globalPosition().toPoint()
+        if not self.lens_timer.isActive():
+            refresh_rate = self.screen().refreshRate() or 60
+            self.lens_timer.start(int(1000 / refresh_rate))
 
-        # Get region around cursor
-        half = self.lens_size // (2 * self.zoom_factor)
-        x1 = max(0, x - half)
-        y1 = max(0, y - half)
-        x2 = min(w, x + half)
-        y2 = min(h, y + half)
+        super().mouseMoveEvent(event)
 
-        zoom_area = self.cv_image[y1:y2, x1:x2]
-        if zoom_area.size == 0:
+    def update_lens(self):
+        if self.lens_scene_pos is None or not self.pyramid:
             return
 
-        zoom_resized = cv2.resize(zoom_area, (self.lens_size, self.lens_size), interpolation=cv2.INTER_NEAREST)
+        # The lens magnifies zoom_factor times what is on screen. Sample the
+        # pyramid level closest to that, so the work per update depends on
+        # the lens size only, not on the image size or view zoom
+        source_per_pixel = 1 / (self.zoom_factor * self.transform().m11())
+        level = int(np.clip(np.floor(np.log2(max(source_per_pixel, 1) / LENS_LEVEL_OVERSAMPLE)) + 1,
+                            0, len(self.pyramid) - 1))
+        image = self.pyramid[level]
+        step = source_per_pixel / 2 ** level  # level pixels per lens pixel
 
-        # Draw crosshair in the zoomed image
-        cx = (x - x1) * self.zoom_factor
-        cy = (y - y1) * self.zoom_factor
-        cv2.line(zoom_resized, (int(cx), 0), (int(cx), self.lens_size - 1), (255, 0, 0), 1)
-        cv2.line(zoom_resized, (0, int(cy)), (self.lens_size - 1, int(cy)), (255, 0, 0), 1)
+        # lens pixel (u, v) -> level pixel, centred on the cursor
+        half = self.lens_size / 2
+        x = self.lens_scene_pos.x() / 2 ** level
+        y = self.lens_scene_pos.y() / 2 ** level
+        transform = np.float32([[step, 0, x - half * step], [0, step, y - half * step]])
+        cv2.warpAffine(image, transform, (self.lens_size, self.lens_size), dst=self.lens_buffer,
+                       flags=cv2.INTER_NEAREST | cv2.WARP_INVERSE_MAP,
+                       borderMode=cv2.BORDER_CONSTANT)
 
-        qimg_zoom = QImage(zoom_resized.data, zoom_resized.shape[1], zoom_resized.shape[0],
-                           zoom_resized.shape[1]*3, QImage.Format.Format_RGB888)
-        self.lens.setPixmap(QPixmap.fromImage(qimg_zoom))
+        # Draw crosshair in the zoomed image
+        center = self.lens_size // 2
+        cv2.line(self.lens_buffer, (center, 0), (center, self.lens_size - 1), (255, 0, 0), 1)
+        cv2.line(self.lens_buffer, (0, center), (self.lens_size - 1, center), (255, 0, 0), 1)
+        self.lens.setPixmap(QPixmap.fromImage(self.lens_image))
 
         # Move lens near cursor
-        self.lens.move(event.globalPosition().toPoint().x() + 20,
-                       event.globalPosition().toPoint().y() + 20)
+        self.lens.move(self.lens_global_pos.x() + 20, self.lens_global_pos.y() + 20)
         self.lens.show()
 
-        super().mouseMoveEvent(event)
-
     def leaveEvent(self, event):
+        self.lens_timer.stop()
+        self.lens_scene_pos = None
         self.lens.hide()
         super().leaveEvent(event)
 
@@ -94,10 +214,7 @@ class ImageSelector(QGraphicsView):
         if event.button() == Qt.MouseButton.LeftButton and self.image_item:
             point = self.mapToScene(event.pos())
             # Mark corner visually
-            dot = QGraphicsEllipseItem(point.x() - 4, point.y() - 4, 8, 8)
-            dot.setPen(QPen(Qt.GlobalColor.red, 2))
-            dot.setBrush(QColor(255, 0, 0, 120))
-            self.scene().addItem(dot)
+            self.mark_point(point.x(), point.y())
             self.corners.append((point.x(), point.y()))
             print(f"Corner {len(self.corners)}: ({point.x():.1f}, {point.y():.1f})")
 
@@ -105,17 +222,21 @@ class ImageSelector(QGraphicsView):
                 print("Four corners selected!")
                 self.calibrate_corners()
                 self.corners_selected_signal.emit(self.calibrated_corners)
+                self.corners = []
 
         super().mousePressEvent(event)
 
     def calibrate_corners(self):
         # Assume user selects roughly: top-left, top-right, bottom-right, bottom-left
-        left_x =  (self.corners[0][0] + self.corners[3][0]) / 2
-        right_x = (self.corners[1][0] + self.corners[2][0]) / 2
-        upper_y = (self.corners[0][1] + self.corners[1][1]) / 2
-        lower_y = (self.corners[2][1] + self.corners[3][1]) / 2
+        # hole centres. The board may be skewed, so the corners are kept as
+        # clicked and mapped through a homography
+        corners = np.array(self.corners)
+        width = (np.linalg.norm(corners[1] - corners[0]) + np.linalg.norm(corners[2] - corners[3])) / 2
+        height = (np.linalg.norm(corners[3] - corners[0]) + np.linalg.norm(corners[2] - corners[1])) / 2
+        rows = round(height / PIXEL_TO_MM) + 1
+        cols = round(width / PIXEL_TO_MM) + 1
 
-        self.calibrated_corners = [[left_x, upper_y], [right_x, upper_y], [right_x, lower_y], [left_x, lower_y]]
+        self.save_calibration(BoardCalibration.from_corners(self.corners, rows, cols))
         return self.calibrated_corners
 
 class ImageSelectorWindow(QMainWindow):
@@ -133,23 +254,75 @@ class ImageSelectorWindow(QMainWindow):
         self.view = ImageSelector(scene)
         layout.addWidget(self.view)
 
+        # Live camera preview, shown until a frame is captured
+        self.capture = CameraCapture(CAMERA_SOURCE)
+        self.preview = QLabel()
+        self.preview.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.preview.hide()
+        layout.addWidget(self.preview, stretch=1)
+
+        self.preview_timer = QTimer(self)
+        self.preview_timer.setInterval(PREVIEW_INTERVAL)
+        self.preview_timer.timeout.connect(self.update_preview)
+
+        self.capture_button = QPushButton("Capture")
+        self.capture_button.clicked.connect(self.capture_frame)
+        self.capture_button.hide()
+        layout.addWidget(self.capture_button)
+
+        self.recalibrate_button = QPushButton("Recalibrate")
+        self.recalibrate_button.clicked.connect(self.view.recalibrate)
+        layout.addWidget(self.recalibrate_button)
+
         self.ok_button = QPushButton("Close")
         self.ok_button.clicked.connect(self.close_window)
         layout.addWidget(self.ok_button)
 
     def get_image(self):
-        # Load an image file at startup
+        # Preview the camera if there is one, otherwise pick an image file
+        if self.capture.start():
+            self.view.hide()
+            self.preview.show()
+            self.capture_button.show()
+            self.preview_timer.start()
+            return
+
         img_path, _ = QFileDialog.getOpenFileName(
             self, "Select an image", "", "Images (*.png *.jpg *.jpeg)"
         )
-        # TODO: Delete hardcode
-        img_path = r"C:\Users\piram\Desktop\igen430\data\test_images\nov2.jpg"
         if img_path:
             self.view.load_image(img_path)
 
+    def update_preview(self):
+        # The QImage wraps the capture buffer, only the pixmap is a copy
+        qimage = self.capture.latest_qimage()
+        if qimage is None:
+            return
+        pixmap = QPixmap.fromImage(qimage)
+        self.preview.setPixmap(pixmap.scaled(self.preview.size(), Qt.AspectRatioMode.KeepAspectRatio))
+
+    def capture_frame(self):
+        frame = self.capture.snapshot()
+        if frame is None:
+            print("No frame from the camera yet")
+            return
+
+        self.stop_preview()
+        self.view.show()
+        self.view.load_frame(frame)
+
+    def stop_preview(self):
+        self.preview_timer.stop()
+        self.capture.stop()
+        self.preview.hide()
+        self.capture_button.hide()
+
     def close_window(self):
         self.close()
 
+    def closeEvent(self, event):
+        self.stop_preview()
+        super().closeEvent(event)
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
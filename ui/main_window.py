@@ -33,14 +33,18 @@ class MainWindow(QMainWindow):
         lines: list of tuples of start/end points: [((x1,y1),(x2,y2)), ...]
         """
 
+        if self.board_tab.scene.calibration is None:
+            print("No board yet, take an image of the board first")
+            return
+
         corners = self.board_tab.scene.corner_points
         points = self.board_tab.scene.points
         start_lines = self.board_tab.scene.start_lines
         end_lines = self.board_tab.scene.end_lines
 
-        points_index = [list(self.calculate_hole_number(x=x, y=y)) for x, y in points]
-        start_lines_index = [list(self.calculate_hole_number(x=x, y=y)) for x, y in start_lines]
-        end_lines_index = [list(self.calculate_hole_number(x=x, y=y)) for x, y in end_lines]
+        points_index = self.calculate_hole_numbers(points)
+        start_lines_index = self.calculate_hole_numbers(start_lines)
+        end_lines_index = self.calculate_hole_numbers(end_lines)
         lines_index = zip(start_lines_index, end_lines_index)
         
         data = {
@@ -60,11 +64,14 @@ class MainWindow(QMainWindow):
 
         print(f"{filename} saved successfully!")
 
-    def calculate_hole_number(self, x, y):
-        x_num = int((x - 3) / 20) + 1
-        y_num = int((y -3) / 20) + 1
-
-        return x_num, y_num
+    def calculate_hole_numbers(self, points):
+        """
+        Hole numbers [x, y] (1-based) of scene points, mapped through the
+        calibration of the image the board was detected in (see
+        ProtoBoardScene.hole_numbers). Empty if no board has been drawn.
+        """
+        numbers = self.board_tab.scene.hole_numbers(points)
+        return [] if numbers is None else numbers
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
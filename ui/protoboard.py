@@ -5,8 +5,15 @@ from PyQt6.QtWidgets import (
     QGraphicsItem,
     QGraphicsLineItem,
 )
-from PyQt6.QtGui import QPen, QColor, QBrush, QPixmap
-from PyQt6.QtCore import Qt
+from PyQt6.QtGui import QPen, QColor, QBrush, QPixmap, QImage
+from PyQt6.QtCore import Qt, pyqtSignal
+import numpy as np
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # repo root, for core/
+from core.calibration import BoardCalibration
+from core.image_loader import ImageLoader
 
 PIXEL_TO_MM = 27.5  ## 2.54 mm hole spacing
 SPACING = 18
@@ -16,6 +23,7 @@ class ProtoBoardScene(QGraphicsScene):
     """
     Class for visualizing the protoboard
     """
+    background_loaded_signal = pyqtSignal(object)  # LoadedImage, from the loader thread
 
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -25,6 +33,15 @@ class ProtoBoardScene(QGraphicsScene):
         self.hole_radius = 3
         self.corner_points = [[]]
         self.image_item = None
+        self.calibration = None  # image pixel -> hole number
+        self.pixel_origin = np.zeros(2)  # image pixel at scene (0, 0)
+        self.pixel_scale = 1.0  # scene units per image pixel
+        self.background_opacity = 1
+
+        # Background images are decoded once, off the UI thread, and shared
+        # with the image selector through the image cache
+        self.loader = ImageLoader()
+        self.background_loaded_signal.connect(self.show_background)
 
         self.holes = []
         self.solder_holes = []
@@ -35,36 +52,41 @@ class ProtoBoardScene(QGraphicsScene):
         image_path=r"C:\Users\piram\Desktop\igen430\data\test_images\nov2.jpg",
         opacity=1,
     ):
-        self.clear()
+        """Load and display background image (decoded in the background)."""
+        self.background_opacity = opacity
+        self.loader.load(image_path, self.background_loaded_signal.emit)
 
-        """Load and display background image."""
-
-        pixmap = QPixmap(image_path)
-        if pixmap.isNull():
-            print("Failed to load image:", image_path)
+    def show_background(self, image):
+        if image is None:
             return
+        self.clear()
 
         max_width = 500
         max_height = 400
 
-        pixmap = pixmap.scaled(
-            max_width,
-            max_height,
-            Qt.AspectRatioMode.KeepAspectRatio,
-            Qt.TransformationMode.SmoothTransformation,
-        )
+        # scaled down from the closest pyramid level rather than full size
+        rgb = image.fit(max_width, max_height)
+        qimage = QImage(rgb.data, rgb.shape[1], rgb.shape[0], rgb.strides[0], QImage.Format.Format_RGB888)
+        pixmap = QPixmap.fromImage(qimage)
 
         self.image_item = QGraphicsPixmapItem(pixmap)
         self.image_item.setFlags(
             QGraphicsItem.GraphicsItemFlag.ItemIsMovable  # allow dragging
             | QGraphicsItem.GraphicsItemFlag.ItemIsSelectable
         )
-        self.image_item.setOpacity(opacity)  # semi-transparent
+        self.image_item.setOpacity(self.background_opacity)  # semi-transparent
         self.image_item.setZValue(0)  # background layer
         self.addItem(self.image_item)
 
-    def draw_board(self, corners=None):
+    def draw_board(self, corners=None, rows=None, cols=None, calibration=None):
+        """
+        Draws the board's holes. With the image's calibration the holes are
+        drawn where they are in the photo (scaled to hole_spacing), so a
+        skewed board is drawn skewed and hole numbers come from the photo's
+        homography. Without one, an evenly spaced grid is drawn.
+        """
         self.clear()
+        self.holes = []
 
         if corners:
             self.corner_points = corners
@@ -73,27 +95,64 @@ class ProtoBoardScene(QGraphicsScene):
             print("No corners!!")
             return
 
-        self.row, self.col = self.calculate_rows_cols()
+        # a detected hole grid knows its size, clicked corners are measured
+        if calibration is not None:
+            self.row, self.col = calibration.rows, calibration.cols
+        elif rows and cols:
+            self.row, self.col = rows, cols
+        else:
+            self.row, self.col = self.calculate_rows_cols()
+
+        hole_cols, hole_rows = np.meshgrid(np.arange(self.col), np.arange(self.row))
+        grid = np.column_stack([hole_cols.ravel(), hole_rows.ravel()])
+        if calibration is not None:
+            # photo pixels of every hole, scaled so holes are hole_spacing apart
+            pixels = calibration.to_pixels(grid)
+            pitch = np.linalg.norm(calibration.to_pixels([[1, 0]]) - calibration.to_pixels([[0, 0]]))
+            self.pixel_origin = pixels.min(axis=0)
+            self.pixel_scale = self.hole_spacing / pitch
+            positions = (pixels - self.pixel_origin) * self.pixel_scale
+            self.calibration = calibration
+        else:
+            positions = grid * self.hole_spacing
+            self.pixel_origin = np.zeros(2)
+            self.pixel_scale = 1.0
+            # the grid is drawn evenly spaced, so its corner holes calibrate it
+            self.calibration = None
+            if self.row > 1 and self.col > 1:
+                last_x, last_y = positions[-1]
+                self.calibration = BoardCalibration.from_corners(
+                    [[0, 0], [last_x, 0], [last_x, last_y], [0, last_y]], self.row, self.col)
+
+        for x, y in positions:
+            hole = QGraphicsEllipseItem(
+                x - 2 * self.hole_radius,
+                y - 2 * self.hole_radius,
+                4 * self.hole_radius,
+                4 * self.hole_radius,
+            )
+
+            hole.setPen(QPen(Qt.GlobalColor.black, 1.2))
+            no_brush = QBrush(Qt.BrushStyle.NoBrush)
+            hole.setBrush(no_brush)
+            hole.setZValue(1)
+            self.addItem(hole)
 
-        # Draw a simple rectangular grid for now
-        for i in range(self.row):
-            for j in range(self.col):
-                x = j * self.hole_spacing
-                y = i * self.hole_spacing
-                hole = QGraphicsEllipseItem(
-                    x - self.hole_radius,
-                    y - self.hole_radius,
-                    4 * self.hole_radius,
-                    4 * self.hole_radius,
-                )
+            self.holes.append([float(x), float(y)])
 
-                hole.setPen(QPen(Qt.GlobalColor.black, 1.2))
-                no_brush = QBrush(Qt.BrushStyle.NoBrush)
-                hole.setBrush(no_brush)
-                hole.setZValue(1)
-                self.addItem(hole)
+    def hole_numbers(self, points):
+        """
+        Hole numbers [x, y] (1-based) of scene points, all mapped in one call
+        through the board's calibration.
 
-                self.holes.append([hole.rect().center().x(), hole.rect().center().y()])
+        Returns:
+            numbers (list): One [x, y] per point, or None if no board has
+                been drawn yet.
+        """
+        if self.calibration is None:
+            return None
+        pixels = np.asarray(points, dtype=float).reshape(-1, 2) / self.pixel_scale + self.pixel_origin
+        return self.calibration.hole_numbers(pixels).tolist()
 
     def calculate_rows_cols(self):
 
@@ -188,12 +247,10 @@ class ProtoBoardSceneWithLines(ProtoBoardScene):
 
 
     def find_closest_hole(self, x_point, y_point):
-        grid_xs = sorted(set(x for x, y in self.holes))
-        grid_ys = sorted(set(y for x, y in self.holes))
-        
-        # Find nearest x
-        nearest_x = min(grid_xs, key=lambda x: abs(x - x_point))
-        nearest_y = min(grid_ys, key=lambda y: abs(y - y_point))
-        
-        return nearest_x, nearest_y
+        # nearest hole in both axes at once, a calibrated board's rows and
+        # columns need not line up with the scene axes
+        holes = np.asarray(self.holes)
+        nearest = np.argmin(np.hypot(holes[:, 0] - x_point, holes[:, 1] - y_point))
+
+        return tuple(holes[nearest])
 
@@ -72,7 +72,7 @@ class BoardViewTab(QWidget):
         
         # SIGNALS 
         self.take_image.clicked.connect(self.load_image)
-        self.image_select_window.view.corners_selected_signal.connect(self.draw_board)
+        self.image_select_window.view.board_detected_signal.connect(self.draw_board)
         # self.add_solder_group.use_image_button.clicked.connect(self.on_image_button)
         # self.add_solder_group.use_image_done_button.clicked.connect(self.on_image_done_button)
         self.add_solder_group.add_line_button.clicked.connect(self.change_line_mode)
@@ -82,8 +82,8 @@ class BoardViewTab(QWidget):
         self.image_select_window.get_image()
         self.image_select_window.show()
 
-    def draw_board(self, corners=None):
-        self.scene.draw_board(corners)
+    def draw_board(self, corners=None, rows=None, cols=None, calibration=None):
+        self.scene.draw_board(corners, rows, cols, calibration)
 
     def on_image_button(self, clicked):
         self.scene.load_background()
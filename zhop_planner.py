@@ -0,0 +1,244 @@
+""" This Python module decides how high the end effector hops between joints,
+based on the solder already on the board and the components sitting on it """
+
+# imports
+import numpy as np
+from gcodewriter import (OP_RAPID, OP_LINEAR, OP_PLUNGE, OP_DISPENSE_ON,
+                         OP_DISPENSE_OFF, OP_ARC_CW, OP_ARC_CCW)
+from job_compiler import Job
+from motion import move_time
+from old_330_code.config import robot_config
+
+# constants (all in mm)
+SOLDER_HEIGHT   = 0.5   # height of a finished joint above the pad
+SOLDER_RADIUS   = 0.8   # radius of a finished joint
+TIP_RADIUS      = 0.3   # radius of the soldering tip
+CLEARANCE       = 0.3   # gap kept between the tip and anything below it
+SHORT_HOP       = 3.0   # hops up to this long skip the full travel height
+ZHOP_VERSION    = 1     # bump whenever hop planning changes the jobs produced
+
+############################## Helper Functions ###############################
+def _crossings(start, end, centres, radius):
+    """ Finds the discs (e.g. solder joints) that a straight move passes over
+    parameters:
+        start, end: x, y of the move
+        centres: (n, 2) array of disc centres
+        radius: distance from a centre at which the tip touches the disc
+    returns:
+        crossed: True for every disc the move passes over
+        leave: fraction of the move at which the tip is clear of each disc
+    """
+    direction = end - start
+    length_sq = float(direction @ direction)
+    offset = centres - start
+
+    if length_sq == 0:
+        inside = np.einsum("ij,ij->i", offset, offset) <= radius ** 2
+        return inside, np.ones(len(centres))
+
+    along = offset @ direction / length_sq
+    closest_sq = np.einsum("ij,ij->i", offset, offset) - along ** 2 * length_sq
+    half_chord = np.sqrt(np.maximum(radius ** 2 - closest_sq, 0) / length_sq)
+
+    crossed = ((closest_sq <= radius ** 2) & (along + half_chord >= 0)
+               & (along - half_chord <= 1))
+    return crossed, np.clip(along + half_chord, 0, 1)
+
+def _box_crossings(start, end, boxes, margin):
+    """ Finds the rectangular footprints (e.g. components) that a straight
+    move passes over, using Liang-Barsky clipping
+    parameters:
+        start, end: x, y of the move
+        boxes: (n, 4) array of x0, y0, x1, y1 footprints
+        margin: how far outside a footprint the tip still touches it
+    returns:
+        crossed: True for every footprint the move passes over
+        leave: fraction of the move at which the tip is clear of each one
+    """
+    lower = boxes[:, :2] - margin
+    upper = boxes[:, 2:] + margin
+    direction = end - start
+
+    enter = np.zeros(len(boxes))
+    leave = np.ones(len(boxes))
+    crossed = np.ones(len(boxes), dtype=bool)
+
+    for axis in range(2):
+        if direction[axis] == 0:
+            crossed &= ((lower[:, axis] <= start[axis])
+                        & (start[axis] <= upper[:, axis]))
+            continue
+
+        t_lower = (lower[:, axis] - start[axis]) / direction[axis]
+        t_upper = (upper[:, axis] - start[axis]) / direction[axis]
+        enter = np.maximum(enter, np.minimum(t_lower, t_upper))
+        leave = np.minimum(leave, np.maximum(t_lower, t_upper))
+
+    return crossed & (enter <= leave), leave
+
+def solder_deposits(job: Job):
+    """ Works out where a job leaves solder behind
+    parameters:
+        job: compiled job
+    returns:
+        centres: (n, 2) array of points covered by solder, lines are sampled
+                    every SOLDER_RADIUS (arcs along their chord, fillets are
+                    much smaller than a joint)
+        done: index of the op after which each point is soldered
+    """
+    centres = []
+    done = []
+    position = None
+    dispensing = False
+
+    for index, (op, x, y) in enumerate(zip(job.ops["op"].tolist(),
+                                           job.ops["x"].tolist(),
+                                           job.ops["y"].tolist())):
+        if op in (OP_RAPID, OP_LINEAR, OP_ARC_CW, OP_ARC_CCW) and not np.isnan(x):
+            if dispensing and op != OP_RAPID:
+                steps = int(np.hypot(x - position[0], y - position[1])
+                            // SOLDER_RADIUS) + 1
+                for t in np.arange(1, steps + 1) / steps:
+                    pending.append((position[0] + (x - position[0]) * t,
+                                    position[1] + (y - position[1]) * t))
+            position = (x, y)
+        elif op == OP_DISPENSE_ON:
+            dispensing = True
+            pending = [position]
+        elif op == OP_DISPENSE_OFF and dispensing:
+            dispensing = False
+            centres.extend(pending)
+            done.extend([index] * len(pending))
+
+    return np.array(centres, dtype=float).reshape(-1, 2), np.array(done, dtype=int)
+
+################################## Planner ####################################
+class ZHopPlanner:
+    """ Rewrites the lift, rapid and plunge between joints of a compiled job
+    so each hop only climbs as high as it needs to:
+        - short hops (up to short_hop mm) travel just above the tallest solder
+            joint or component under their path instead of at the job's
+            travel height
+        - long hops keep the travel height, or go higher if a component under
+            the path is taller
+        - when the descent onto the next joint cannot hit anything, it is
+            merged into the rapid (G0 X Y Z) down to just above the board,
+            leaving only a short final plunge
+    The lift off a fresh joint always stays vertical so it is not smeared """
+
+    def __init__(self, components: list = (), short_hop: float = SHORT_HOP,
+                 config: dict = robot_config):
+        """ parameters:
+            components: (x0, y0, x1, y1, height) footprints in mm of the
+                        components already on the board
+            short_hop: longest hop (in mm) allowed below the travel height
+            config: GRBL config used to estimate the time saved
+        """
+        self.components = np.array(components, dtype=float).reshape(-1, 5)
+        self.short_hop = short_hop
+        self.config = config
+        self.stats = {}
+
+    def settings(self) -> dict:
+        """ Everything that changes the hops planned (besides the board's own
+        components), used to key the job cache """
+
+        return {"version": ZHOP_VERSION, "short_hop": self.short_hop,
+                "solder_height": SOLDER_HEIGHT, "solder_radius": SOLDER_RADIUS,
+                "tip_radius": TIP_RADIUS, "clearance": CLEARANCE}
+
+    def hops(self, job: Job):
+        """ Indices of the rapids that hop from one joint to the next, i.e.
+        that sit between a lift and a plunge """
+
+        op = job.ops["op"]
+        rapid = np.flatnonzero(op[1:-1] == OP_RAPID) + 1
+        return rapid[(op[rapid - 1] == OP_PLUNGE) & (op[rapid + 1] == OP_PLUNGE)
+                     & ~np.isnan(job.ops["z"][rapid - 1])]
+
+    def plan(self, job: Job) -> Job:
+        """ Returns a copy of job with the hop heights rewritten """
+
+        ops = job.ops.copy()
+        hops = self.hops(job)
+
+        # position before every op, carried forward from the last xy move
+        moves = np.flatnonzero(~np.isnan(ops["x"]))
+        last_move = moves[np.searchsorted(moves, hops) - 1]
+        starts = np.stack((ops["x"][last_move], ops["y"][last_move]), axis=1)
+        ends = np.stack((ops["x"][hops], ops["y"][hops]), axis=1)
+
+        travel = ops["z"][hops - 1].copy()
+        work = ops["z"][hops + 1].copy()
+        centres, done = solder_deposits(job)
+
+        reduced = 0
+        merged = 0
+        for k, (hop, start, end) in enumerate(zip(hops, starts, ends)):
+            on_board = centres[:np.searchsorted(done, hop)]
+            solder, solder_leave = _crossings(start, end, on_board,
+                                              SOLDER_RADIUS + TIP_RADIUS)
+            parts, parts_leave = _box_crossings(start, end, self.components[:, :4],
+                                                TIP_RADIUS)
+
+            heights = np.concatenate((np.full(solder.sum(), SOLDER_HEIGHT),
+                                      self.components[parts, 4]))
+            leave = np.concatenate((solder_leave[solder], parts_leave[parts]))
+            needed = work[k] + heights.max(initial=0) + CLEARANCE
+
+            if np.hypot(*(end - start)) <= self.short_hop:
+                hop_z = needed
+            else:
+                hop_z = max(needed, travel[k])
+            reduced += hop_z < travel[k]
+            ops["z"][hop - 1] = hop_z
+
+            # descend along the rapid to just above the board, as long as the
+            # tip stays above everything it passes over on the way down
+            approach = work[k] + CLEARANCE
+            tip = hop_z + (approach - hop_z) * leave
+            if np.all(tip >= work[k] + heights + CLEARANCE) and hop_z > approach:
+                ops["z"][hop] = approach
+                merged += 1
+
+        new_job = Job(ops)
+        self._record(job, new_job, hops, starts, ends, reduced, merged)
+        return new_job
+
+    def report(self) -> str:
+        """ Human readable summary of the last call to plan """
+
+        if not self.stats:
+            return "z hops: nothing planned"
+
+        return (f"z hops: {self.stats['reduced']} of {self.stats['hops']} "
+                f"hops below travel height, {self.stats['merged']} descents "
+                f"merged into rapids, Z travel {self.stats['z_before']:.1f} -> "
+                f"{self.stats['z_after']:.1f} mm, "
+                f"{self.stats['time_saved']:.1f} s saved")
+
+    def _record(self, job, new_job, hops, starts, ends, reduced, merged):
+        """ Records how much Z travel and time the new hops save """
+
+        dx, dy = (ends - starts).T
+        work = job.ops["z"][hops + 1]
+
+        totals = []
+        for ops in (job.ops, new_job.ops):
+            lift = ops["z"][hops - 1] - work
+            descent = np.nan_to_num(ops["z"][hops] - ops["z"][hops - 1])
+            plunge = lift + descent
+            time = (move_time(0, 0, lift, config=self.config)
+                    + move_time(dx, dy, descent, config=self.config)
+                    + move_time(0, 0, plunge, config=self.config))
+            distance = np.abs(lift) + np.abs(descent) + np.abs(plunge)
+            totals.append((float(time.sum()), float(distance.sum())))
+
+        self.stats = {
+            "hops": len(hops),
+            "reduced": int(reduced),
+            "merged": merged,
+            "z_before": totals[0][1],
+            "z_after": totals[1][1],
+            "time_saved": totals[0][0] - totals[1][0],
+        }